@@ -0,0 +1,324 @@
+"""数据获取、缓存和分析热点路径的性能基准测试
+
+网络相关的测试全部请求进程内启动的替身服务器（src/stub_server.py），净值数据为固定随机种子生成的合成序列，
+结果可以复现。每次运行的结果保存到benchmarks/results/latest.json，--save-baseline保存为基线，
+之后的运行会与基线比较，耗时超过基线threshold倍的项目标记为性能回退。
+有测试出错时以非零状态退出且不保存基线；基线只能在requirements.txt固定的pandas/numpy版本下保存。
+
+用法：
+    python benchmarks/run_benchmarks.py                  # 运行全部测试并与基线比较
+    python benchmarks/run_benchmarks.py --quick          # 只测试1k/10k规模，轮数更少
+    python benchmarks/run_benchmarks.py --only analysis  # 只运行某一组测试
+    python benchmarks/run_benchmarks.py --save-baseline  # 保存为新的基线
+"""
+import sys
+import os
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import argparse
+import json
+import platform
+import shutil
+import statistics
+import tempfile
+import time
+import warnings
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+
+from src import fund_data
+from src import fund_analysis
+from src.stub_server import StubServer
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+BASELINE_FILE = os.path.join(BENCH_DIR, "baseline.json")
+RESULTS_FILE = os.path.join(BENCH_DIR, "results", "latest.json")
+
+SIZES = (1000, 10000, 100000)
+QUICK_SIZES = (1000, 10000)
+DEFAULT_THRESHOLD = 1.3     # 耗时超过基线的倍数时视为性能回退
+GROUPS = ('analysis', 'cache', 'parse', 'fetch')
+REQUIREMENTS_FILE = os.path.join(os.path.dirname(BENCH_DIR), "requirements.txt")
+PINNED_PACKAGES = {'pandas': pd, 'numpy': np}   # 基线必须在这些包的固定版本下生成
+
+
+def synthetic_nav_frame(n, seed=0, with_acc_nav=True, end=None):
+    """生成n个交易日的合成净值数据（几何随机游走），日期为截止end的工作日"""
+    rng = np.random.default_rng(seed)
+    if end is None:
+        # 10万个工作日约380年，从1700年开始以保证日期在pandas支持的范围内；
+        # 用numpy按工作日偏移生成，pandas 1.5的bdate_range生成这么长的范围时会溢出
+        dates = pd.DatetimeIndex(np.busday_offset('1700-01-01', np.arange(n), roll='forward').astype('datetime64[ns]'))
+    else:
+        dates = pd.bdate_range(end=end, periods=n)
+    nav = np.round(np.exp(np.cumsum(rng.normal(0.0003, 0.012, n))), 4)
+    df = pd.DataFrame({'date': dates, 'nav': nav})
+    if with_acc_nav:
+        df['acc_nav'] = np.round(nav + 0.1, 4)
+    return df
+
+
+def measure(func, setup=None, rounds=None, min_time=0.3, max_rounds=50):
+    """多次运行func并返回耗时统计（毫秒），setup在每轮之前运行且不计入耗时"""
+    timings = []
+    start = time.perf_counter()
+    while True:
+        if setup is not None:
+            setup()
+        t0 = time.perf_counter()
+        func()
+        timings.append((time.perf_counter() - t0) * 1000)
+        if rounds is not None:
+            if len(timings) >= rounds:
+                break
+        elif len(timings) >= max_rounds or (time.perf_counter() - start >= min_time and len(timings) >= 3):
+            break
+    return {
+        'median_ms': statistics.median(timings),
+        'min_ms': min(timings),
+        'rounds': len(timings)
+    }
+
+
+def bench_analysis(sizes, results):
+    """src/fund_analysis.py中的所有函数，以及基金分析页面的数据准备"""
+    for n in sizes:
+        df = synthetic_nav_frame(n)
+        nav = df['nav']
+        dated_nav = df.set_index('date')['nav']
+        start_date, end_date = df['date'].iloc[0], df['date'].iloc[-1]
+        range_index = fund_analysis.NavRangeIndex(df['date'], df['nav'])
+        cases = {
+            'calculate_max_drawdown': lambda: fund_analysis.calculate_max_drawdown(nav),
+            'calculate_volatility': lambda: fund_analysis.calculate_volatility(nav),
+            'calculate_sharpe_ratio': lambda: fund_analysis.calculate_sharpe_ratio(nav),
+            'calculate_annual_return': lambda: fund_analysis.calculate_annual_return(dated_nav),
+            'calculate_period_returns': lambda: fund_analysis.calculate_period_returns(df),
+            'calculate_return_distribution': lambda: fund_analysis.calculate_return_distribution(nav),
+            'analyze': lambda: fund_analysis.analyze(nav, df['date']),
+            'calculate_fund_summary': lambda: fund_analysis.calculate_fund_summary(df),
+            'calculate_period_metrics': lambda: fund_analysis.calculate_period_metrics(df, start_date, end_date),
+            'DrawdownTree.max_drawdown': lambda: range_index.drawdown_tree.max_drawdown(0, n - 1),
+            'NavRangeIndex.build': lambda: fund_analysis.NavRangeIndex(df['date'], df['nav']),
+            'calculate_period_metrics_from_index': lambda: fund_analysis.calculate_period_metrics_from_index(
+                range_index, start_date, end_date),
+        }
+        for name, func in cases.items():
+            try:
+                results[f"analysis.{name}[{n}]"] = measure(func)
+            except Exception as e:
+                # 依赖的pandas版本与requirements.txt不一致时个别函数可能无法运行，记录错误后继续
+                results[f"analysis.{name}[{n}]"] = {'error': str(e)}
+
+
+def bench_batch(results, funds=500, days=2500):
+    """多只基金的批量指标计算：对齐后的矩阵运算与逐只调用analyze()的对比"""
+    frames = {f"{i:06d}": synthetic_nav_frame(days - i, seed=i, end='2025-06-30') for i in range(funds)}
+    dates, codes, matrix = fund_analysis.align_nav_frames(frames)
+    label = f"{funds}x{days}"
+    results[f"analysis.align_nav_frames[{label}]"] = measure(lambda: fund_analysis.align_nav_frames(frames))
+    results[f"analysis.analyze_matrix[{label}]"] = measure(lambda: fund_analysis.analyze_matrix(matrix, dates, codes))
+    results[f"analysis.analyze_loop[{label}]"] = measure(
+        lambda: [fund_analysis.analyze(df['nav'], df['date']) for df in frames.values()], rounds=3)
+
+
+def bench_cache(sizes, results):
+    """二进制缓存文件的保存、完整读取（进程内缓存命中/未命中）、按日期范围读取、读取指标状态和追加写入"""
+    cache_dir = tempfile.mkdtemp(prefix='fund_bench_cache_')
+    original_cache_dir = fund_data.CACHE_DIR
+    fund_data.CACHE_DIR = cache_dir
+    try:
+        for n in sizes:
+            df = synthetic_nav_frame(n)
+            fund_code = f"9{n:05d}"[-6:]
+            results[f"cache.save[{n}]"] = measure(lambda: fund_data.save_fund_data_to_cache(fund_code, df))
+            results[f"cache.load_full[{n}]"] = measure(lambda: fund_data.get_cached_fund_data(fund_code))
+            results[f"cache.load_full_uncached[{n}]"] = measure(lambda: fund_data.get_cached_fund_data(fund_code),
+                                                                setup=fund_data.clear_frame_cache)
+            range_start = df['date'].iloc[-250]
+            results[f"cache.load_last_year[{n}]"] = measure(
+                lambda: fund_data.get_cached_fund_data(fund_code, start_date=range_start))
+            results[f"cache.meta[{n}]"] = measure(lambda: fund_data.get_cache_meta(fund_code))
+            fund_info = {'fund_code': fund_code, 'is_money_fund': False}
+            results[f"cache.metric_state[{n}]"] = measure(
+                lambda: fund_data.get_fund_metric_state(fund_code, fund_info).headline())
+
+            next_rows = iter(synthetic_nav_frame(n + 200, seed=1).iloc[n:].itertuples(index=False))
+            def append_one():
+                row = next(next_rows)
+                fund_data.append_fund_data_to_cache(
+                    fund_code, pd.DataFrame({'date': [row.date], 'nav': [row.nav], 'acc_nav': [row.acc_nav]}))
+            results[f"cache.append_one[{n}]"] = measure(append_one, rounds=100)
+    finally:
+        fund_data.CACHE_DIR = original_cache_dir
+        shutil.rmtree(cache_dir, ignore_errors=True)
+
+
+def bench_parse(results, stub):
+    """单页历史净值的解析耗时"""
+    text = stub._lsjz_page({'code': '900001', 'page': '1', 'per': '20'})
+    results["parse.lsjz_page[20]"] = measure(lambda: fund_data._parse_nav_page(text, False))
+    text = stub._lsjz_page({'code': '900001', 'page': '1', 'per': '200'})
+    results["parse.lsjz_page[200]"] = measure(lambda: fund_data._parse_nav_page(text, False))
+
+
+def bench_fetch(results, stub):
+    """通过替身服务器获取数据：get_fund_data冷启动/缓存命中，以及分页接口的完整获取"""
+    cache_dir = tempfile.mkdtemp(prefix='fund_bench_fetch_')
+    original = (fund_data.CACHE_DIR, fund_data.FUND_API_BASE_URL)
+    fund_data.FUND_API_BASE_URL = stub.base_url
+    fund_data.CACHE_DIR = cache_dir
+
+    def clear_cache():
+        shutil.rmtree(cache_dir, ignore_errors=True)
+        fund_data._fund_info_memo.clear()
+        fund_data.clear_frame_cache()
+
+    def counted(name, func, **kwargs):
+        stub.reset_stats()
+        result = measure(func, **kwargs)
+        result['requests_per_round'] = stub.stats['requests'] / result['rounds']
+        results[name] = result
+
+    try:
+        for fund_code, n in (('900001', 1000), ('900002', 10000)):
+            counted(f"fetch.get_fund_data_cold[{n}]", lambda: fund_data.get_fund_data(fund_code),
+                    setup=clear_cache, rounds=5)
+            counted(f"fetch.get_fund_data_warm[{n}]", lambda: fund_data.get_fund_data(fund_code))
+        counted("fetch.lsjz_all_pages[1000]", lambda: fund_data.fetch_fund_data_from_api('900001', None, None),
+                setup=clear_cache, rounds=2)
+        counted("fetch.get_fund_info_cold", lambda: fund_data.get_fund_info('900001'), setup=clear_cache, rounds=5)
+    finally:
+        fund_data.CACHE_DIR, fund_data.FUND_API_BASE_URL = original
+        shutil.rmtree(cache_dir, ignore_errors=True)
+
+
+def start_stub():
+    """启动使用合成数据的替身服务器（无延迟、无错误，只测量客户端开销）"""
+    end = datetime.now().strftime('%Y-%m-%d')
+    funds = {}
+    for fund_code, n in (('900001', 1000), ('900002', 10000)):
+        funds[fund_code] = {
+            'df': synthetic_nav_frame(n, seed=int(fund_code), end=end),
+            'fund_info': {'fund_name': f"合成基金{fund_code}", 'fund_company': '基准测试基金管理有限公司',
+                          'fund_type': '混合型', 'fund_code': fund_code, 'is_money_fund': False}
+        }
+    return StubServer(funds=funds, fixture_dir=tempfile.mkdtemp(prefix='fund_bench_fixtures_')).start()
+
+
+def compare(results, baseline, threshold):
+    """与基线比较并打印结果，返回性能回退的项目列表"""
+    regressions = []
+    print(f"{'名称':<48}{'中位数(ms)':>12}{'基线(ms)':>12}{'倍数':>8}")
+    for name, result in results.items():
+        base = baseline.get(name)
+        if 'error' in result:
+            print(f"{name:<48}{'错误: ' + result['error'][:60]}")
+            continue
+        if base is None or 'median_ms' not in base:
+            print(f"{name:<48}{result['median_ms']:>12.3f}{'-':>12}{'-':>8}")
+            continue
+        ratio = result['median_ms'] / base['median_ms'] if base['median_ms'] > 0 else float('inf')
+        flag = '  性能回退' if ratio > threshold else ''
+        print(f"{name:<48}{result['median_ms']:>12.3f}{base['median_ms']:>12.3f}{ratio:>8.2f}{flag}")
+        if ratio > threshold:
+            regressions.append(name)
+    return regressions
+
+
+def unpinned_packages():
+    """返回版本与requirements.txt不一致的包：[(包名, 已安装版本, 固定版本)]"""
+    pins = {}
+    with open(REQUIREMENTS_FILE, 'r', encoding='utf-8') as f:
+        for line in f:
+            name, _, version = line.strip().partition('==')
+            if version:
+                pins[name.lower()] = version
+    return [(name, module.__version__, pins[name]) for name, module in PINNED_PACKAGES.items()
+            if name in pins and module.__version__ != pins[name]]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="基金数据和分析热点路径的性能基准测试")
+    parser.add_argument('--quick', action='store_true', help="只测试1k/10k规模")
+    parser.add_argument('--only', choices=GROUPS, action='append', help="只运行指定的测试组，可重复指定")
+    parser.add_argument('--save-baseline', action='store_true', help="把本次结果保存为基线")
+    parser.add_argument('--baseline', default=BASELINE_FILE, help="基线文件路径")
+    parser.add_argument('--threshold', type=float, default=DEFAULT_THRESHOLD, help="判定性能回退的耗时倍数")
+    parser.add_argument('--fail-on-regression', action='store_true', help="有性能回退时以非零状态退出")
+    args = parser.parse_args()
+
+    sizes = QUICK_SIZES if args.quick else SIZES
+    groups = args.only or GROUPS
+    warnings.filterwarnings('ignore')
+
+    results = {}
+    stub = start_stub() if ('parse' in groups or 'fetch' in groups) else None
+    try:
+        # 测试过程中的日志输出对结果没有意义
+        with open(os.devnull, 'w', encoding='utf-8') as devnull:
+            stdout, sys.stdout = sys.stdout, devnull
+            try:
+                if 'analysis' in groups:
+                    bench_analysis(sizes, results)
+                    bench_batch(results)
+                if 'cache' in groups:
+                    bench_cache(sizes, results)
+                if 'parse' in groups:
+                    bench_parse(results, stub)
+                if 'fetch' in groups:
+                    bench_fetch(results, stub)
+            finally:
+                sys.stdout = stdout
+    finally:
+        if stub is not None:
+            stub.stop()
+
+    report = {
+        'meta': {
+            'timestamp': datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
+            'python': platform.python_version(),
+            'numpy': np.__version__,
+            'pandas': pd.__version__,
+            'platform': platform.platform(),
+        },
+        'results': results
+    }
+    os.makedirs(os.path.dirname(RESULTS_FILE), exist_ok=True)
+    with open(RESULTS_FILE, 'w', encoding='utf-8') as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+
+    baseline = {}
+    if os.path.exists(args.baseline):
+        with open(args.baseline, 'r', encoding='utf-8') as f:
+            baseline = json.load(f).get('results', {})
+    regressions = compare(results, baseline, args.threshold)
+
+    errors = [name for name, result in results.items() if 'error' in result]
+    if errors:
+        # 出错的项目无法检测性能回退，不能作为基线
+        print(f"{len(errors)}项测试出错{'，未保存基线' if args.save_baseline else ''}: {', '.join(errors)}")
+        sys.exit(1)
+
+    if args.save_baseline:
+        mismatched = unpinned_packages()
+        if mismatched:
+            for name, installed, pinned in mismatched:
+                print(f"{name}版本为{installed}，与requirements.txt固定的{pinned}不一致")
+            print("未保存基线：请在requirements.txt固定的环境中生成基线")
+            sys.exit(1)
+        # 只运行部分测试时保留基线中其余项目的结果
+        report['results'] = {**baseline, **results}
+        with open(args.baseline, 'w', encoding='utf-8') as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+        print(f"基线已保存到: {args.baseline}")
+    elif regressions:
+        print(f"{len(regressions)}项性能回退（超过基线{args.threshold}倍）")
+        if args.fail_on_regression:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
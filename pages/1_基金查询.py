@@ -42,6 +42,8 @@ if 'fund_code' not in st.session_state:
     st.session_state.fund_code = ''
 if 'fund_data' not in st.session_state:
     st.session_state.fund_data = None
+if 'fund_data_future' not in st.session_state:
+    st.session_state.fund_data_future = None
 if 'start_date' not in st.session_state:
     st.session_state.start_date = None
 if 'end_date' not in st.session_state:
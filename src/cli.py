@@ -5,12 +5,8 @@ sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 from src.fund_data import get_fund_data
 from src.fund_plot import plot_fund_nav
 from src.fund_analysis import (
-    calculate_max_drawdown,
-    calculate_volatility,
-    calculate_sharpe_ratio,
-    calculate_annual_return,
-    calculate_period_returns,
-    calculate_return_distribution
+    analyze,
+    calculate_period_returns
 )
 from src.fund_visualization import (
     plot_risk_metrics,
@@ -70,7 +66,7 @@ def main():
     print(f"\n正在获取基金 {fund_code} 从 {start_date} 到 {end_date} 的净值数据...")
     
     # 获取基金数据
-    fill_missing = input("是否显示非交易日数据？(y/n，y则保留非交易日并使用上一交易日数据，n则仅显示交易日): ").strip().lower() == 'y'
+    fill_missing = 'calendar' if input("是否显示非交易日数据？(y/n，y则保留非交易日并使用上一交易日数据，n则仅显示交易日): ").strip().lower() == 'y' else False
     df = get_fund_data(fund_code, start_date, end_date, fill_missing=fill_missing)
     
     if df.empty:
@@ -90,18 +86,18 @@ def main():
         print("2. 请求的日期范围超出了基金的存续期")
         print("3. 未来日期的数据尚未产生")
     
-    # 计算基础技术指标
-    nav_series = df['nav']
-    max_drawdown = calculate_max_drawdown(nav_series)
-    volatility = calculate_volatility(nav_series)
-    sharpe_ratio = calculate_sharpe_ratio(nav_series)
-    annual_return = calculate_annual_return(nav_series)
+    # 一次计算全部风险收益指标和收益分布统计
+    metrics = analyze(df['nav'], df['date'])
+    max_drawdown = metrics.max_drawdown
+    volatility = metrics.volatility
+    sharpe_ratio = metrics.sharpe_ratio
+    annual_return = metrics.annual_return
     
     # 计算周期收益率
     monthly_returns, quarterly_returns, yearly_returns = calculate_period_returns(df)
     
-    # 计算收益分布统计
-    return_stats = calculate_return_distribution(nav_series)
+    # 收益分布统计
+    return_stats = metrics.return_distribution()
     
     # 显示基本统计信息
     print("\n基本统计信息:")
@@ -115,6 +111,10 @@ def main():
     print(f"最大回撤率: {max_drawdown:.2f}%")
     print(f"波动率: {volatility:.2f}%")
     print(f"夏普比率: {sharpe_ratio:.2f}")
+    print(f"索提诺比率: {metrics.sortino_ratio:.2f}")
+    print(f"卡玛比率: {metrics.calmar_ratio:.2f}")
+    print(f"下行标准差: {metrics.downside_deviation:.2f}%")
+    print(f"日胜率: {metrics.win_rate:.2f}%")
     
     # 绘制净值曲线
     print("\n正在绘制净值曲线...")
@@ -1,5 +1,341 @@
+import warnings
 import numpy as np
 import pandas as pd
+from dataclasses import dataclass, field
+
+TRADING_DAYS_PER_YEAR = 252
+DEFAULT_RISK_FREE_RATE = 0.03
+DISTRIBUTION_PERCENTILES = (1, 5, 10, 25, 75, 90, 95, 99)
+
+@dataclass(frozen=True)
+class FundMetrics:
+    """analyze()的计算结果，收益率、回撤、波动率类指标均为百分比"""
+    count: int                  # 净值数据点数
+    start_nav: float
+    end_nav: float
+    total_return: float         # 区间涨跌幅
+    annual_return: float        # 按自然日计算的年化收益率
+    max_drawdown: float         # 最大回撤率（负数）
+    volatility: float           # 年化波动率
+    downside_deviation: float   # 年化下行标准差（低于无风险日收益率的部分）
+    sharpe_ratio: float
+    sortino_ratio: float
+    calmar_ratio: float         # 年化收益率 / |最大回撤率|
+    win_rate: float             # 日收益率为正的天数占比
+    mean: float                 # 以下为日收益率分布统计
+    std: float
+    skew: float
+    kurtosis: float
+    min: float
+    max: float
+    median: float
+    percentiles: dict = field(default_factory=dict)
+
+    def return_distribution(self):
+        """转换为calculate_return_distribution()返回的字典格式"""
+        stats = {
+            'mean': self.mean,
+            'std': self.std,
+            'skew': self.skew,
+            'kurtosis': self.kurtosis,
+            'min': self.min,
+            'max': self.max,
+            'median': self.median
+        }
+        for p, value in self.percentiles.items():
+            stats[f'percentile_{p}'] = value
+        return stats
+
+def _to_nav_array(nav):
+    """净值序列转换为float64数组，缺失值用前值填充（与pandas pct_change的默认行为一致）"""
+    nav = np.asarray(nav, dtype=np.float64)
+    if np.isnan(nav).any():
+        nav = pd.Series(nav).ffill().to_numpy()
+    return nav
+
+def _daily_returns(nav):
+    """日收益率数组（已去掉首日和缺失值）"""
+    returns = nav[1:] / nav[:-1] - 1
+    return returns[~np.isnan(returns)]
+
+def _sample_std(values):
+    """样本标准差（ddof=1），少于两个数据时为NaN"""
+    if len(values) < 2:
+        return np.nan
+    return float(np.std(values, ddof=1))
+
+def _max_drawdown(nav):
+    cummax = np.fmax.accumulate(nav)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        drawdown = (nav - cummax) / cummax
+    if len(drawdown) == 0 or np.isnan(drawdown).all():
+        return np.nan
+    return float(np.nanmin(drawdown) * 100)
+
+def _sharpe_ratio(excess_returns):
+    if len(excess_returns) == 0:
+        return 0.0
+    return float(np.sqrt(TRADING_DAYS_PER_YEAR) * excess_returns.mean() / _sample_std(excess_returns))
+
+def _days_between(first_date, last_date):
+    """两个日期相差的自然日数，按日历日期相减（pandas 1.5的Timestamp相减超过约292年时会溢出）"""
+    return (pd.Timestamp(last_date).date() - pd.Timestamp(first_date).date()).days
+
+def _annual_return(first_nav, last_nav, first_date, last_date):
+    total_days = _days_between(first_date, last_date)
+    if total_days <= 0:
+        return 0.0
+    total_return = (last_nav / first_nav) - 1
+    return float(((1 + total_return) ** (365 / total_days) - 1) * 100)
+
+def _skew(returns, deviations, m2):
+    """样本偏度，与pandas Series.skew()的无偏估计相同"""
+    n = len(returns)
+    if n < 3:
+        return np.nan
+    if m2 == 0:
+        return 0.0
+    m3 = (deviations ** 3).sum()
+    return float((n * (n - 1) ** 0.5 / (n - 2)) * (m3 / m2 ** 1.5))
+
+def _kurtosis(returns, deviations, m2):
+    """样本超额峰度，与pandas Series.kurtosis()的无偏估计相同"""
+    n = len(returns)
+    if n < 4:
+        return np.nan
+    denominator = (n - 2) * (n - 3) * m2 ** 2
+    if denominator == 0:
+        return 0.0
+    m4 = (deviations ** 4).sum()
+    adjustment = 3 * (n - 1) ** 2 / ((n - 2) * (n - 3))
+    return float(n * (n + 1) * (n - 1) * m4 / denominator - adjustment)
+
+def _return_distribution(returns):
+    """日收益率分布统计（未乘100），返回(统计字典, 离差数组)"""
+    n = len(returns)
+    mean = float(returns.mean()) if n else np.nan
+    deviations = returns - mean
+    m2 = (deviations ** 2).sum()
+    stats = {
+        'mean': mean,
+        'std': _sample_std(returns),
+        'skew': _skew(returns, deviations, m2),
+        'kurtosis': _kurtosis(returns, deviations, m2)
+    }
+    if n:
+        # 中位数和各分位数一次计算
+        quantiles = np.percentile(returns, (0, 50, 100) + DISTRIBUTION_PERCENTILES)
+        stats.update(min=float(quantiles[0]), median=float(quantiles[1]), max=float(quantiles[2]),
+                     percentiles={p: float(q) for p, q in zip(DISTRIBUTION_PERCENTILES, quantiles[3:])})
+    else:
+        stats.update(min=np.nan, max=np.nan, median=np.nan, percentiles={p: np.nan for p in DISTRIBUTION_PERCENTILES})
+    return stats
+
+def analyze(nav, dates, risk_free_rate=DEFAULT_RISK_FREE_RATE):
+    """
+    一次计算基金的全部收益风险指标：日收益率只计算一次，所有指标在同一组NumPy数组上向量化计算
+    
+    参数:
+        nav: 净值序列（pandas.Series或数组），按日期升序排列
+        dates: 与nav对应的日期序列
+        risk_free_rate: float, 无风险利率，默认3%
+    返回:
+        FundMetrics: 各项指标
+    """
+    nav = _to_nav_array(nav)
+    dates = pd.DatetimeIndex(pd.to_datetime(np.asarray(dates)))
+    returns = _daily_returns(nav)
+    count = len(nav)
+    
+    n = len(returns)
+    stats = _return_distribution(returns)
+    std = stats['std']
+    
+    # 收益风险指标
+    daily_risk_free = risk_free_rate / TRADING_DAYS_PER_YEAR
+    excess_returns = returns - daily_risk_free
+    downside = np.minimum(excess_returns, 0)
+    downside_std = float(np.sqrt((downside ** 2).mean())) if n else np.nan
+    annual_return = _annual_return(nav[0], nav[-1], dates[0], dates[-1]) if count else 0.0
+    max_drawdown = _max_drawdown(nav)
+    
+    with np.errstate(invalid='ignore', divide='ignore'):
+        sortino_ratio = float(np.sqrt(TRADING_DAYS_PER_YEAR) * excess_returns.mean() / downside_std) \
+            if n and downside_std > 0 else np.nan
+        calmar_ratio = float(annual_return / abs(max_drawdown)) if max_drawdown else np.nan
+    
+    return FundMetrics(
+        count=count,
+        start_nav=float(nav[0]) if count else np.nan,
+        end_nav=float(nav[-1]) if count else np.nan,
+        total_return=float((nav[-1] / nav[0] - 1) * 100) if count else np.nan,
+        annual_return=annual_return,
+        max_drawdown=max_drawdown,
+        volatility=float(std * np.sqrt(TRADING_DAYS_PER_YEAR) * 100),
+        downside_deviation=float(downside_std * np.sqrt(TRADING_DAYS_PER_YEAR) * 100),
+        sharpe_ratio=_sharpe_ratio(excess_returns),
+        sortino_ratio=sortino_ratio,
+        calmar_ratio=calmar_ratio,
+        win_rate=float((returns > 0).mean() * 100) if n else np.nan,
+        mean=stats['mean'] * 100,
+        std=std * 100,
+        skew=stats['skew'],
+        kurtosis=stats['kurtosis'],
+        min=stats['min'] * 100,
+        max=stats['max'] * 100,
+        median=stats['median'] * 100,
+        percentiles={p: value * 100 for p, value in stats['percentiles'].items()}
+    )
+
+def align_nav_frames(frames, column='nav'):
+    """
+    把多只基金的净值数据按日期对齐为 日期 × 基金 的二维数组，某只基金没有数据的日期为NaN
+    
+    参数:
+        frames: dict, 基金代码 -> 包含date和净值列的DataFrame；
+                也可以是包含fund_code/date/净值列的长表（例如fund_store.load_nav_range的结果）
+        column: str, 使用的净值列，默认单位净值
+    返回:
+        tuple: (日期DatetimeIndex, 基金代码列表, float64二维数组)
+    """
+    if isinstance(frames, pd.DataFrame):
+        frames = {code: group for code, group in frames.groupby('fund_code', sort=False)}
+    codes = list(frames)
+    days = [np.asarray(frames[code]['date'], dtype='datetime64[D]') for code in codes]
+    dates = np.unique(np.concatenate(days)) if days else np.array([], dtype='datetime64[D]')
+    
+    matrix = np.full((len(dates), len(codes)), np.nan)
+    for j, code in enumerate(codes):
+        matrix[np.searchsorted(dates, days[j]), j] = frames[code][column].to_numpy(dtype=np.float64)
+    return pd.DatetimeIndex(dates.astype('datetime64[ns]')), codes, matrix
+
+def _forward_fill_columns(matrix):
+    """按列向前填充NaN（向量化，不逐列循环）"""
+    valid = ~np.isnan(matrix)
+    index = np.where(valid, np.arange(len(matrix))[:, None], 0)
+    np.maximum.accumulate(index, axis=0, out=index)
+    return matrix[index, np.arange(matrix.shape[1])]
+
+def _column_percentiles(values, counts, percentiles):
+    """按列计算分位数（线性插值，与np.percentile相同），每列只使用前counts个非NaN值"""
+    ordered = np.sort(values, axis=0)   # NaN排在每列末尾
+    columns = np.arange(values.shape[1])
+    result = np.full((len(percentiles), values.shape[1]), np.nan)
+    has_data = counts > 0
+    for i, p in enumerate(percentiles):
+        position = p / 100 * (np.maximum(counts, 1) - 1)
+        lower = np.floor(position).astype(np.intp)
+        upper = np.minimum(lower + 1, np.maximum(counts, 1) - 1)
+        weight = position - lower
+        a, b = ordered[lower, columns], ordered[upper, columns]
+        diff = b - a
+        value = np.where(weight >= 0.5, b - diff * (1 - weight), a + diff * weight)
+        result[i] = np.where(has_data, value, np.nan)
+    return result
+
+def analyze_matrix(nav_matrix, dates, codes=None, risk_free_rate=DEFAULT_RISK_FREE_RATE):
+    """
+    按列批量计算多只基金的收益风险指标，所有基金在同一组数组运算中完成
+    
+    NaN表示该基金在该日期没有净值（成立前、停止披露后或当天未公布），计算时跳过：
+    每列的结果与对该基金自身（去掉NaN后）的净值序列调用analyze()一致（在浮点误差范围内）
+    
+    参数:
+        nav_matrix: 日期 × 基金 的二维净值数组（可用align_nav_frames生成）
+        dates: 与行对应的日期序列
+        codes: 与列对应的基金代码，作为结果的索引
+        risk_free_rate: float, 无风险利率，默认3%
+    返回:
+        pandas.DataFrame: 每只基金一行，列与FundMetrics的字段相同，分位数展开为percentile_{p}列
+    """
+    nav = np.asarray(nav_matrix, dtype=np.float64)
+    if nav.ndim == 1:
+        nav = nav[:, None]
+    dates = pd.DatetimeIndex(pd.to_datetime(np.asarray(dates)))
+    if len(nav) == 0:
+        # 没有任何日期时按只有一行NaN处理，所有指标为NaN
+        nav = np.full((1, nav.shape[1]), np.nan)
+        dates = pd.DatetimeIndex([pd.NaT])
+    rows, columns = nav.shape
+    valid = ~np.isnan(nav)
+    count = valid.sum(axis=0)
+    has_data = count > 0
+    
+    # 每列相邻两个有效净值之间的收益率，放在后一个有效净值所在的行
+    filled = _forward_fill_columns(nav)
+    returns = np.full_like(nav, np.nan)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        returns[1:] = np.where(valid[1:], filled[1:] / filled[:-1] - 1, np.nan)
+    return_valid = ~np.isnan(returns)
+    n = return_valid.sum(axis=0)
+    
+    with np.errstate(invalid='ignore', divide='ignore'), warnings.catch_warnings():
+        warnings.simplefilter('ignore', RuntimeWarning)
+        # 日收益率分布（无效位置的离差置为0，直接求和）
+        mean = np.nansum(returns, axis=0) / n
+        deviations = np.where(return_valid, returns - mean, 0.0)
+        squared = deviations * deviations
+        m2 = squared.sum(axis=0)
+        std = np.where(n >= 2, np.sqrt(m2 / (n - 1)), np.nan)
+        m3 = (squared * deviations).sum(axis=0)
+        m4 = (squared * squared).sum(axis=0)
+        skew = np.where(m2 == 0, 0.0, (n * (n - 1) ** 0.5 / (n - 2)) * (m3 / m2 ** 1.5))
+        skew = np.where(n < 3, np.nan, skew)
+        kurt_denominator = (n - 2) * (n - 3) * m2 ** 2
+        kurtosis = np.where(kurt_denominator == 0, 0.0,
+                            n * (n + 1) * (n - 1) * m4 / kurt_denominator - 3 * (n - 1) ** 2 / ((n - 2) * (n - 3)))
+        kurtosis = np.where(n < 4, np.nan, kurtosis)
+        quantiles = _column_percentiles(returns, n, (0, 50, 100) + DISTRIBUTION_PERCENTILES)
+        
+        # 收益风险指标
+        daily_risk_free = risk_free_rate / TRADING_DAYS_PER_YEAR
+        excess_mean = mean - daily_risk_free
+        downside = np.where(return_valid, np.minimum(returns - daily_risk_free, 0), 0.0)
+        downside_std = np.sqrt((downside * downside).sum(axis=0) / n)
+        sharpe_ratio = np.where(n == 0, 0.0, np.sqrt(TRADING_DAYS_PER_YEAR) * excess_mean / std)
+        sortino_ratio = np.where((n > 0) & (downside_std > 0),
+                                 np.sqrt(TRADING_DAYS_PER_YEAR) * excess_mean / downside_std, np.nan)
+        win_rate = np.where(n > 0, (returns > 0).sum(axis=0) / n * 100, np.nan)
+        
+        cummax = np.fmax.accumulate(nav, axis=0)
+        max_drawdown = np.nanmin((nav - cummax) / cummax, axis=0) * 100
+        
+        # 每列第一个和最后一个有效净值
+        first = np.argmax(valid, axis=0)
+        last = rows - 1 - np.argmax(valid[::-1], axis=0)
+        column_index = np.arange(columns)
+        start_nav = nav[first, column_index]
+        end_nav = nav[last, column_index]
+        days = dates.to_numpy().astype('datetime64[D]')
+        total_days = (days[last] - days[first]).astype(np.int64)
+        annual_return = np.where(total_days > 0, ((end_nav / start_nav) ** (365 / total_days) - 1) * 100, 0.0)
+        annual_return = np.where(has_data, annual_return, np.nan)
+        calmar_ratio = np.where(max_drawdown != 0, annual_return / np.abs(max_drawdown), np.nan)
+    
+    result = pd.DataFrame({
+        'count': count,
+        'start_nav': start_nav,
+        'end_nav': end_nav,
+        'total_return': (end_nav / start_nav - 1) * 100,
+        'annual_return': annual_return,
+        'max_drawdown': max_drawdown,
+        'volatility': std * np.sqrt(TRADING_DAYS_PER_YEAR) * 100,
+        'downside_deviation': downside_std * np.sqrt(TRADING_DAYS_PER_YEAR) * 100,
+        'sharpe_ratio': sharpe_ratio,
+        'sortino_ratio': sortino_ratio,
+        'calmar_ratio': calmar_ratio,
+        'win_rate': win_rate,
+        'mean': mean * 100,
+        'std': std * 100,
+        'skew': skew,
+        'kurtosis': kurtosis,
+        'min': quantiles[0] * 100,
+        'max': quantiles[2] * 100,
+        'median': quantiles[1] * 100
+    }, index=codes)
+    for p, values in zip(DISTRIBUTION_PERCENTILES, quantiles[3:]):
+        result[f'percentile_{p}'] = values * 100
+    return result
 
 def calculate_max_drawdown(nav_series):
     """
@@ -11,9 +347,7 @@ def calculate_max_drawdown(nav_series):
     返回:
         float: 最大回撤率（百分比）
     """
-    cummax = nav_series.cummax()
-    drawdown = (nav_series - cummax) / cummax
-    return float(drawdown.min() * 100)
+    return _max_drawdown(_to_nav_array(nav_series))
 
 def calculate_volatility(nav_series):
     """
@@ -24,10 +358,9 @@ def calculate_volatility(nav_series):
     返回:
         float: 年化波动率（百分比）
     """
-    daily_returns = nav_series.pct_change().dropna()
-    return float(daily_returns.std() * np.sqrt(252) * 100)
+    return float(_sample_std(_daily_returns(_to_nav_array(nav_series))) * np.sqrt(TRADING_DAYS_PER_YEAR) * 100)
 
-def calculate_sharpe_ratio(nav_series, risk_free_rate=0.03):
+def calculate_sharpe_ratio(nav_series, risk_free_rate=DEFAULT_RISK_FREE_RATE):
     """
     计算夏普比率
     夏普比率 = (年化收益率 - 无风险利率) / 年化波动率
@@ -38,18 +371,15 @@ def calculate_sharpe_ratio(nav_series, risk_free_rate=0.03):
     返回:
         float: 夏普比率
     """
-    daily_returns = nav_series.pct_change().dropna()
-    excess_returns = daily_returns - risk_free_rate/252
-    if len(excess_returns) == 0:
-        return 0
-    return float(np.sqrt(252) * excess_returns.mean() / excess_returns.std())
+    returns = _daily_returns(_to_nav_array(nav_series))
+    return _sharpe_ratio(returns - risk_free_rate / TRADING_DAYS_PER_YEAR)
 
 def calculate_annual_return(nav_series):
     """
     计算年化收益率
     
     参数:
-        nav_series: pandas.Series, 净值数据序列
+        nav_series: pandas.Series, 以日期为索引的净值数据序列
     返回:
         float: 年化收益率（百分比）
     """
@@ -57,18 +387,7 @@ def calculate_annual_return(nav_series):
         # 确保日期索引是datetime类型
         if not isinstance(nav_series.index, pd.DatetimeIndex):
             nav_series.index = pd.to_datetime(nav_series.index)
-        
-        # 计算总天数
-        total_days = (nav_series.index[-1] - nav_series.index[0]).days
-        if total_days <= 0:
-            return 0.0
-            
-        # 计算总收益率
-        total_return = (nav_series.iloc[-1] / nav_series.iloc[0]) - 1
-        
-        # 计算年化收益率
-        annual_return = (1 + total_return) ** (365 / total_days) - 1
-        return float(annual_return * 100)
+        return _annual_return(nav_series.iloc[0], nav_series.iloc[-1], nav_series.index[0], nav_series.index[-1])
     except Exception as e:
         print(f"计算年化收益率时发生错误: {str(e)}")
         return 0.0
@@ -110,23 +429,456 @@ def calculate_return_distribution(nav_series):
     返回:
         dict: 包含收益率分布统计信息的字典
     """
-    # 计算日收益率
-    returns = nav_series.pct_change().dropna()
+    stats = _return_distribution(_daily_returns(_to_nav_array(nav_series)))
+    distribution = {key: stats[key] * 100 if key in ('mean', 'std', 'min', 'max', 'median') else stats[key]
+                    for key in ('mean', 'std', 'skew', 'kurtosis', 'min', 'max', 'median')}
+    for p, value in stats['percentiles'].items():
+        distribution[f'percentile_{p}'] = value * 100
+    return distribution
+
+def calculate_fund_summary(df, is_money_fund=False):
+    """
+    计算基金统计信息（最新净值、历史最高最低等，货币基金为七日年化收益率）
     
-    # 计算统计指标
-    stats = {
-        'mean': returns.mean() * 100,  # 平均日收益率
-        'std': returns.std() * 100,    # 标准差
-        'skew': returns.skew(),        # 偏度
-        'kurtosis': returns.kurtosis(), # 峰度
-        'min': returns.min() * 100,     # 最小值
-        'max': returns.max() * 100,     # 最大值
-        'median': returns.median() * 100 # 中位数
+    参数:
+        df: pandas.DataFrame, 按日期升序排列、包含date和nav列的净值数据
+        is_money_fund: bool, 是否为货币基金（nav为每万份收益）
+    返回:
+        dict: 统计指标，收益率类指标均为百分比
+    """
+    latest_date = df['date'].max()
+    summary = {
+        'latest_date': latest_date,
+        'latest_nav': df['nav'].iloc[-1],
+        'establishment_date': df['date'].min()
     }
     
-    # 计算分位数
-    percentiles = [1, 5, 10, 25, 75, 90, 95, 99]
-    for p in percentiles:
-        stats[f'percentile_{p}'] = np.percentile(returns, p) * 100
+    if is_money_fund:
+        # 七日年化收益率
+        last_7_days = df[df['date'] > latest_date - pd.Timedelta(days=7)]['nav']
+        seven_day_return = (last_7_days.sum() / 10000) * 100  # 七日累计收益率
+        summary['seven_day_annual'] = (pow(1 + seven_day_return/100, 365/7) - 1) * 100
+        
+        # 历史七日年化收益率序列
+        rolling_7day_return = (df['nav'].rolling(window=7).sum() / 10000) * 100
+        rolling_7day_annual = (pow(1 + rolling_7day_return/100, 365/7) - 1) * 100
+        summary['max_7day_annual'] = rolling_7day_annual.max()
+        summary['max_7day_annual_date'] = df.loc[rolling_7day_annual.idxmax(), 'date']
+        summary['min_7day_annual'] = rolling_7day_annual.min()
+        summary['min_7day_annual_date'] = df.loc[rolling_7day_annual.idxmin(), 'date']
+    else:
+        max_nav = df['nav'].max()
+        min_nav = df['nav'].min()
+        summary['nav_change'] = (df['nav'].iloc[-1] / df['nav'].iloc[0] - 1) * 100
+        summary['max_nav'] = max_nav
+        summary['max_nav_date'] = df[df['nav'] == max_nav]['date'].iloc[0]
+        summary['min_nav'] = min_nav
+        summary['min_nav_date'] = df[df['nav'] == min_nav]['date'].iloc[0]
+        summary['total_return'] = ((df['nav'].iloc[-1] / df['nav'].iloc[0]) - 1) * 100
+    return summary
+
+def calculate_period_metrics(period_df, start_date, end_date, is_money_fund=False, range_index=None):
+    """
+    计算投资区间的收益和风险指标（基金分析页面的投资天数指标分析）
+    
+    参数:
+        period_df: pandas.DataFrame, 投资区间内按日期升序排列的净值数据（不能为空）
+        start_date: 区间开始日期
+        end_date: 区间结束日期
+        is_money_fund: bool, 是否为货币基金（nav为每万份收益）
+        range_index: NavRangeIndex, 可选，完整净值数据的区间指标索引，给定时收益率、波动率和最大回撤从索引中获取
+    返回:
+        dict: 区间指标，收益率类指标均为百分比；非货币基金还包含从0%开始的收益率曲线return_rate
+              （有累计净值时用累计净值计算，return_uses_acc_nav标记是否使用了累计净值）
+    """
+    if range_index is not None:
+        metrics = calculate_period_metrics_from_index(range_index, start_date, end_date, is_money_fund)
+        if not is_money_fund:
+            _add_return_curve(metrics, period_df)
+        return metrics
+    
+    trading_days = len(period_df)
+    calendar_days = _days_between(start_date, end_date) + 1
+    metrics = {'trading_days': trading_days, 'calendar_days': calendar_days}
+    
+    if is_money_fund:
+        total_income = period_df['nav'].sum()  # 区间内每日万份收益之和
+        cumulative_return = (total_income / 10000) * 100
+        metrics['total_income'] = total_income
+        metrics['cumulative_return'] = cumulative_return
+        metrics['annual_return'] = (pow(1 + cumulative_return/100, 365/calendar_days) - 1) * 100
+        return metrics
     
-    return stats
\ No newline at end of file
+    nav = period_df['nav']
+    _add_return_curve(metrics, period_df)
+    
+    period_return = (nav.iloc[-1] / nav.iloc[0] - 1) * 100
+    metrics['start_nav'] = nav.iloc[0]
+    metrics['end_nav'] = nav.iloc[-1]
+    metrics['period_return'] = period_return
+    metrics['annual_return'] = (pow(1 + period_return/100, 252/trading_days) - 1) * 100
+    
+    # 区间波动率
+    daily_return = nav.pct_change()
+    mean_return = daily_return.mean()
+    metrics['volatility'] = np.sqrt(((daily_return - mean_return) ** 2).sum() / (trading_days - 1)) * 100
+    
+    # 最大回撤
+    rolling_max = nav.expanding().max()
+    drawdown = (nav - rolling_max) / rolling_max * 100
+    metrics['max_drawdown'] = abs(drawdown.min())
+    return metrics
+
+def _add_return_curve(metrics, period_df):
+    """区间的收益率曲线（从0%开始，有累计净值时用累计净值计算）"""
+    uses_acc_nav = 'acc_nav' in period_df.columns and not period_df['acc_nav'].isna().all()
+    curve_nav = period_df['acc_nav'] if uses_acc_nav else period_df['nav']
+    metrics['return_rate'] = (curve_nav / curve_nav.iloc[0] - 1) * 100
+    metrics['return_uses_acc_nav'] = uses_acc_nav
+
+_EMPTY_DRAWDOWN_NODE = (-np.inf, np.inf, 0.0)
+
+def _combine_drawdown_nodes(left, right):
+    """合并相邻两段的(最高净值, 最低净值, 最大回撤)：跨段的最大回撤为右段最低点相对左段最高点的跌幅"""
+    cross = right[1] / left[0] - 1 if left[0] > -np.inf and right[1] < np.inf else 0.0
+    return max(left[0], right[0]), min(left[1], right[1]), min(left[2], right[2], cross)
+
+class DrawdownTree:
+    """
+    区间最大回撤的线段树：每个节点保存对应区间内的最高净值、最低净值和最大回撤（跌幅，负数），
+    任意交易日偏移区间[i, j]的最大回撤只需合并O(log n)个节点；追加新净值时只更新新叶子到根的路径，
+    容量不足时按两倍扩容（均摊O(1)次重建）。缺失的净值（NaN）不参与计算
+    """
+
+    def __init__(self, nav=()):
+        nav = np.asarray(nav, dtype=np.float64)
+        self._size = 0
+        self._allocate(len(nav))
+        self._size = len(nav)
+        self._set_leaves(0, nav)
+        self._rebuild()
+
+    def __len__(self):
+        return self._size
+
+    def _allocate(self, size):
+        self._capacity = 1
+        while self._capacity < max(size, 1):
+            self._capacity *= 2
+        self._max = np.full(2 * self._capacity, -np.inf)
+        self._min = np.full(2 * self._capacity, np.inf)
+        self._mdd = np.zeros(2 * self._capacity)
+
+    def _set_leaves(self, start, nav):
+        leaves = self._capacity + start + np.arange(len(nav))
+        valid = ~np.isnan(nav)
+        self._max[leaves] = np.where(valid, nav, -np.inf)
+        self._min[leaves] = np.where(valid, nav, np.inf)
+        self._mdd[leaves] = 0.0
+
+    def _combine_nodes(self, nodes):
+        """按子节点重新计算一组节点（向量化）"""
+        left, right = 2 * nodes, 2 * nodes + 1
+        left_max, right_min = self._max[left], self._min[right]
+        with np.errstate(invalid='ignore', divide='ignore'):
+            cross = np.where(np.isfinite(left_max) & np.isfinite(right_min), right_min / left_max - 1, 0.0)
+        self._max[nodes] = np.maximum(left_max, self._max[right])
+        self._min[nodes] = np.minimum(self._min[left], right_min)
+        self._mdd[nodes] = np.minimum(np.minimum(self._mdd[left], self._mdd[right]), cross)
+
+    def _rebuild(self):
+        level = self._capacity // 2
+        while level >= 1:
+            self._combine_nodes(np.arange(level, 2 * level))
+            level //= 2
+
+    def values(self):
+        """已保存的净值（缺失值为NaN）"""
+        leaves = self._max[self._capacity:self._capacity + self._size]
+        return np.where(np.isfinite(leaves), leaves, np.nan)
+
+    def append(self, nav):
+        """在末尾追加新净值"""
+        nav = np.asarray(nav, dtype=np.float64)
+        if len(nav) == 0:
+            return
+        start = self._size
+        if start + len(nav) > self._capacity:
+            # 容量不足时扩容并整体重建
+            values = np.concatenate((self.values(), nav))
+            self._allocate(len(values))
+            self._size = len(values)
+            self._set_leaves(0, values)
+            self._rebuild()
+            return
+        self._size += len(nav)
+        self._set_leaves(start, nav)
+        # 新叶子的祖先在每一层都是连续的一段节点
+        lo, hi = self._capacity + start, self._capacity + self._size - 1
+        while lo > 1:
+            lo, hi = lo // 2, hi // 2
+            if hi - lo < 8:
+                # 节点很少时逐个合并，避免数组运算的固定开销
+                for node in range(lo, hi + 1):
+                    left, right = 2 * node, 2 * node + 1
+                    self._max[node], self._min[node], self._mdd[node] = _combine_drawdown_nodes(
+                        (self._max[left], self._min[left], self._mdd[left]),
+                        (self._max[right], self._min[right], self._mdd[right]))
+            else:
+                self._combine_nodes(np.arange(lo, hi + 1))
+
+    def query(self, i, j):
+        """交易日偏移区间[i, j]（包含两端）的(最高净值, 最低净值, 最大回撤)"""
+        left, right = _EMPTY_DRAWDOWN_NODE, _EMPTY_DRAWDOWN_NODE
+        lo, hi = i + self._capacity, j + self._capacity + 1
+        while lo < hi:
+            if lo & 1:
+                left = _combine_drawdown_nodes(left, (self._max[lo], self._min[lo], self._mdd[lo]))
+                lo += 1
+            if hi & 1:
+                hi -= 1
+                right = _combine_drawdown_nodes((self._max[hi], self._min[hi], self._mdd[hi]), right)
+            lo //= 2
+            hi //= 2
+        return _combine_drawdown_nodes(left, right)
+
+    def max_drawdown(self, i, j):
+        """交易日偏移区间[i, j]的最大回撤率（百分比，负数，与calculate_max_drawdown()相同），区间内没有净值时为NaN"""
+        highest, _, drawdown = self.query(i, j)
+        if highest == -np.inf:
+            return np.nan
+        return float(drawdown * 100)
+
+class NavRangeIndex:
+    """
+    基金净值的区间指标索引：按交易日偏移预先计算日收益率、日收益率平方和每日净值（货币基金为万份收益）的前缀和，
+    任意[开始, 结束]区间的收益率、年化收益率和波动率都只需O(1)次运算
+    （按日期定位区间为一次二分查找），最大回撤由DrawdownTree在O(log n)内得到。
+    结果与calculate_period_metrics()相同（在浮点误差范围内）；新净值通过append()增量加入
+    """
+
+    def __init__(self, dates, nav):
+        self.dates = np.empty(0, dtype='datetime64[ns]')
+        self.nav = np.empty(0)
+        self._filled = np.empty(0)      # 缺失值用前值填充后的净值
+        # 前缀和的第k项为前k个交易日（偏移0到k-1）之和，区间[i, j]内的日收益率为偏移i+1到j的交易日
+        self._return_sum = np.zeros(1)
+        self._square_sum = np.zeros(1)
+        self._nav_sum = np.zeros(1)
+        self.drawdown_tree = DrawdownTree()
+        self.append(dates, nav)
+
+    def __len__(self):
+        return len(self.nav)
+
+    def append(self, dates, nav):
+        """追加晚于已有数据的新净值，前缀和与回撤树只处理新增的点"""
+        dates = np.asarray(dates, dtype='datetime64[ns]')
+        nav = np.asarray(nav, dtype=np.float64)
+        if len(dates) == 0:
+            return
+        if (len(self.dates) and dates[0] <= self.dates[-1]) or (np.diff(dates) <= np.timedelta64(0)).any():
+            raise ValueError("只能按日期升序追加晚于已有数据的净值")
+        
+        previous = self._filled[-1:]
+        filled = _to_nav_array(np.concatenate((previous, nav)))[len(previous):]
+        chain = np.concatenate((previous, filled))
+        with np.errstate(invalid='ignore', divide='ignore'):
+            steps = chain[1:] / chain[:-1] - 1
+            # 每个新交易日相对前一交易日的收益率，成立首日为0
+            returns = steps if len(previous) else np.concatenate(([0.0], steps))
+        
+        self._return_sum = np.concatenate((self._return_sum, self._return_sum[-1] + np.cumsum(returns)))
+        self._square_sum = np.concatenate((self._square_sum, self._square_sum[-1] + np.cumsum(returns * returns)))
+        self._nav_sum = np.concatenate((self._nav_sum, self._nav_sum[-1] + np.cumsum(np.nan_to_num(nav))))
+        self.dates = np.concatenate((self.dates, dates))
+        self.nav = np.concatenate((self.nav, nav))
+        self._filled = np.concatenate((self._filled, filled))
+        self.drawdown_tree.append(nav)
+
+    def locate(self, start_date, end_date):
+        """按日期定位区间（包含两端），返回交易日偏移(i, j)，区间内没有数据时返回None"""
+        i = int(np.searchsorted(self.dates, np.datetime64(pd.to_datetime(start_date), 'ns'), side='left'))
+        j = int(np.searchsorted(self.dates, np.datetime64(pd.to_datetime(end_date), 'ns'), side='right')) - 1
+        if i > j:
+            return None
+        return i, j
+
+    def nav_sum(self, i, j):
+        """区间[i, j]内每日净值之和（货币基金为每万份收益之和）"""
+        return self._nav_sum[j + 1] - self._nav_sum[i]
+
+    def period_return(self, i, j):
+        """区间收益率（百分比）"""
+        return (self.nav[j] / self.nav[i] - 1) * 100
+
+    def annual_return(self, i, j):
+        """按交易日数（每年252个交易日）年化的区间收益率（百分比）"""
+        return (pow(1 + self.period_return(i, j) / 100, TRADING_DAYS_PER_YEAR / (j - i + 1)) - 1) * 100
+
+    def volatility(self, i, j):
+        """区间日收益率的标准差（百分比，未年化），与calculate_period_metrics()的计算方式相同"""
+        count = j - i
+        if count == 0:
+            return np.nan
+        total = self._return_sum[j + 1] - self._return_sum[i + 1]
+        squares = self._square_sum[j + 1] - self._square_sum[i + 1]
+        return np.sqrt(max(squares - total * total / count, 0.0) / count) * 100
+
+    def max_drawdown(self, i, j):
+        """区间最大回撤率（百分比，取绝对值，与calculate_period_metrics()相同）"""
+        return abs(self.drawdown_tree.max_drawdown(i, j))
+
+def calculate_period_metrics_from_index(range_index, start_date, end_date, is_money_fund=False):
+    """
+    用NavRangeIndex计算投资区间的收益和风险指标（不含收益率曲线），区间内没有数据时返回None
+    
+    参数:
+        range_index: NavRangeIndex, 基金净值的区间指标索引
+        start_date: 区间开始日期
+        end_date: 区间结束日期
+        is_money_fund: bool, 是否为货币基金（nav为每万份收益）
+    返回:
+        dict: 与calculate_period_metrics()相同的键（return_rate和return_uses_acc_nav除外）
+    """
+    located = range_index.locate(start_date, end_date)
+    if located is None:
+        return None
+    i, j = located
+    calendar_days = _days_between(start_date, end_date) + 1
+    metrics = {'trading_days': j - i + 1, 'calendar_days': calendar_days}
+    
+    if is_money_fund:
+        total_income = range_index.nav_sum(i, j)
+        cumulative_return = (total_income / 10000) * 100
+        metrics['total_income'] = total_income
+        metrics['cumulative_return'] = cumulative_return
+        metrics['annual_return'] = (pow(1 + cumulative_return/100, 365/calendar_days) - 1) * 100
+        return metrics
+    
+    metrics['start_nav'] = range_index.nav[i]
+    metrics['end_nav'] = range_index.nav[j]
+    metrics['period_return'] = range_index.period_return(i, j)
+    metrics['annual_return'] = range_index.annual_return(i, j)
+    metrics['volatility'] = range_index.volatility(i, j)
+    metrics['max_drawdown'] = range_index.max_drawdown(i, j)
+    return metrics
+
+@dataclass
+class MetricState:
+    """
+    可序列化的基金流式指标状态：日收益率的均值和离差平方和（Welford算法）、历史最高净值、当前回撤和最大回撤、
+    收益率个数及首末净值。每个新净值由update()在O(1)内更新，headline()得到的指标与analyze()相同（在浮点误差范围内）。
+    缺失的净值按前值填充处理（收益率为0），与analyze()一致；日期保存为'YYYY-MM-DD'字符串
+    """
+    data_count: int = 0             # 已处理的净值行数（包括缺失值）
+    count: int = 0                  # 日收益率个数
+    mean: float = 0.0               # 日收益率均值
+    m2: float = 0.0                 # 日收益率离差平方和
+    peak: float = np.nan            # 历史最高净值
+    drawdown: float = 0.0           # 当前回撤（小数，负数）
+    max_drawdown: float = 0.0       # 最大回撤（小数，负数）
+    first_nav: float = np.nan
+    last_nav: float = np.nan
+    first_date: str = None          # 第一个有效净值的日期
+    last_date: str = None           # 最后一行数据的日期
+
+    @classmethod
+    def from_history(cls, nav, dates):
+        """用完整的历史净值（按日期升序）一次性向量化地构建状态"""
+        nav = _to_nav_array(nav)
+        dates = np.asarray(dates)
+        state = cls(data_count=len(nav))
+        if len(nav) == 0:
+            return state
+        state.last_date = pd.Timestamp(dates[-1]).strftime('%Y-%m-%d')
+        valid = np.flatnonzero(~np.isnan(nav))
+        if len(valid) == 0:
+            return state
+        
+        # 前值填充后第一个有效净值之后不再有缺失值
+        nav = nav[valid[0]:]
+        returns = _daily_returns(nav)
+        state.count = len(returns)
+        if state.count:
+            state.mean = float(returns.mean())
+            deviations = returns - state.mean
+            state.m2 = float((deviations * deviations).sum())
+        state.peak = float(nav.max())
+        state.drawdown = float(nav[-1] / state.peak - 1)
+        state.max_drawdown = float((nav / np.maximum.accumulate(nav) - 1).min())
+        state.first_nav = float(nav[0])
+        state.last_nav = float(nav[-1])
+        state.first_date = pd.Timestamp(dates[valid[0]]).strftime('%Y-%m-%d')
+        return state
+
+    @classmethod
+    def from_dict(cls, data):
+        return cls(**{name: data[name] for name in cls.__dataclass_fields__})
+
+    def to_dict(self):
+        return {name: getattr(self, name) for name in self.__dataclass_fields__}
+
+    def update(self, nav, date):
+        """加入下一个交易日（晚于last_date）的净值"""
+        self.data_count += 1
+        self.last_date = pd.Timestamp(date).strftime('%Y-%m-%d')
+        nav = float(nav)
+        if np.isnan(nav):
+            if np.isnan(self.last_nav):
+                return
+            nav = self.last_nav
+        
+        if np.isnan(self.first_nav):
+            self.first_nav = self.last_nav = self.peak = nav
+            self.first_date = self.last_date
+            return
+        
+        daily_return = nav / self.last_nav - 1
+        self.count += 1
+        delta = daily_return - self.mean
+        self.mean += delta / self.count
+        self.m2 += delta * (daily_return - self.mean)
+        
+        self.last_nav = nav
+        self.peak = max(self.peak, nav)
+        self.drawdown = nav / self.peak - 1
+        self.max_drawdown = min(self.max_drawdown, self.drawdown)
+
+    def extend(self, nav, dates):
+        """按日期顺序加入多个新净值，开销只与新增个数有关"""
+        for value, date in zip(np.asarray(nav, dtype=np.float64), dates):
+            self.update(value, date)
+
+    def std(self):
+        """日收益率的样本标准差（ddof=1），少于两个收益率时为NaN"""
+        if self.count < 2:
+            return np.nan
+        return float(np.sqrt(self.m2 / (self.count - 1)))
+
+    def headline(self, risk_free_rate=DEFAULT_RISK_FREE_RATE):
+        """
+        基金的主要指标，收益率、回撤、波动率类指标均为百分比，含义与analyze()的同名字段相同
+        
+        返回:
+            dict: latest_date, latest_nav, total_return, annual_return, volatility, sharpe_ratio,
+                  max_drawdown, current_drawdown
+        """
+        has_nav = not np.isnan(self.first_nav)
+        std = self.std()
+        if self.count:
+            with np.errstate(invalid='ignore', divide='ignore'):
+                sharpe_ratio = float(np.sqrt(TRADING_DAYS_PER_YEAR) * (self.mean - risk_free_rate / TRADING_DAYS_PER_YEAR) / std)
+        else:
+            sharpe_ratio = 0.0
+        return {
+            'latest_date': self.last_date,
+            'latest_nav': self.last_nav,
+            'total_return': (self.last_nav / self.first_nav - 1) * 100 if has_nav else np.nan,
+            'annual_return': _annual_return(self.first_nav, self.last_nav, pd.Timestamp(self.first_date),
+                                            pd.Timestamp(self.last_date)) if has_nav else 0.0,
+            'volatility': std * np.sqrt(TRADING_DAYS_PER_YEAR) * 100,
+            'sharpe_ratio': sharpe_ratio,
+            'max_drawdown': self.max_drawdown * 100 if has_nav else np.nan,
+            'current_drawdown': self.drawdown * 100 if has_nav else np.nan
+        }
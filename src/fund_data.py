@@ -1,19 +1,342 @@
 import requests
+from requests.adapters import HTTPAdapter
+import numpy as np
 import pandas as pd
-from bs4 import BeautifulSoup
+from bs4 import BeautifulSoup, SoupStrainer
 import time
 from tqdm import tqdm
 import datetime
 from io import StringIO
 import os
 import json
+import copy
+import shutil
+import re
+import random
+import threading
+from urllib.parse import urlparse
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from contextlib import contextmanager
+try:
+    import fcntl
+except ImportError:     # Windows
+    fcntl = None
+    import msvcrt
+
+from src import fund_store
+from src import trading_calendar
+from src.fund_analysis import MetricState
 
 # 定义缓存目录
 # 使用绝对路径确保文件保存在根目录的data/fund_cache下
 CACHE_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "data/fund_cache")
 
-def get_fund_info(fund_code):
-    """获取基金基本信息，包括基金名称、公司、类型等"""
+# 二进制净值缓存格式（{fund_code}.nav）：
+#   固定长度的文件头 = 魔数 + 空格填充的JSON元数据
+#   之后是按日期升序排列的定长记录，日期以自1970-01-01起的天数(int64)保存
+NAV_CACHE_MAGIC = b'FUNDNAV1'
+NAV_CACHE_HEADER_SIZE = 4096
+NAV_CACHE_COLUMNS = ('date', 'nav', 'acc_nav')
+NAV_RECORD_DTYPE = np.dtype([('date', '<i8'), ('nav', '<f8'), ('acc_nav', '<f8')])
+CACHE_COMPACT_EVERY = 30    # 增量追加写入多少次之后压缩（完整重写）一次缓存文件
+NAV_CACHE_HEADER_RETRIES = 1        # 文件头解析失败（可能正被原地重写）时的重读次数
+NAV_CACHE_HEADER_RETRY_DELAY = 0.05 # 重读文件头之前的等待时间（秒）
+
+# 缓存后端：'file'为每只基金一个二进制缓存文件；'sqlite'为全部基金共用的单文件SQLite净值库（见src/fund_store.py），
+# 可通过环境变量FUND_CACHE_BACKEND切换
+CACHE_BACKEND = os.environ.get('FUND_CACHE_BACKEND', 'file')
+
+# 分页获取历史净值时的并发参数
+FETCH_MAX_WORKERS = 4       # 并发获取分页数据的最大线程数
+FETCH_RATE = 10.0           # 每个主机的分页请求平均速率上限（次/秒），所有线程共享
+FETCH_BURST = 10            # 令牌桶容量：空闲之后允许连续发出的请求数，使并发的线程可以同时开始
+FETCH_PAGE_RETRIES = 2      # 单页在HTTP层重试之外的额外重试次数（覆盖解析失败等情况）
+
+# 分页下载的断点暂存区：已下载的页面保存在CACHE_DIR/staging下，下载中断后从断点继续
+STAGING_DIR_NAME = "staging"
+STAGING_MAX_AGE = 7 * 24 * 3600     # 超过该时间（秒）未更新的暂存数据视为过期并清理
+
+class _RateLimiter:
+    """线程安全的限速器，保证相邻两次请求之间至少间隔min_interval秒"""
+    
+    def __init__(self, min_interval):
+        self.min_interval = min_interval
+        self._lock = threading.Lock()
+        self._next_time = 0.0
+    
+    def wait(self):
+        with self._lock:
+            now = time.monotonic()
+            wait_time = self._next_time - now
+            self._next_time = max(now, self._next_time) + self.min_interval
+        if wait_time > 0:
+            time.sleep(wait_time)
+
+class _TokenBucket:
+    """线程安全的令牌桶限速器：平均每秒最多rate次请求，空闲时最多积累burst个令牌用于突发请求"""
+    
+    def __init__(self, rate, burst):
+        self.rate = rate
+        self.burst = burst
+        self._lock = threading.Lock()
+        self._tokens = float(burst)
+        self._last_time = time.monotonic()
+    
+    def wait(self):
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self.burst, self._tokens + (now - self._last_time) * self.rate)
+            self._last_time = now
+            # 令牌不足时预支一个令牌，等待到它补足的时间
+            self._tokens -= 1
+            wait_time = -self._tokens / self.rate if self._tokens < 0 else 0.0
+        if wait_time > 0:
+            time.sleep(wait_time)
+
+_page_rate_limiters = {}
+_page_rate_limiters_lock = threading.Lock()
+
+def _get_page_rate_limiter(url):
+    """获取分页接口所在主机的令牌桶限速器，不同主机（例如真实接口和替身服务器）分别限速"""
+    host = urlparse(url).netloc
+    with _page_rate_limiters_lock:
+        if host not in _page_rate_limiters:
+            _page_rate_limiters[host] = _TokenBucket(FETCH_RATE, FETCH_BURST)
+        return _page_rate_limiters[host]
+
+# 东方财富接口地址；设置环境变量FUND_API_BASE_URL后所有接口都改为请求该地址（例如src/stub_server.py启动的本地替身服务器）
+FUND_BASE_URL = "http://fund.eastmoney.com"
+FUND_SEARCH_BASE_URL = "http://fundsuggest.eastmoney.com"
+FUND_API_BASE_URL = os.environ.get('FUND_API_BASE_URL')
+
+def _api_url(base_url, path):
+    """拼接接口URL，设置了FUND_API_BASE_URL时替换为该地址"""
+    return (FUND_API_BASE_URL or base_url).rstrip('/') + path
+
+# HTTP客户端参数，所有东方财富接口共用同一个带连接池的会话
+HTTP_HEADERS = {
+    "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36"
+}
+HTTP_TIMEOUT = (5, 15)              # (连接超时, 读取超时)，单位秒
+HTTP_MAX_RETRIES = 3                # 5xx响应、超时和连接错误的最大重试次数
+HTTP_BACKOFF_BASE = 0.5             # 指数退避的基础等待时间（秒）
+HTTP_BACKOFF_MAX = 8.0              # 单次退避的最长等待时间（秒）
+HTTP_MAX_CONNECTIONS_PER_HOST = 8   # 单个主机的最大并发请求数，同时也是该主机的连接池大小
+HTTP_MIN_INTERVAL = 0.05            # 所有请求共享的全局最小请求间隔（秒）
+
+# 批量获取多只基金数据时的线程数
+BATCH_MAX_WORKERS = 6
+
+# 全市场最新净值快照（基金排行接口），一次分页请求返回所有开放式基金的最新单位净值和累计净值
+SNAPSHOT_PATH = "/data/rankhandler.aspx"
+SNAPSHOT_REFERER = "http://fund.eastmoney.com/data/fundranking.html"
+SNAPSHOT_PAGE_SIZE = 10000      # 每页基金数量，全市场通常只需一到两页
+SNAPSHOT_MIN_FUNDS = 5          # 批量获取的基金数不少于该数量时，先用快照追加最新净值
+
+# 先返回缓存、再后台更新（get_fund_data_stale）时使用的后台线程数
+BACKGROUND_MAX_WORKERS = 2
+_background_executor = None
+_background_lock = threading.Lock()
+
+# 缺口检测：缓存中间缺失的日期窗口超过该数量时，合并为一个覆盖全部缺口的窗口获取
+GAP_MAX_WINDOWS = 10
+
+# 进程内共享的净值数据LRU缓存（按占用字节数限制大小），所有会话共享同一份只读数据
+FRAME_CACHE_MAX_BYTES = int(os.environ.get('FUND_FRAME_CACHE_MB', '256')) * 1024 * 1024
+_frame_cache = OrderedDict()    # fund_code -> (缓存版本, 完整DataFrame, 元数据, 字节数)
+_frame_cache_bytes = 0
+_frame_cache_stats = {'hits': 0, 'misses': 0, 'evictions': 0}
+_frame_cache_lock = threading.Lock()
+
+# 正在进行中的基金数据更新（single-flight），键为(基金代码, 结束日期, 数据源)
+_inflight_calls = {}
+_inflight_lock = threading.Lock()
+
+_http_session = None
+_http_lock = threading.Lock()
+_host_semaphores = {}
+_global_rate_limiter = _RateLimiter(HTTP_MIN_INTERVAL)
+
+def _get_http_session():
+    """获取模块共享的HTTP会话（keep-alive连接池），首次调用时创建"""
+    global _http_session
+    with _http_lock:
+        if _http_session is None:
+            session = requests.Session()
+            session.headers.update(HTTP_HEADERS)
+            adapter = HTTPAdapter(pool_connections=4, pool_maxsize=HTTP_MAX_CONNECTIONS_PER_HOST)
+            session.mount('http://', adapter)
+            session.mount('https://', adapter)
+            _http_session = session
+        return _http_session
+
+def _get_host_semaphore(host):
+    """获取限制单个主机并发请求数的信号量"""
+    with _http_lock:
+        if host not in _host_semaphores:
+            _host_semaphores[host] = threading.BoundedSemaphore(HTTP_MAX_CONNECTIONS_PER_HOST)
+        return _host_semaphores[host]
+
+def _http_get(url, timeout=None, rate_limiter=None, **kwargs):
+    """通过共享会话发送GET请求
+
+    5xx响应、超时和连接错误按指数退避加随机抖动重试，重试耗尽后抛出最后一次的异常；
+    同一主机的并发请求数不超过HTTP_MAX_CONNECTIONS_PER_HOST，所有请求受全局限速器约束，
+    rate_limiter可额外指定更严格的接口级限速器。
+    """
+    session = _get_http_session()
+    semaphore = _get_host_semaphore(urlparse(url).netloc)
+    if timeout is None:
+        timeout = HTTP_TIMEOUT
+    
+    for attempt in range(HTTP_MAX_RETRIES + 1):
+        if rate_limiter is not None:
+            rate_limiter.wait()
+        _global_rate_limiter.wait()
+        try:
+            with semaphore:
+                response = session.get(url, timeout=timeout, **kwargs)
+            if response.status_code < 500:
+                return response
+            error = requests.HTTPError(f"服务器返回错误状态码: {response.status_code}", response=response)
+        except (requests.Timeout, requests.ConnectionError) as e:
+            error = e
+        
+        if attempt == HTTP_MAX_RETRIES:
+            raise error
+        delay = min(HTTP_BACKOFF_MAX, HTTP_BACKOFF_BASE * (2 ** attempt))
+        delay = random.uniform(delay / 2, delay)
+        print(f"请求失败（{str(error)}），{delay:.1f}秒后进行第{attempt + 1}次重试: {url}")
+        time.sleep(delay)
+
+# 基金信息缓存有效期（秒）：名称、公司、类型等静态字段保留数天，申购状态等动态字段保留数小时
+FUND_INFO_STATIC_TTL = 3 * 24 * 3600
+FUND_INFO_DYNAMIC_TTL = 6 * 3600
+
+_fund_info_memo = {}    # 进程内基金信息缓存：fund_code -> 缓存记录
+_fund_info_lock = threading.Lock()
+
+# 历史净值数据源：
+#   'lsjz'      - F10DataApi分页HTML表格接口，逐页获取
+#   'pingzhong' - pingzhongdata脚本接口，一次请求返回完整的单位净值和累计净值走势
+#   'auto'      - 完整历史使用pingzhong，增量更新使用lsjz，pingzhong失败时回退到lsjz
+HISTORY_SOURCES = ('auto', 'pingzhong', 'lsjz')
+DEFAULT_HISTORY_SOURCE = 'auto'
+
+def get_fund_info(fund_code, use_cache=True, static_only=False):
+    """获取基金基本信息，包括基金名称、公司、类型等
+
+    结果先查进程内缓存，再查磁盘缓存（{fund_code}_info.json），均按字段分组的有效期判断是否过期：
+    静态字段过期时重新完整获取；仅申购状态等动态字段过期时只请求搜索API刷新这些字段。
+    static_only为True时只要求静态字段有效（例如仅需判断是否为货币基金），不会因动态字段过期而发起请求。
+    """
+    if not use_cache:
+        return copy.deepcopy(_refresh_fund_info(fund_code))
+    
+    with _fund_info_lock:
+        record = _fund_info_memo.get(fund_code)
+    if record is None:
+        record = _load_fund_info_record(fund_code)
+    
+    now = time.time()
+    if record is not None and now - record['static_time'] < FUND_INFO_STATIC_TTL:
+        if static_only or now - record['dynamic_time'] < FUND_INFO_DYNAMIC_TTL:
+            return copy.deepcopy(record['fund_info'])
+        # 只有动态字段过期，只刷新申购状态等字段
+        try:
+            item = _fetch_fund_search_item(fund_code)
+            if item is not None:
+                fund_info = dict(record['fund_info'])
+                _apply_dynamic_fields(fund_info, item.get('FundBaseInfo') or {})
+                record = _store_fund_info_record(fund_code, fund_info, record['static_time'])
+                return copy.deepcopy(record['fund_info'])
+        except Exception as e:
+            print(f"刷新基金申购状态时发生错误: {str(e)}")
+        # 刷新失败时继续使用缓存的信息
+        return copy.deepcopy(record['fund_info'])
+    
+    return copy.deepcopy(_refresh_fund_info(fund_code))
+
+def _refresh_fund_info(fund_code):
+    """从网络完整获取基金信息，获取成功时写入缓存"""
+    fund_info = _fetch_fund_info(fund_code)
+    if fund_info.get('fund_name', '未获取到') != '未获取到' or fund_info.get('fund_type', '未获取到') != '未获取到':
+        _store_fund_info_record(fund_code, fund_info)
+    return fund_info
+
+def _fund_info_cache_file(fund_code):
+    return os.path.join(CACHE_DIR, f"{fund_code}_info.json")
+
+def _load_fund_info_record(fund_code):
+    """从磁盘读取基金信息缓存记录并放入进程内缓存，不存在或损坏时返回None"""
+    info_file = _fund_info_cache_file(fund_code)
+    if not os.path.exists(info_file):
+        return None
+    try:
+        with open(info_file, 'r', encoding='utf-8') as f:
+            record = json.load(f)
+        if not all(key in record for key in ('fund_info', 'static_time', 'dynamic_time')):
+            return None
+    except Exception as e:
+        print(f"读取基金信息缓存时发生错误: {str(e)}")
+        return None
+    with _fund_info_lock:
+        _fund_info_memo[fund_code] = record
+    return record
+
+def _store_fund_info_record(fund_code, fund_info, static_time=None):
+    """保存基金信息到进程内缓存和磁盘缓存，返回缓存记录"""
+    now = time.time()
+    record = {
+        'fund_info': fund_info,
+        'static_time': now if static_time is None else static_time,
+        'dynamic_time': now
+    }
+    with _fund_info_lock:
+        _fund_info_memo[fund_code] = record
+    try:
+        if not os.path.exists(CACHE_DIR):
+            os.makedirs(CACHE_DIR)
+        with open(_fund_info_cache_file(fund_code), 'w', encoding='utf-8') as f:
+            json.dump(record, f, ensure_ascii=False, indent=4)
+    except Exception as e:
+        print(f"保存基金信息缓存时发生错误: {str(e)}")
+    return record
+
+def _parse_is_buy(isbuy_value):
+    """解析申购状态：1为可申购，2或0为暂停申购，空字符串或其他值为未知"""
+    if isbuy_value == '1':
+        return True
+    elif isbuy_value == '2' or isbuy_value == '0':
+        return False
+    return None
+
+def _apply_dynamic_fields(fund_info, base_info):
+    """用搜索API的FundBaseInfo更新申购状态等动态字段"""
+    fund_info['is_buy'] = _parse_is_buy(base_info.get('ISBUY', ''))
+    fund_info['min_purchase'] = base_info.get('MINSG', 0)
+    fund_info['update_date'] = base_info.get('FSRQ', '')
+
+def _fetch_fund_search_item(fund_code):
+    """请求基金搜索API，返回与基金代码完全匹配的条目，未找到时返回None"""
+    search_url = _api_url(FUND_SEARCH_BASE_URL, f"/FundSearch/api/FundSearchAPI.ashx?callback=&m=1&key={fund_code}")
+    response = _http_get(search_url)
+    data = response.json()
+    if 'Datas' in data and data['Datas']:
+        for item in data['Datas']:
+            if item['CODE'] == fund_code:
+                return item
+    return None
+
+# 基金详情页只需要标题和基本信息表格，解析时只保留这两部分
+_DETAIL_PAGE_STRAINER = SoupStrainer(['div', 'table'], class_=['fundDetail-tit', 'info w790'])
+
+def _fetch_fund_info(fund_code):
+    """从搜索API和基金详情页获取基金基本信息
+
+    先请求搜索API，其JSON已包含名称、类型和基金公司时不再下载详情页；否则从详情页补全缺失的字段
+    """
     try:
         # 初始化返回的字典
         fund_info = {
@@ -35,98 +358,23 @@ def get_fund_info(fund_code):
             'investment_themes': []
         }
         
-        headers = {
-            "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36"
-        }
-        
-        # 首先尝试从基金详情页获取信息
-        detail_url = f"http://fund.eastmoney.com/{fund_code}.html"
-        response = requests.get(detail_url, headers=headers)
-        response.encoding = 'utf-8'
-        soup = BeautifulSoup(response.text, 'html.parser')
-        
-        # 获取基金名称
-        name_element = soup.find('div', class_='fundDetail-tit')
-        if name_element:
-            fund_info['fund_name'] = name_element.find('div').text.strip()
-        
-        # 查找基金信息表格
-        info_table = soup.find('table', class_='info w790')
-        if info_table:
-            rows = info_table.find_all('tr')
-            for row in rows:
-                cells = row.find_all('td')
-                for i, cell in enumerate(cells):
-                    text = cell.text.strip()
-                    if '基金类型' in text and i + 1 < len(cells):
-                        fund_type = cells[i + 1].text.strip()
-                        fund_info['fund_type'] = fund_type
-                        fund_info['is_money_fund'] = '货币型' in fund_type or '保本型' in fund_type
-                    elif '基金管理人' in text and i + 1 < len(cells):
-                        fund_info['fund_company'] = cells[i + 1].text.strip()
+        item = None
+        try:
+            item = _fetch_fund_search_item(fund_code)
+            if item is not None:
+                _apply_search_item(fund_info, item)
+        except Exception as e:
+            print(f"解析搜索API数据时发生错误: {str(e)}")
         
-        # 如果从详情页获取不到完整信息，尝试使用搜索API
-        if fund_info['fund_type'] == '未获取到' or fund_info['fund_company'] == '未获取到':
-            search_url = f"http://fundsuggest.eastmoney.com/FundSearch/api/FundSearchAPI.ashx?callback=&m=1&key={fund_code}"
-            response = requests.get(search_url, headers=headers)
-            
+        # 搜索API缺少名称、类型或基金公司时，从基金详情页补全
+        if '未获取到' in (fund_info['fund_name'], fund_info['fund_type'], fund_info['fund_company']):
             try:
-                data = response.json()
-                if 'Datas' in data and len(data['Datas']) > 0:
-                    for item in data['Datas']:
-                        if item['CODE'] == fund_code:
-                            if fund_info['fund_name'] == '未获取到':
-                                fund_info['fund_name'] = item['NAME']
-                            
-                            # 添加新的字段
-                            base_info = item.get('FundBaseInfo', {})
-                            if base_info:
-                                # 基金经理信息
-                                fund_info['fund_manager'] = base_info.get('JJJL', '未获取到')
-                                fund_info['fund_manager_id'] = base_info.get('JJJLID', '未获取到')
-                                
-                                # 申购相关信息
-                                isbuy_value = base_info.get('ISBUY', '')
-                                # 修正申购状态的判断逻辑：
-                                # 1为可申购，2为暂停申购，空字符串或其他值为未知
-                                if isbuy_value == '1':
-                                    fund_info['is_buy'] = True
-                                elif isbuy_value == '2' or isbuy_value == '0':
-                                    fund_info['is_buy'] = False
-                                else:
-                                    fund_info['is_buy'] = None
-                                
-                                fund_info['min_purchase'] = base_info.get('MINSG', 0)
-                                
-                                # 其他基础信息
-                                fund_info['fund_short_name'] = base_info.get('SHORTNAME', '未获取到')
-                                fund_info['fund_company_id'] = base_info.get('JJGSID', '未获取到')
-                                fund_info['other_name'] = base_info.get('OTHERNAME', '')
-                                fund_info['update_date'] = base_info.get('FSRQ', '')
-                                
-                                # 直接使用FTYPE作为基金类型
-                                if fund_info['fund_type'] == '未获取到':
-                                    fund_type = base_info.get('FTYPE', '未知类型')
-                                    fund_info['fund_type'] = fund_type
-                                    # 更新is_money_fund标志，检查是否为货币型或保本型
-                                    fund_info['is_money_fund'] = '货币型' in fund_type or '保本型' in fund_type
-                                
-                                if fund_info['fund_company'] == '未获取到':
-                                    fund_info['fund_company'] = base_info.get('JJGS', '未获取到')
-                            
-                            # 添加主题投资信息
-                            if 'ZTJJInfo' in item and item['ZTJJInfo']:
-                                themes = []
-                                for theme in item['ZTJJInfo']:
-                                    themes.append({
-                                        'type': theme.get('TTYPE', ''),
-                                        'name': theme.get('TTYPENAME', '')
-                                    })
-                                fund_info['investment_themes'] = themes
-                            
-                            break
+                _apply_detail_page(fund_info, fund_code)
             except Exception as e:
-                print(f"解析搜索API数据时发生错误: {str(e)}")
+                print(f"解析基金详情页时发生错误: {str(e)}")
+        
+        if item is not None and fund_info['fund_type'] == '未获取到':
+            fund_info['fund_type'] = '未知类型'
         
         return fund_info
         
@@ -140,6 +388,73 @@ def get_fund_info(fund_code):
             'is_money_fund': False
         }
 
+def _set_fund_type(fund_info, fund_type):
+    """设置基金类型，并更新is_money_fund标志（货币型或保本型）"""
+    fund_info['fund_type'] = fund_type
+    fund_info['is_money_fund'] = '货币型' in fund_type or '保本型' in fund_type
+
+def _apply_search_item(fund_info, item):
+    """用搜索API返回的条目填充基金信息"""
+    if item.get('NAME'):
+        fund_info['fund_name'] = item['NAME']
+    
+    base_info = item.get('FundBaseInfo') or {}
+    if base_info:
+        # 基金经理信息
+        fund_info['fund_manager'] = base_info.get('JJJL', '未获取到')
+        fund_info['fund_manager_id'] = base_info.get('JJJLID', '未获取到')
+        
+        # 申购状态、最小申购金额、净值日期
+        _apply_dynamic_fields(fund_info, base_info)
+        
+        # 其他基础信息
+        fund_info['fund_short_name'] = base_info.get('SHORTNAME', '未获取到')
+        fund_info['fund_company_id'] = base_info.get('JJGSID', '未获取到')
+        fund_info['other_name'] = base_info.get('OTHERNAME', '')
+        
+        # 直接使用FTYPE作为基金类型
+        if base_info.get('FTYPE'):
+            _set_fund_type(fund_info, base_info['FTYPE'])
+        if base_info.get('JJGS'):
+            fund_info['fund_company'] = base_info['JJGS']
+    
+    # 添加主题投资信息
+    if 'ZTJJInfo' in item and item['ZTJJInfo']:
+        themes = []
+        for theme in item['ZTJJInfo']:
+            themes.append({
+                'type': theme.get('TTYPE', ''),
+                'name': theme.get('TTYPENAME', '')
+            })
+        fund_info['investment_themes'] = themes
+
+def _apply_detail_page(fund_info, fund_code):
+    """从基金详情页补全名称、类型和基金管理人（只解析标题和基本信息表格）"""
+    detail_url = _api_url(FUND_BASE_URL, f"/{fund_code}.html")
+    response = _http_get(detail_url)
+    response.encoding = 'utf-8'
+    soup = BeautifulSoup(response.text, 'lxml', parse_only=_DETAIL_PAGE_STRAINER)
+    
+    # 获取基金名称
+    name_element = soup.find('div', class_='fundDetail-tit')
+    if name_element and fund_info['fund_name'] == '未获取到':
+        fund_info['fund_name'] = name_element.find('div').text.strip()
+    
+    # 查找基金信息表格
+    info_table = soup.find('table', class_='info w790')
+    if info_table:
+        rows = info_table.find_all('tr')
+        for row in rows:
+            cells = row.find_all('td')
+            for i, cell in enumerate(cells):
+                text = cell.text.strip()
+                if '基金类型' in text and i + 1 < len(cells):
+                    if fund_info['fund_type'] == '未获取到':
+                        _set_fund_type(fund_info, cells[i + 1].text.strip())
+                elif '基金管理人' in text and i + 1 < len(cells):
+                    if fund_info['fund_company'] == '未获取到':
+                        fund_info['fund_company'] = cells[i + 1].text.strip()
+
 def map_fund_type_code(type_code):
     """将基金类型代码映射为可读的类型名称"""
     type_mapping = {
@@ -161,273 +476,1468 @@ def map_fund_type_code(type_code):
     
     return type_mapping.get(str(type_code), '未知类型')
 
-def get_cached_fund_data(fund_code):
-    """从本地缓存获取基金数据"""
-    cache_file = os.path.join(CACHE_DIR, f"{fund_code}.csv")
-    meta_file = os.path.join(CACHE_DIR, f"{fund_code}_meta.json")
-    
-    if os.path.exists(cache_file) and os.path.exists(meta_file):
+def _nav_cache_file(fund_code):
+    return os.path.join(CACHE_DIR, f"{fund_code}.nav")
+
+def _legacy_cache_files(fund_code):
+    """旧版缓存格式（CSV数据文件 + JSON元数据文件）的路径"""
+    return os.path.join(CACHE_DIR, f"{fund_code}.csv"), os.path.join(CACHE_DIR, f"{fund_code}_meta.json")
+
+def _build_cache_meta(fund_code, df, last_update=None, previous_meta=None):
+    """根据净值数据生成缓存元数据，previous_meta中的缺口检查进度会被保留"""
+    if last_update is None:
+        last_update = datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+    meta_data = {
+        'last_update': last_update,
+        'fund_code': fund_code,
+        'data_count': len(df),
+        'date_range': {
+            'start': df['date'].min().strftime('%Y-%m-%d'),
+            'end': df['date'].max().strftime('%Y-%m-%d')
+        },
+        'columns': [column for column in NAV_CACHE_COLUMNS if column in df.columns]
+    }
+    if previous_meta is not None:
+        for key in ('gaps_checked_through', 'confirmed_gap_days'):
+            if key in previous_meta:
+                meta_data[key] = previous_meta[key]
+    return meta_data
+
+def _encode_nav_cache_header(meta_data):
+    """将元数据编码为固定长度的文件头：魔数 + 空格填充的JSON"""
+    payload = json.dumps(meta_data, ensure_ascii=False).encode('utf-8')
+    if len(payload) > NAV_CACHE_HEADER_SIZE - len(NAV_CACHE_MAGIC):
+        raise ValueError("缓存元数据过长，超出文件头大小")
+    return NAV_CACHE_MAGIC + payload.ljust(NAV_CACHE_HEADER_SIZE - len(NAV_CACHE_MAGIC), b' ')
+
+def _frame_to_records(df):
+    """将净值DataFrame转换为缓存文件的记录数组（日期存为自1970-01-01起的天数）"""
+    records = np.empty(len(df), dtype=NAV_RECORD_DTYPE)
+    records['date'] = df['date'].values.astype('datetime64[D]').astype(np.int64)
+    records['nav'] = df['nav'].to_numpy(dtype=np.float64)
+    if 'acc_nav' in df.columns:
+        records['acc_nav'] = df['acc_nav'].to_numpy(dtype=np.float64)
+    else:
+        records['acc_nav'] = np.nan
+    return records
+
+def _records_to_frame(records, columns):
+    """将缓存文件的记录数组转换回净值DataFrame"""
+    df = pd.DataFrame({'date': pd.to_datetime(records['date'].astype('datetime64[D]').astype('datetime64[ns]'))})
+    for column in columns:
+        if column != 'date':
+            df[column] = records[column]
+    return df
+
+def _write_nav_cache(fund_code, df, meta_data):
+    """写入二进制净值缓存文件，先写临时文件再原子替换，避免读到写了一半的文件"""
+    cache_file = _nav_cache_file(fund_code)
+    tmp_file = f"{cache_file}.{os.getpid()}.{threading.get_ident()}.tmp"
+    with open(tmp_file, 'wb') as f:
+        f.write(_encode_nav_cache_header(meta_data))
+        f.write(_frame_to_records(df).tobytes())
+    os.replace(tmp_file, cache_file)
+    _invalidate_frame_cache(fund_code)
+    return cache_file
+
+def _decode_nav_cache_header(header, cache_file):
+    """解析文件头中的元数据，格式不正确时抛出ValueError"""
+    if len(header) != NAV_CACHE_HEADER_SIZE or not header.startswith(NAV_CACHE_MAGIC):
+        raise ValueError(f"缓存文件格式不正确: {cache_file}")
+    # JSON和UTF-8解码错误都是ValueError的子类
+    return json.loads(header[len(NAV_CACHE_MAGIC):].decode('utf-8'))
+
+def _read_nav_cache_meta(fund_code):
+    """只读取二进制缓存文件头中的元数据，文件不存在时返回None
+
+    追加写入和元数据更新会原地重写文件头，并发读取可能读到写了一半的文件头，
+    因此解析失败时等待片刻后重读，重读仍失败才视为文件损坏
+    """
+    cache_file = _nav_cache_file(fund_code)
+    if not os.path.exists(cache_file):
+        return None
+    for attempt in range(NAV_CACHE_HEADER_RETRIES + 1):
+        with open(cache_file, 'rb') as f:
+            header = f.read(NAV_CACHE_HEADER_SIZE)
         try:
-            # 读取缓存数据
-            df = pd.read_csv(cache_file)
-            df['date'] = pd.to_datetime(df['date'])
-            
-            # 读取元数据
-            with open(meta_file, 'r') as f:
-                meta_data = json.load(f)
-            
-            # 检查最后更新时间
-            last_update = pd.to_datetime(meta_data['last_update'])
-            current_time = pd.to_datetime(datetime.datetime.now())
-            
-            # 如果今天已经更新过，直接返回缓存数据
-            if last_update.date() == current_time.date():
-                print(f"使用今日已更新的缓存数据（最后更新：{last_update.strftime('%Y-%m-%d %H:%M:%S')}）")
-                return df, True  # 返回第二个参数表示是否是今日数据
-            
-            print(f"找到缓存数据（最后更新：{last_update.strftime('%Y-%m-%d %H:%M:%S')}），检查是否需要更新...")
-            return df, False  # 返回第二个参数表示是否是今日数据
-            
-        except Exception as e:
-            print(f"读取缓存数据时发生错误: {str(e)}")
-            # 如果读取出错，删除可能损坏的缓存文件
-            try:
-                os.remove(cache_file)
-                os.remove(meta_file)
-            except:
-                pass
+            return _decode_nav_cache_header(header, cache_file)
+        except ValueError:
+            if attempt == NAV_CACHE_HEADER_RETRIES:
+                raise
+            time.sleep(NAV_CACHE_HEADER_RETRY_DELAY)
+
+def _to_day_number(value):
+    """将日期转换为自1970-01-01起的天数"""
+    return np.datetime64(pd.to_datetime(value).date(), 'D').astype(np.int64)
+
+def _read_nav_cache(fund_code, start_date=None, end_date=None):
+    """读取二进制缓存文件，返回(DataFrame, 元数据)
+
+    记录区通过内存映射访问，给定日期范围时在日期列上二分查找，只复制范围内的记录，
+    内存占用与请求的窗口大小有关而与基金成立时长无关。
+    只读取文件头中data_count条已提交的记录，追加写入中断时文件末尾残留的半条记录会被忽略
+    """
+    meta_data = _read_nav_cache_meta(fund_code)
+    cache_file = _nav_cache_file(fund_code)
+    count = meta_data['data_count']
+    if os.path.getsize(cache_file) < NAV_CACHE_HEADER_SIZE + count * NAV_RECORD_DTYPE.itemsize:
+        raise ValueError(f"缓存文件记录数与元数据不一致: {cache_file}")
+    
+    if count == 0:
+        records = np.empty(0, dtype=NAV_RECORD_DTYPE)
+    else:
+        mapped = np.memmap(cache_file, dtype=NAV_RECORD_DTYPE, mode='r', offset=NAV_CACHE_HEADER_SIZE, shape=(count,))
+        lo, hi = 0, count
+        if start_date is not None:
+            lo = int(np.searchsorted(mapped['date'], _to_day_number(start_date), side='left'))
+        if end_date is not None:
+            hi = int(np.searchsorted(mapped['date'], _to_day_number(end_date), side='right'))
+        records = np.array(mapped[lo:hi])
+        # 及时释放映射，避免在Windows上阻止之后的文件替换
+        del mapped
+    return _records_to_frame(records, meta_data['columns']), meta_data
+
+def _compact_nav_cache(fund_code):
+    """压缩缓存文件：重新读取全部记录，去重排序后原子地重写整个文件，并重置追加计数"""
+    df, meta_data = _read_nav_cache(fund_code)
+    df = df.drop_duplicates(subset=['date']).sort_values('date').reset_index(drop=True)
+    _write_nav_cache(fund_code, df, _build_cache_meta(fund_code, df, meta_data['last_update'], meta_data))
+    print(f"基金{fund_code}的缓存文件已压缩，共{len(df)}条记录")
+
+def append_fund_data_to_cache(fund_code, new_data):
+    """将增量净值数据追加写入缓存文件，写盘开销只与新增行数有关
+
+    只接受按日期升序且全部晚于缓存最后日期的数据，并且不能引入缓存中没有的列；
+    不满足条件（或还没有缓存）时返回False，由调用方改为完整保存。
+    先在已提交记录之后写入新记录，再原地更新文件头中的元数据，文件头更新前中断不会影响已有数据。
+    每追加CACHE_COMPACT_EVERY次压缩一次文件。使用SQLite净值库时在一个事务中写入新行和元数据。
+    """
+    if new_data.empty:
+        return True
+    try:
+        meta_data = get_cache_meta(fund_code)
+        if meta_data is None:
+            return False
+        
+        dates = new_data['date']
+        if not dates.is_monotonic_increasing or dates.duplicated().any():
+            return False
+        if dates.iloc[0] <= pd.to_datetime(meta_data['date_range']['end']):
+            return False
+        if 'acc_nav' in new_data.columns and 'acc_nav' not in meta_data['columns']:
+            return False
+        
+        committed_count = meta_data['data_count']
+        committed_end = meta_data['date_range']['end']
+        meta_data['last_update'] = datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+        meta_data['data_count'] += len(new_data)
+        meta_data['date_range']['end'] = dates.iloc[-1].strftime('%Y-%m-%d')
+        
+        _invalidate_frame_cache(fund_code)
+        if _use_sqlite_store():
+            fund_store.append_fund_data(fund_code, new_data, meta_data)
+            print(f"已追加{len(new_data)}条数据到净值库: {fund_store.STORE_PATH}")
+            _advance_metric_state(fund_code, new_data, committed_count, committed_end)
+            return True
+        
+        meta_data['appends_since_compaction'] = meta_data.get('appends_since_compaction', 0) + 1
+        records = _frame_to_records(new_data)
+        with open(_nav_cache_file(fund_code), 'r+b') as f:
+            # 从已提交记录的末尾开始写，覆盖之前中断时可能残留的未提交数据
+            f.seek(NAV_CACHE_HEADER_SIZE + committed_count * NAV_RECORD_DTYPE.itemsize)
+            f.write(records.tobytes())
+            f.truncate()
+            f.flush()
+            os.fsync(f.fileno())
+            f.seek(0)
+            f.write(_encode_nav_cache_header(meta_data))
+        _invalidate_frame_cache(fund_code)
+        _advance_metric_state(fund_code, new_data, committed_count, committed_end)
+        
+        print(f"已追加{len(records)}条数据到缓存: {_nav_cache_file(fund_code)}")
+        if meta_data['appends_since_compaction'] >= CACHE_COMPACT_EVERY:
+            _compact_nav_cache(fund_code)
+        return True
+    except Exception as e:
+        print(f"追加缓存数据时发生错误: {str(e)}")
+        return False
+
+def _migrate_legacy_cache(fund_code):
+    """将旧版CSV + JSON元数据缓存转换为二进制缓存文件，转换成功后删除旧文件
+
+    返回是否进行了转换
+    """
+    cache_file, meta_file = _legacy_cache_files(fund_code)
+    if not (os.path.exists(cache_file) and os.path.exists(meta_file)):
+        return False
+    df = pd.read_csv(cache_file)
+    df['date'] = pd.to_datetime(df['date'])
+    with open(meta_file, 'r') as f:
+        legacy_meta = json.load(f)
+    # 保留原来的最后更新时间，避免迁移本身被当作一次数据更新
+    _write_nav_cache(fund_code, df, _build_cache_meta(fund_code, df, legacy_meta['last_update']))
+    os.remove(cache_file)
+    os.remove(meta_file)
+    print(f"已将基金{fund_code}的CSV缓存转换为二进制缓存格式")
+    return True
+
+def _use_sqlite_store():
+    return CACHE_BACKEND == 'sqlite'
+
+def _import_file_cache_to_store(fund_code):
+    """净值库中没有该基金时，把已有的文件缓存（包括旧版CSV缓存）导入净值库，返回是否导入"""
+    if not os.path.exists(_nav_cache_file(fund_code)) and not _migrate_legacy_cache(fund_code):
+        return False
+    df, meta_data = _read_nav_cache(fund_code)
+    fund_store.save_fund_data(fund_code, df, meta_data)
+    _invalidate_frame_cache(fund_code)
+    print(f"已将基金{fund_code}的缓存文件导入净值库")
+    return True
+
+def get_cache_meta(fund_code):
+    """获取基金缓存的元数据（最后更新时间、数据条数、日期范围、列），没有缓存时返回None"""
+    try:
+        if _use_sqlite_store():
+            meta_data = fund_store.load_meta(fund_code)
+            if meta_data is None and _import_file_cache_to_store(fund_code):
+                meta_data = fund_store.load_meta(fund_code)
+            return meta_data
+        if not os.path.exists(_nav_cache_file(fund_code)):
+            _migrate_legacy_cache(fund_code)
+        return _read_nav_cache_meta(fund_code)
+    except Exception as e:
+        print(f"读取缓存元数据时发生错误: {str(e)}")
+        return None
+
+def _load_cache(fund_code, start_date=None, end_date=None):
+    """从当前缓存后端读取基金数据，返回(DataFrame, 元数据)，没有缓存时返回(None, None)
+
+    给定日期范围时只读取范围内的行（文件缓存通过内存映射二分定位，SQLite净值库通过主键范围扫描）
+    """
+    if _use_sqlite_store():
+        df, meta_data = fund_store.load_fund_data(fund_code, start_date, end_date)
+        if df is None and _import_file_cache_to_store(fund_code):
+            df, meta_data = fund_store.load_fund_data(fund_code, start_date, end_date)
+        return df, meta_data
+    
+    cache_file = _nav_cache_file(fund_code)
+    try:
+        # 首次读取时透明地迁移旧版CSV缓存
+        if not os.path.exists(cache_file):
+            _migrate_legacy_cache(fund_code)
+    except Exception as e:
+        print(f"转换旧版缓存数据时发生错误: {str(e)}")
+    
+    if not os.path.exists(cache_file):
+        return None, None
+    try:
+        return _read_nav_cache(fund_code, start_date, end_date)
+    except Exception as e:
+        # 不删除缓存文件：读到正在写入的文件头时已重读过一次，仍然失败多半是文件确实损坏，
+        # 下一次持有文件锁的更新读不到元数据，会重新获取完整数据并原子地重写文件
+        print(f"读取缓存文件时发生错误: {str(e)}")
+        return None, None
+
+def _cache_version(fund_code):
+    """缓存的版本标识：文件缓存为文件的修改时间和大小，SQLite净值库为元数据；没有缓存时返回None"""
+    if _use_sqlite_store():
+        meta_data = fund_store.load_meta(fund_code)
+        return None if meta_data is None else json.dumps(meta_data, sort_keys=True)
+    try:
+        stat = os.stat(_nav_cache_file(fund_code))
+    except OSError:
+        return None
+    return (stat.st_mtime_ns, stat.st_size)
+
+def _frame_nbytes(df):
+    return int(df.memory_usage(index=True, deep=False).sum())
+
+def _invalidate_frame_cache(fund_code):
+    """本进程写入缓存后移除该基金的共享数据（其他进程的写入通过版本标识发现）"""
+    global _frame_cache_bytes
+    with _frame_cache_lock:
+        entry = _frame_cache.pop(fund_code, None)
+        if entry is not None:
+            _frame_cache_bytes -= entry[3]
+
+def _store_frame(fund_code, version, df, meta_data):
+    """放入LRU缓存，超出FRAME_CACHE_MAX_BYTES时淘汰最久未使用的基金"""
+    global _frame_cache_bytes
+    nbytes = _frame_nbytes(df)
+    if nbytes > FRAME_CACHE_MAX_BYTES:
+        return
+    with _frame_cache_lock:
+        previous = _frame_cache.pop(fund_code, None)
+        if previous is not None:
+            _frame_cache_bytes -= previous[3]
+        _frame_cache[fund_code] = (version, df, meta_data, nbytes)
+        _frame_cache_bytes += nbytes
+        while _frame_cache_bytes > FRAME_CACHE_MAX_BYTES:
+            _, evicted = _frame_cache.popitem(last=False)
+            _frame_cache_bytes -= evicted[3]
+            _frame_cache_stats['evictions'] += 1
+
+def _shallow_slice(df, start_date=None, end_date=None):
+    """按日期范围截取并重建索引，与原数据共享底层数组，不复制净值数据"""
+    df = slice_by_date(df, start_date, end_date).copy(deep=False)
+    df.index = pd.RangeIndex(len(df))
+    return df
+
+def _load_cache_shared(fund_code, start_date=None, end_date=None):
+    """通过进程内LRU缓存读取基金数据，返回(DataFrame, 元数据)，没有缓存时返回(None, None)
+
+    缓存的是完整历史，按日期范围截取后返回共享底层数组的浅拷贝：调用方可以增删列，但不能原地修改净值。
+    缓存文件的版本标识变化（包括其他进程写入）时重新读取。
+    未命中时，给定了日期范围的读取只从缓存后端读取范围内的行（文件缓存的内存映射二分定位），不放入LRU缓存，
+    避免为了一小段区间读入并常驻完整历史；只有不限日期范围的读取才会把完整历史放入LRU缓存
+    """
+    version = _cache_version(fund_code)
+    entry = None
+    with _frame_cache_lock:
+        cached = _frame_cache.get(fund_code)
+        if version is not None and cached is not None and cached[0] == version:
+            _frame_cache.move_to_end(fund_code)
+            _frame_cache_stats['hits'] += 1
+            entry = cached
+        else:
+            _frame_cache_stats['misses'] += 1
+    
+    if entry is None:
+        if start_date is not None or end_date is not None:
+            df, meta_data = _load_cache(fund_code, start_date, end_date)
+            if df is None:
+                return None, None
+            return df.reset_index(drop=True), meta_data
+        df, meta_data = _load_cache(fund_code)
+        if df is None:
+            return None, None
+        if version is None:
+            # 首次读取时迁移或导入了缓存，读取后再确定版本
+            version = _cache_version(fund_code)
+        _store_frame(fund_code, version, df, meta_data)
+    else:
+        _, df, meta_data, _ = entry
+    return _shallow_slice(df, start_date, end_date), copy.deepcopy(meta_data)
+
+def get_frame_cache_stats():
+    """进程内净值数据缓存的统计信息：命中、未命中、淘汰次数，当前基金数和占用字节数"""
+    with _frame_cache_lock:
+        return {
+            **_frame_cache_stats,
+            'entries': len(_frame_cache),
+            'bytes': _frame_cache_bytes,
+            'max_bytes': FRAME_CACHE_MAX_BYTES
+        }
+
+def clear_frame_cache():
+    """清空进程内净值数据缓存并重置统计"""
+    global _frame_cache_bytes
+    with _frame_cache_lock:
+        _frame_cache.clear()
+        _frame_cache_bytes = 0
+        for key in _frame_cache_stats:
+            _frame_cache_stats[key] = 0
+
+def get_cached_fund_data(fund_code, start_date=None, end_date=None):
+    """从本地缓存获取基金数据，给定日期范围时截取范围内的行
+
+    数据来自进程内共享的LRU缓存（见_load_cache_shared），返回的DataFrame应视为只读
+    """
+    try:
+        # 读取缓存数据和元数据
+        df, meta_data = _load_cache_shared(fund_code, start_date, end_date)
+        if df is None:
+            return None, False
+        
+        # 检查最后更新时间
+        last_update = pd.to_datetime(meta_data['last_update'])
+        current_time = pd.to_datetime(datetime.datetime.now())
+        
+        # 如果今天已经更新过，直接返回缓存数据
+        if last_update.date() == current_time.date():
+            print(f"使用今日已更新的缓存数据（最后更新：{last_update.strftime('%Y-%m-%d %H:%M:%S')}）")
+            return df, True  # 返回第二个参数表示是否是今日数据
+        
+        print(f"找到缓存数据（最后更新：{last_update.strftime('%Y-%m-%d %H:%M:%S')}），检查是否需要更新...")
+        return df, False  # 返回第二个参数表示是否是今日数据
+        
+    except Exception as e:
+        print(f"读取缓存数据时发生错误: {str(e)}")
     return None, False
 
-def save_fund_data_to_cache(fund_code, df):
-    """保存基金数据到本地缓存"""
+def _update_cache_meta(fund_code, meta_data):
+    """只更新缓存元数据，不改动净值记录（文件缓存原地重写文件头）"""
+    if _use_sqlite_store():
+        fund_store.save_meta(fund_code, meta_data)
+    else:
+        with open(_nav_cache_file(fund_code), 'r+b') as f:
+            f.write(_encode_nav_cache_header(meta_data))
+    _invalidate_frame_cache(fund_code)
+
+def save_fund_data_to_cache(fund_code, df, gaps_checked_through=None):
+    """保存基金数据到本地缓存
+
+    原有的缺口检查进度会被保留，gaps_checked_through不为None时更新为该日期
+    """
     try:
+        meta_data = _build_cache_meta(fund_code, df, previous_meta=get_cache_meta(fund_code))
+        if gaps_checked_through is not None:
+            meta_data['gaps_checked_through'] = gaps_checked_through
+        if _use_sqlite_store():
+            fund_store.save_fund_data(fund_code, df, meta_data)
+            _invalidate_frame_cache(fund_code)
+            _rebuild_metric_state(fund_code, df)
+            print(f"数据已保存到净值库: {fund_store.STORE_PATH}")
+            return
+        
         # 确保缓存目录存在
         if not os.path.exists(CACHE_DIR):
             os.makedirs(CACHE_DIR)
         
-        # 保存数据文件
-        cache_file = os.path.join(CACHE_DIR, f"{fund_code}.csv")
-        df.to_csv(cache_file, index=False)
-        
-        # 保存元数据
-        meta_file = os.path.join(CACHE_DIR, f"{fund_code}_meta.json")
-        meta_data = {
-            'last_update': datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
-            'fund_code': fund_code,
-            'data_count': len(df),
-            'date_range': {
-                'start': df['date'].min().strftime('%Y-%m-%d'),
-                'end': df['date'].max().strftime('%Y-%m-%d')
-            }
-        }
-        with open(meta_file, 'w') as f:
-            json.dump(meta_data, f, indent=4)
+        # 数据和元数据保存在同一个二进制文件中
+        cache_file = _write_nav_cache(fund_code, df, meta_data)
+        _rebuild_metric_state(fund_code, df)
         
         print(f"数据已缓存到: {cache_file}")
         
     except Exception as e:
         print(f"保存缓存数据时发生错误: {str(e)}")
 
-def get_fund_data(fund_code, start_date=None, end_date=None, fill_missing=False):
-    """获取基金历史净值数据，支持缓存和智能更新"""
+def _metric_state_file(fund_code):
+    return os.path.join(CACHE_DIR, f"{fund_code}_metrics.json")
+
+def _load_metric_state(fund_code):
+    """读取基金的流式指标状态，不存在或损坏时返回None"""
+    state_file = _metric_state_file(fund_code)
+    if not os.path.exists(state_file):
+        return None
     try:
-        # 设置结束日期为当前日期
-        if end_date is None:
-            end_date = datetime.datetime.now().strftime('%Y-%m-%d')
+        with open(state_file, 'r', encoding='utf-8') as f:
+            return MetricState.from_dict(json.load(f))
+    except Exception as e:
+        print(f"读取指标状态时发生错误: {str(e)}")
+        return None
+
+def _save_metric_state(fund_code, state):
+    """保存基金的流式指标状态，先写临时文件再原子替换"""
+    try:
+        if not os.path.exists(CACHE_DIR):
+            os.makedirs(CACHE_DIR)
+        state_file = _metric_state_file(fund_code)
+        tmp_file = f"{state_file}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp_file, 'w', encoding='utf-8') as f:
+            json.dump(state.to_dict(), f, indent=4)
+        os.replace(tmp_file, state_file)
+    except Exception as e:
+        print(f"保存指标状态时发生错误: {str(e)}")
+
+def _remove_metric_state(fund_code):
+    try:
+        os.remove(_metric_state_file(fund_code))
+    except OSError:
+        pass
+
+def _cached_fund_info(fund_code):
+    """只从进程内或磁盘缓存读取基金信息（不发起网络请求），没有缓存时返回None"""
+    with _fund_info_lock:
+        record = _fund_info_memo.get(fund_code)
+    if record is None:
+        record = _load_fund_info_record(fund_code)
+    return None if record is None else record['fund_info']
+
+def _is_money_fund_cached(fund_code, columns):
+    """判断是否为货币基金，只使用已缓存的基金信息（不发起网络请求）；
+    没有缓存的基金信息时按缓存数据是否有累计净值列判断（货币基金没有累计净值）"""
+    fund_info = _cached_fund_info(fund_code)
+    if fund_info is not None:
+        return bool(fund_info.get('is_money_fund', False))
+    return 'acc_nav' not in columns
+
+def _rebuild_metric_state(fund_code, df):
+    """保存完整净值后重新构建指标状态；货币基金的净值列为每万份收益，收益率和回撤没有意义，不维护指标状态"""
+    if _is_money_fund_cached(fund_code, df.columns):
+        _remove_metric_state(fund_code)
+        return
+    _save_metric_state(fund_code, MetricState.from_history(df['nav'], df['date']))
+
+def _advance_metric_state(fund_code, new_data, committed_count, committed_end):
+    """缓存追加新净值后同步推进指标状态；状态与追加前的缓存不一致时删除，下次读取时重新构建"""
+    state = _load_metric_state(fund_code)
+    if state is None:
+        return
+    if _is_money_fund_cached(fund_code, new_data.columns):
+        _remove_metric_state(fund_code)
+        return
+    if state.data_count == committed_count and state.last_date == committed_end:
+        state.extend(new_data['nav'], new_data['date'])
+        _save_metric_state(fund_code, state)
+        return
+    _remove_metric_state(fund_code)
+
+def get_fund_metric_state(fund_code, fund_info=None):
+    """
+    获取基金的流式指标状态（MetricState），没有缓存或为货币基金时返回None
+
+    状态随缓存的保存和追加同步更新，读取开销与历史长度无关；
+    状态文件缺失或与缓存不一致时，从缓存的完整净值重新构建一次并保存。
+    fund_info为调用方已有的基金信息，用于判断是否为货币基金；不传时只使用已缓存的基金信息，不发起网络请求
+    """
+    meta_data = get_cache_meta(fund_code)
+    if meta_data is None:
+        return None
+    if fund_info is not None:
+        is_money_fund = fund_info.get('is_money_fund', False)
+    else:
+        is_money_fund = _is_money_fund_cached(fund_code, meta_data['columns'])
+    if is_money_fund:
+        return None
+    state = _load_metric_state(fund_code)
+    if state is not None and state.data_count == meta_data['data_count'] \
+            and state.last_date == meta_data['date_range']['end']:
+        return state
+    
+    df, _ = _load_cache_shared(fund_code)
+    if df is None:
+        return None
+    state = MetricState.from_history(df['nav'], df['date'])
+    _save_metric_state(fund_code, state)
+    return state
+
+def slice_by_date(df, start_date=None, end_date=None):
+    """按日期范围截取按日期升序排列的净值数据（包含两端），通过二分查找定位，不构造布尔掩码"""
+    if df.empty or (start_date is None and end_date is None):
+        return df
+    dates = df['date'].values
+    lo = 0 if start_date is None else np.searchsorted(dates, np.datetime64(pd.to_datetime(start_date)), side='left')
+    hi = len(df) if end_date is None else np.searchsorted(dates, np.datetime64(pd.to_datetime(end_date)), side='right')
+    return df.iloc[lo:hi]
+
+def find_cache_gaps(dates):
+    """对照交易日历找出升序日期序列中间缺失的交易日，返回[(窗口开始, 窗口结束), ...]
+
+    只检查第一个和最后一个日期之间、交易日历覆盖年份内的交易日，连续缺失的交易日合并为一个窗口
+    """
+    dates = pd.DatetimeIndex(dates)
+    if len(dates) == 0:
+        return []
+    first = max(dates[0], pd.Timestamp(f"{trading_calendar.CALENDAR_START_YEAR}-01-01"))
+    last = min(dates[-1], pd.Timestamp(f"{trading_calendar.CALENDAR_END_YEAR}-12-31"))
+    expected = trading_calendar.trading_days(first, last)
+    missing = np.flatnonzero(~expected.isin(dates))
+    if len(missing) == 0:
+        return []
+    # 在交易日序列中位置不相邻的缺失日期分属不同窗口
+    groups = np.split(missing, np.flatnonzero(np.diff(missing) != 1) + 1)
+    return [(expected[group[0]], expected[group[-1]]) for group in groups]
+
+def _merge_nav_frames(cached, fetched):
+    """合并缓存数据和补充获取的数据：缓存中已有的值保持不变，只补充缺失的行和缺失的累计净值"""
+    merged = cached.set_index('date').combine_first(fetched.set_index('date')).reset_index()
+    return merged[[column for column in NAV_CACHE_COLUMNS if column in merged.columns]]
+
+def _backfill_acc_nav(fund_code, source, new_data=None):
+    """只为缺少累计净值的日期范围获取数据并按列补齐，不重新加载完整历史
+
+    new_data为同时需要写入的增量数据。补齐成功时返回写入缓存的完整数据，失败时返回None
+    """
+    cached, _ = _load_cache(fund_code)
+    if cached is None or cached.empty:
+        return None
+    missing = cached['acc_nav'].isna() if 'acc_nav' in cached.columns else pd.Series(True, index=cached.index)
+    missing_dates = cached.loc[missing, 'date']
+    if missing_dates.empty:
+        return None
+    
+    # 缺失范围从最早的净值开始时不传开始日期，auto模式下一次请求即可获取完整走势
+    start_date = None if missing_dates.iloc[0] == cached['date'].iloc[0] else missing_dates.iloc[0].strftime('%Y-%m-%d')
+    end_date = missing_dates.iloc[-1].strftime('%Y-%m-%d')
+    print(f"补齐 {missing_dates.iloc[0].strftime('%Y-%m-%d')} 至 {end_date} 的累计净值（共{len(missing_dates)}条）...")
+    try:
+        fetched = _fetch_history(fund_code, start_date, end_date, source)
+    except Exception as e:
+        print(f"获取累计净值数据时发生错误: {str(e)}")
+        return None
+    if fetched.empty or 'acc_nav' not in fetched.columns:
+        print("未获取到累计净值数据")
+        return None
+    
+    fetched = fetched.loc[fetched['date'].isin(missing_dates), ['date', 'acc_nav']]
+    merged = _merge_nav_frames(cached, fetched)
+    if new_data is not None and not new_data.empty:
+        merged = _merge_nav_frames(merged, new_data)
+    save_fund_data_to_cache(fund_code, merged)
+    return merged
+
+def _repair_cache_gaps(fund_code, meta_data, needs_acc_nav):
+    """检查上次检查之后新增的缓存数据中间缺失的交易日（以及缺失的累计净值），只获取缺失的日期窗口并补齐
+
+    补齐后（或确认上游也没有这些数据后）把检查进度记录到元数据的gaps_checked_through，
+    上游同样缺失的交易日数累计在confirmed_gap_days中，之后不再重复获取。
+    有窗口获取失败时只保存已获取到的数据，检查进度和确认缺失的天数都不变，下次更新时重试。返回是否重写了缓存
+    """
+    checked_through = meta_data.get('gaps_checked_through')
+    cache_end = meta_data['date_range']['end']
+    if checked_through is not None and checked_through >= cache_end:
+        return False
+    
+    try:
+        # 从检查进度当天（包含）开始扫描：检查进度之后紧接着的缺口需要它之前的最后一行才能发现
+        scan_start = checked_through
+        scanned, _ = _load_cache(fund_code, scan_start)
+        if scanned is None or scanned.empty:
+            return False
         
-        # 获取缓存数据
-        cached_data, is_today = get_cached_fund_data(fund_code)
+        windows = find_cache_gaps(scanned['date'])
+        if needs_acc_nav and 'acc_nav' in scanned.columns:
+            missing_acc_nav = scanned.loc[scanned['acc_nav'].isna(), 'date']
+            if not missing_acc_nav.empty:
+                windows.append((missing_acc_nav.iloc[0], missing_acc_nav.iloc[-1]))
         
-        if cached_data is not None:
-            # 获取基金类型信息，判断是否为货币基金
-            fund_info = get_fund_info(fund_code)
-            is_money_fund = fund_info.get('is_money_fund', False)
-            
-            # 检查缓存数据是否包含累计净值（对于非货币基金）
-            has_acc_nav = 'acc_nav' in cached_data.columns
-            needs_acc_nav = not is_money_fund  # 非货币基金需要累计净值
-            
-            # 读取元数据信息
-            meta_file = os.path.join(CACHE_DIR, f"{fund_code}_meta.json")
-            with open(meta_file, 'r') as f:
-                meta_data = json.load(f)
-            
-            if is_today and (has_acc_nav or not needs_acc_nav):
-                # 如果是今天的数据且包含所需的累计净值数据(或者是货币基金不需要累计净值)，直接返回
-                print(f"使用今日已更新的缓存数据（最后更新：{meta_data['last_update']}）")
-                return cached_data
-            elif is_today and needs_acc_nav and not has_acc_nav:
-                # 如果是今天的数据但非货币基金缺少累计净值，需要重新获取
-                print(f"缓存数据缺少累计净值，重新获取完整数据...")
-                df = fetch_fund_data_from_api(fund_code, None, None)
-                if not df.empty:
-                    save_fund_data_to_cache(fund_code, df)
-                return df
-            
-            # 获取缓存的最后一个日期
-            last_cache_date = cached_data['date'].max()
-            current_date = pd.to_datetime(end_date)
-            
-            # 如果缓存数据不是最新的，获取增量更新
-            if current_date.date() > last_cache_date.date():
-                # 获取元数据里的最后更新时间
-                last_update = pd.to_datetime(meta_data['last_update'])
-                current_time = pd.to_datetime(datetime.datetime.now())
-                
-                # 计算最后更新时间与当前时间的时间差（小时）
-                hours_diff = (current_time - last_update).total_seconds() / 3600
-                
-                # 如果最后更新时间在24小时内，且今天不是交易日或者最后一个交易日就是缓存数据的最后日期，则不更新
-                today = datetime.datetime.now().date()
-                is_weekend = today.weekday() >= 5  # 周六和周日
-                
-                # 判断是否需要更新
-                if hours_diff < 24 and (is_weekend or last_cache_date.date() == pd.to_datetime(end_date).date()) and (has_acc_nav or not needs_acc_nav):
-                    print(f"缓存数据已在24小时内更新过（{last_update.strftime('%Y-%m-%d %H:%M:%S')}），无需频繁更新")
-                    df = cached_data
-                    return df
-                
+        if not windows:
+            meta_data['gaps_checked_through'] = cache_end
+            _update_cache_meta(fund_code, meta_data)
+            return False
+        
+        windows.sort()
+        if len(windows) > GAP_MAX_WINDOWS:
+            # 缺口过多时合并为一个窗口，分页接口一次获取
+            windows = [(windows[0][0], max(end for _, end in windows))]
+        print(f"检测到缓存数据中有{len(windows)}个缺失的日期窗口，只获取缺失部分...")
+        
+        frames = []
+        failed_windows = 0
+        for window_start, window_end in windows:
+            # 窗口向两侧各扩展一个交易日：缺口两侧的净值在缓存中一定存在，获取成功时结果不会为空；
+            # 结果为空说明请求失败（分页接口第一页失败时返回空表），不能据此确认上游也缺失
+            fetch_start = trading_calendar.previous_trading_day(window_start, inclusive=False)
+            fetch_end = trading_calendar.next_trading_day(window_end)
+            frame = fetch_fund_data_from_api(fund_code, fetch_start.strftime('%Y-%m-%d'), fetch_end.strftime('%Y-%m-%d'))
+            if frame.empty:
+                failed_windows += 1
+            else:
+                frames.append(frame)
+        
+        cached, _ = _load_cache(fund_code)
+        if cached is None:
+            return False
+        merged = _merge_nav_frames(cached, pd.concat(frames, ignore_index=True)) if frames else cached
+        unchanged = len(merged) == len(cached) and merged.equals(cached)
+        
+        if failed_windows:
+            print(f"有{failed_windows}个缺失窗口获取失败，下次更新时重试")
+            if unchanged:
+                return False
+            save_fund_data_to_cache(fund_code, merged)
+            return True
+        
+        # 所有窗口都获取成功后仍然缺失的交易日说明上游也没有数据
+        remaining = find_cache_gaps(slice_by_date(merged, scan_start)['date'])
+        confirmed_days = sum(len(trading_calendar.trading_days(start, end)) for start, end in remaining)
+        meta_data['confirmed_gap_days'] = meta_data.get('confirmed_gap_days', 0) + confirmed_days
+        if unchanged:
+            meta_data['gaps_checked_through'] = cache_end
+            _update_cache_meta(fund_code, meta_data)
+            print(f"上游数据同样缺失，已确认{confirmed_days}个交易日没有净值")
+            return False
+        
+        _update_cache_meta(fund_code, meta_data)   # 先记录确认缺失的天数，保存数据时会保留
+        save_fund_data_to_cache(fund_code, merged, gaps_checked_through=cache_end)
+        print(f"已补齐缺失数据{len(merged) - len(cached)}条，仍缺失{confirmed_days}个交易日")
+        return True
+    except Exception as e:
+        # 补齐失败不影响正常返回数据，检查进度不前进，下次继续尝试
+        print(f"补齐缓存缺失数据时发生错误: {str(e)}")
+        return False
+
+class _InflightCall:
+    """一次进行中的更新，等待者通过event等待并共享它的结果或异常"""
+    
+    def __init__(self):
+        self.event = threading.Event()
+        self.result = None
+        self.error = None
+
+def _single_flight(key, func):
+    """同一个key同时只执行一次func，并发的其他调用等待这次执行完成并共享结果"""
+    with _inflight_lock:
+        call = _inflight_calls.get(key)
+        is_leader = call is None
+        if is_leader:
+            call = _InflightCall()
+            _inflight_calls[key] = call
+    
+    if not is_leader:
+        call.event.wait()
+        if call.error is not None:
+            raise call.error
+        return call.result
+    
+    try:
+        call.result = func()
+        return call.result
+    except BaseException as e:
+        call.error = e
+        raise
+    finally:
+        with _inflight_lock:
+            _inflight_calls.pop(key, None)
+        call.event.set()
+
+@contextmanager
+def _fund_file_lock(fund_code):
+    """基金级别的跨进程文件锁，保证多个进程（例如多个Streamlit实例）不会同时下载和写入同一只基金的缓存"""
+    os.makedirs(CACHE_DIR, exist_ok=True)
+    lock_file = os.path.join(CACHE_DIR, f"{fund_code}.lock")
+    with open(lock_file, 'a+b') as f:
+        if fcntl is not None:
+            fcntl.flock(f.fileno(), fcntl.LOCK_EX)
+        else:
+            f.seek(0)
+            while True:
+                try:
+                    msvcrt.locking(f.fileno(), msvcrt.LK_LOCK, 1)
+                    break
+                except OSError:
+                    # LK_LOCK重试10次（约10秒）后仍未获得锁会抛出异常，继续等待
+                    continue
+        try:
+            yield
+        finally:
+            if fcntl is not None:
+                fcntl.flock(f.fileno(), fcntl.LOCK_UN)
+            else:
+                f.seek(0)
+                msvcrt.locking(f.fileno(), msvcrt.LK_UNLCK, 1)
+
+def _update_fund_cache_locked(fund_code, end_date, source):
+    """持有基金文件锁时更新缓存
+
+    获得锁之后_update_fund_cache会重新读取缓存元数据，如果其他进程刚刚完成了更新，就不会再次下载
+    """
+    with _fund_file_lock(fund_code):
+        return _update_fund_cache(fund_code, end_date, source)
+
+def _update_fund_cache(fund_code, end_date, source):
+    """根据缓存元数据判断是否需要更新，并获取增量或完整历史数据写入缓存
+
+    重新获取了完整历史时返回完整数据，否则返回None，由调用方按日期范围读取缓存
+    """
+    # 获取缓存元数据
+    meta_data = get_cache_meta(fund_code)
+    df = None   # 只有重新获取了完整历史时才在内存中持有完整数据
+
+    if meta_data is not None:
+        # 获取基金类型信息，判断是否为货币基金
+        fund_info = get_fund_info(fund_code, static_only=True)
+        is_money_fund = fund_info.get('is_money_fund', False)
+
+        # 检查缓存数据是否包含累计净值（对于非货币基金）
+        has_acc_nav = 'acc_nav' in meta_data['columns']
+        needs_acc_nav = not is_money_fund  # 非货币基金需要累计净值
+
+        # 检查最后更新时间是否为今天
+        last_update = pd.to_datetime(meta_data['last_update'])
+        is_today = last_update.date() == datetime.datetime.now().date()
+
+        # 获取缓存的最后一个日期
+        last_cache_date = pd.to_datetime(meta_data['date_range']['end'])
+        current_date = pd.to_datetime(end_date)
+
+        if is_today and (has_acc_nav or not needs_acc_nav):
+            # 如果是今天的数据且包含所需的累计净值数据(或者是货币基金不需要累计净值)，直接使用缓存
+            print(f"使用今日已更新的缓存数据（最后更新：{meta_data['last_update']}）")
+        elif is_today and needs_acc_nav and not has_acc_nav:
+            # 如果是今天的数据但非货币基金缺少累计净值，按列补齐累计净值
+            print(f"缓存数据缺少累计净值，补齐累计净值...")
+            df = _backfill_acc_nav(fund_code, source)
+
+        # 如果缓存数据不是最新的，获取增量更新
+        elif current_date.date() > last_cache_date.date():
+            # 根据交易日历和净值公布时间，推算请求范围内最晚可能已公布净值的交易日
+            latest_nav_date = min(
+                trading_calendar.expected_latest_nav_date(fund_info.get('fund_type')),
+                trading_calendar.previous_trading_day(current_date)
+            )
+
+            # 缓存已包含该交易日的净值时，不可能有新数据，无需发起网络请求
+            if last_cache_date.date() >= latest_nav_date and (has_acc_nav or not needs_acc_nav):
+                print(f"缓存数据已包含最新可公布的净值（{latest_nav_date.strftime('%Y-%m-%d')}），无需更新")
+            else:
                 print(f"缓存数据需要更新，获取 {last_cache_date.strftime('%Y-%m-%d')} 之后的数据...")
                 # 获取增量数据
                 increment_start = (last_cache_date + datetime.timedelta(days=1)).strftime('%Y-%m-%d')
-                new_data = fetch_fund_data_from_api(fund_code, increment_start, end_date)
-                
-                if not new_data.empty:
+                try:
+                    new_data = _fetch_history(fund_code, increment_start, end_date, source)
+                except Exception as e:
+                    # 增量获取失败（例如有分页请求失败）时不改动缓存和更新时间，继续使用已有的缓存数据
+                    print(f"获取增量数据时发生错误: {str(e)}，使用已有的缓存数据")
+                    new_data = None
+
+                if new_data is None:
+                    pass
+                elif not new_data.empty:
                     # 判断新数据中是否包含累计净值
                     includes_acc_nav = 'acc_nav' in new_data.columns
-                    
+
                     # 判断缓存数据是否包含累计净值，如果不包含但新数据中有，则需要重新获取完整数据
                     if includes_acc_nav and not has_acc_nav and needs_acc_nav:
-                        print("检测到新数据包含累计净值而缓存数据不包含，重新获取完整数据...")
-                        df = fetch_fund_data_from_api(fund_code, None, None)
-                        if not df.empty:
-                            save_fund_data_to_cache(fund_code, df)
-                        return df
-                    
-                    # 合并新旧数据
-                    df = pd.concat([cached_data, new_data], ignore_index=True)
-                    df = df.drop_duplicates(subset=['date']).sort_values('date')
-                    # 更新缓存
-                    save_fund_data_to_cache(fund_code, df)
-                    print("缓存数据已更新")
+                        print("检测到新数据包含累计净值而缓存数据不包含，补齐累计净值...")
+                        df = _backfill_acc_nav(fund_code, source, new_data)
+                        if df is None:
+                            # 补齐失败时仍然保存增量数据
+                            cached_data, _ = _load_cache(fund_code)
+                            if cached_data is not None:
+                                save_fund_data_to_cache(fund_code, _merge_nav_frames(cached_data, new_data))
+                    else:
+                        # 增量数据都在缓存最后日期之后时，只需追加写入缓存文件
+                        new_data = new_data.sort_values('date')
+                        if not (new_data['date'].min() > last_cache_date and append_fund_data_to_cache(fund_code, new_data)):
+                            # 合并新旧数据，读取缓存失败时不写入，避免只用增量数据覆盖缓存
+                            cached_data, _ = _load_cache(fund_code)
+                            if cached_data is not None:
+                                merged = pd.concat([cached_data, new_data], ignore_index=True)
+                                merged = merged.drop_duplicates(subset=['date']).sort_values('date')
+                                # 更新缓存
+                                save_fund_data_to_cache(fund_code, merged)
+                                print("缓存数据已更新")
+                        else:
+                            print("缓存数据已更新")
                 else:
                     print("没有新数据需要更新")
-                    df = cached_data
+        else:
+            # 即使缓存数据是最新的，如果是非货币基金但缺少累计净值，也需要重新获取
+            if needs_acc_nav and not has_acc_nav:
+                print("缓存数据缺少累计净值，补齐累计净值...")
+                df = _backfill_acc_nav(fund_code, source)
             else:
-                # 即使缓存数据是最新的，如果是非货币基金但缺少累计净值，也需要重新获取
-                if needs_acc_nav and not has_acc_nav:
-                    print("缓存数据缺少累计净值，重新获取完整数据...")
-                    df = fetch_fund_data_from_api(fund_code, None, None)
-                    if not df.empty:
-                        save_fund_data_to_cache(fund_code, df)
-                    return df
-                
                 print("缓存数据已是最新，无需更新")
-                df = cached_data
-        else:
-            # 获取完整历史数据
-            print(f"未找到缓存数据，开始获取基金{fund_code}的完整历史数据...")
-            df = fetch_fund_data_from_api(fund_code, None, None)  # 不需要传入日期参数
-            if not df.empty:
-                save_fund_data_to_cache(fund_code, df)
         
-        # 填充非交易日数据
-        if fill_missing and not df.empty:
-            # 检查是否存在acc_nav列
-            has_acc_nav = 'acc_nav' in df.columns
-            
-            date_range = pd.date_range(start=df['date'].min(), end=df['date'].max(), freq='D')
-            df = df.set_index('date').reindex(date_range)
-            df = df.ffill()  # 使用ffill()替代fillna(method='ffill')
-            df = df.reset_index().rename(columns={'index': 'date'})
+        # 检查并补齐缓存中间缺失的交易日，重写了缓存时由调用方重新读取
+        meta_data = get_cache_meta(fund_code)
+        if meta_data is not None and _repair_cache_gaps(fund_code, meta_data, needs_acc_nav):
+            df = None
+
+    else:
+        # 获取完整历史数据
+        print(f"未找到缓存数据，开始获取基金{fund_code}的完整历史数据...")
+        df = _fetch_history(fund_code, None, None, source)  # 不需要传入日期参数
+        if not df.empty:
+            save_fund_data_to_cache(fund_code, df)
+    
+    return df
+
+def get_fund_data(fund_code, start_date=None, end_date=None, fill_missing=False, source=None):
+    """获取基金历史净值数据，支持缓存和智能更新
+
+    只返回[start_date, end_date]范围内的数据（start_date为None时从成立日开始）。
+    是否需要更新只依据缓存元数据判断，缓存中的净值通过进程内共享的LRU缓存读取，返回的数据应视为只读。
+    source指定历史数据源（见HISTORY_SOURCES），默认使用DEFAULT_HISTORY_SOURCE
+    """
+    if source is None:
+        source = DEFAULT_HISTORY_SOURCE
+    try:
+        requested_end_date = end_date
+        # 设置结束日期为当前日期
+        if end_date is None:
+            end_date = datetime.datetime.now().strftime('%Y-%m-%d')
         
-        return df
+        # 同一基金同时只有一个更新在进行，其余调用等待并共享它的结果
+        df = _single_flight((fund_code, end_date, source),
+                            lambda: _update_fund_cache_locked(fund_code, end_date, source))
+        if df is None:
+            # 从进程内共享的缓存读取，多个会话查看同一基金时共享同一份数据；
+            # 只传调用方给定的日期范围，不限范围的读取才会把完整历史放入共享缓存
+            df, _ = _load_cache_shared(fund_code, start_date, requested_end_date)
+            if df is None:
+                df = pd.DataFrame()
+        
+        # 按请求的日期范围截取（浅拷贝，不复制净值数据）
+        df = _shallow_slice(df, start_date, end_date)
+        
+        return _fill_missing_dates(df, fill_missing)
     
     except Exception as e:
         print(f"获取基金数据时发生错误: {str(e)}")
         return pd.DataFrame()
 
-def fetch_fund_data_from_api(fund_code, start_date, end_date):
-    """从API获取基金数据，使用分页方式从最新日期往前滚动获取"""
-    all_data = pd.DataFrame()
+def _fill_missing_dates(df, fill_missing):
+    """填充缺失日期的数据：fill_missing为'calendar'时补全所有自然日，否则按交易日历补全缺失的交易日"""
+    if not fill_missing or df.empty:
+        return df
+    if fill_missing == 'calendar':
+        date_range = pd.date_range(start=df['date'].min(), end=df['date'].max(), freq='D')
+    else:
+        date_range = trading_calendar.trading_days(df['date'].min(), df['date'].max())
+        # 保留数据中原有的非交易日记录（例如货币基金的节假日收益）
+        date_range = date_range.union(pd.DatetimeIndex(df['date']))
+    df = df.set_index('date').reindex(date_range)
+    df = df.ffill()  # 使用ffill()替代fillna(method='ffill')
+    df = df.reset_index().rename(columns={'index': 'date'})
+    return df
+
+def _get_background_executor():
+    """获取后台更新使用的线程池，首次调用时创建"""
+    global _background_executor
+    with _background_lock:
+        if _background_executor is None:
+            _background_executor = ThreadPoolExecutor(max_workers=BACKGROUND_MAX_WORKERS,
+                                                      thread_name_prefix='fund-refresh')
+        return _background_executor
+
+def get_fund_data_stale(fund_code, start_date=None, end_date=None, fill_missing=False, source=None):
+    """先返回缓存数据、再在后台更新（stale-while-revalidate），返回(df, future)
+
+    有缓存时立即返回缓存中请求范围内的数据（只需读取本地文件），同时把get_fund_data提交到后台线程池检查并获取增量数据，
+    future完成后的结果就是更新后的数据；没有缓存时与get_fund_data相同，同步获取完整数据，future为None
+    """
+    try:
+        cached_df, _ = _load_cache_shared(fund_code, start_date, end_date)
+    except Exception as e:
+        print(f"读取缓存数据时发生错误: {str(e)}")
+        cached_df = None
+    if cached_df is None:
+        return get_fund_data(fund_code, start_date, end_date, fill_missing=fill_missing, source=source), None
+
+    future = _get_background_executor().submit(get_fund_data, fund_code, start_date, end_date,
+                                               fill_missing=fill_missing, source=source)
+    return _fill_missing_dates(cached_df, fill_missing), future
+
+def _build_snapshot_url(page, per_page):
+    """构造基金排行接口的URL，按基金代码排序获取全部开放式基金"""
+    end_date = datetime.datetime.now().strftime('%Y-%m-%d')
+    start_date = (datetime.datetime.now() - datetime.timedelta(days=365)).strftime('%Y-%m-%d')
+    return _api_url(FUND_BASE_URL, f"{SNAPSHOT_PATH}?op=ph&dt=kf&ft=all&rs=&gs=0&sc=dm&st=asc&sd={start_date}&ed={end_date}"
+                                   f"&qdii=&tabSubtype=,,,,,&pi={page}&pn={per_page}&dx=1")
+
+def fetch_latest_nav_snapshot():
+    """获取全市场开放式基金的最新净值快照
+
+    返回包含fund_code/fund_name/date/nav/acc_nav列的DataFrame。
+    接口要求带Referer，每条记录格式为"代码,名称,拼音,净值日期,单位净值,累计净值,..."；货币基金不在其中
+    """
+    rows = []
+    page = 1
+    while True:
+        response = _http_get(_build_snapshot_url(page, SNAPSHOT_PAGE_SIZE), headers={'Referer': SNAPSHOT_REFERER})
+        text = response.text
+        match = re.search(r'datas:\[(.*?)\]', text, re.S)
+        if not match:
+            raise ValueError("基金排行接口返回的数据格式不正确")
+        for item in re.findall(r'"([^"]*)"', match.group(1)):
+            fields = item.split(',')
+            if len(fields) >= 6:
+                rows.append(fields[:6])
+        
+        pages_match = re.search(r'allPages:\s*(\d+)', text)
+        total_pages = int(pages_match.group(1)) if pages_match else 1
+        if page >= total_pages:
+            break
+        page += 1
+    
+    df = pd.DataFrame(rows, columns=['fund_code', 'fund_name', 'pinyin', 'date', 'nav', 'acc_nav']).drop(columns=['pinyin'])
+    df['date'] = pd.to_datetime(df['date'], format='%Y-%m-%d', errors='coerce')
+    df['nav'] = pd.to_numeric(df['nav'], errors='coerce')
+    df['acc_nav'] = pd.to_numeric(df['acc_nav'], errors='coerce')
+    df = df.dropna(subset=['date', 'nav']).drop_duplicates(subset=['fund_code'])
+    print(f"获取到{len(df)}只基金的最新净值快照")
+    return df.reset_index(drop=True)
+
+def _cached_fund_codes():
+    """列出当前缓存后端中所有已缓存的基金代码"""
+    if _use_sqlite_store():
+        return fund_store.list_funds()['fund_code'].tolist()
+    if not os.path.exists(CACHE_DIR):
+        return []
+    return sorted(name[:-len('.nav')] for name in os.listdir(CACHE_DIR) if name.endswith('.nav'))
+
+def update_cache_from_snapshot(fund_codes=None, snapshot=None):
+    """用全市场最新净值快照批量为已缓存的基金追加最新净值，一次请求代替逐只基金的增量请求
+
+    只有快照中的净值日期恰好是缓存最后日期之后的下一个交易日时才追加，避免在缓存中留下缺口；
+    其余基金（快照日期不连续、货币基金、没有缓存等）保持不变，由get_fund_data按原有逻辑更新。
+    fund_codes为None时处理所有已缓存的基金。返回追加了数据的基金代码列表
+    """
+    if fund_codes is None:
+        fund_codes = _cached_fund_codes()
+    fund_codes = list(dict.fromkeys(fund_codes))
+    if not fund_codes:
+        return []
+    if snapshot is None:
+        snapshot = fetch_latest_nav_snapshot()
+    latest = snapshot.set_index('fund_code')
+    
+    updated = []
+    for fund_code in fund_codes:
+        if fund_code not in latest.index:
+            continue
+        row = latest.loc[fund_code]
+        if pd.isna(row['acc_nav']):
+            continue
+        with _fund_file_lock(fund_code):
+            meta_data = get_cache_meta(fund_code)
+            # 只处理包含累计净值的缓存（货币基金的每万份收益不在快照中）
+            if meta_data is None or 'acc_nav' not in meta_data['columns']:
+                continue
+            last_cache_date = pd.to_datetime(meta_data['date_range']['end'])
+            if row['date'].date() != trading_calendar.next_trading_day(last_cache_date):
+                continue
+            new_data = pd.DataFrame({'date': [row['date']], 'nav': [row['nav']], 'acc_nav': [row['acc_nav']]})
+            if append_fund_data_to_cache(fund_code, new_data):
+                updated.append(fund_code)
+    
+    print(f"已通过净值快照为{len(updated)}只基金追加最新净值")
+    return updated
+
+def _stale_snapshot_candidates(fund_codes):
+    """筛选可以用净值快照更新的基金：已有包含累计净值的缓存，且缓存最后日期早于此刻最晚可能已公布净值的交易日
+
+    只读取缓存元数据和已缓存的基金信息，不发起网络请求
+    """
+    stale_codes = []
+    for fund_code in fund_codes:
+        meta_data = get_cache_meta(fund_code)
+        if meta_data is None or 'acc_nav' not in meta_data['columns']:
+            continue
+        fund_info = _cached_fund_info(fund_code) or {}
+        latest_nav_date = trading_calendar.expected_latest_nav_date(fund_info.get('fund_type'))
+        if pd.to_datetime(meta_data['date_range']['end']).date() < latest_nav_date:
+            stale_codes.append(fund_code)
+    return stale_codes
+
+def get_fund_data_many(fund_codes, max_workers=None, with_info=True, use_snapshot=None, **kwargs):
+    """批量获取多只基金的净值数据（和基金信息），通过线程池并行处理
+
+    这是一个生成器，按完成顺序逐只产出(fund_code, result, error)：
+    成功时result为{'df': 净值数据, 'fund_info': 基金信息}，error为None；
+    失败时result为None，error为异常对象。重复的基金代码只处理一次。
+    其余关键字参数原样传给get_fund_data，所有请求共享HTTP层的全局限速。
+    use_snapshot为True时（None表示获取到最新日期、且缓存需要更新的基金不少于SNAPSHOT_MIN_FUNDS只时）
+    先通过全市场净值快照一次性为缓存需要更新的基金追加最新净值，之后的逐只更新大多可以直接使用缓存；
+    缓存都已是最新时不下载快照。
+    """
+    if max_workers is None:
+        max_workers = BATCH_MAX_WORKERS
+    unique_codes = list(dict.fromkeys(fund_codes))
+    if not unique_codes:
+        return
+    
+    auto_snapshot = use_snapshot is None
+    if auto_snapshot:
+        use_snapshot = len(unique_codes) >= SNAPSHOT_MIN_FUNDS and kwargs.get('end_date') is None
+    if use_snapshot:
+        try:
+            stale_codes = _stale_snapshot_candidates(unique_codes)
+            if stale_codes and (not auto_snapshot or len(stale_codes) >= SNAPSHOT_MIN_FUNDS):
+                update_cache_from_snapshot(stale_codes)
+        except Exception as e:
+            print(f"通过净值快照更新缓存时发生错误: {str(e)}")
+    
+    def load_one(fund_code):
+        fund_info = get_fund_info(fund_code) if with_info else None
+        df = get_fund_data(fund_code, **kwargs)
+        if df.empty:
+            raise ValueError(f"未能获取到基金{fund_code}的净值数据")
+        return {'df': df, 'fund_info': fund_info}
+    
+    with ThreadPoolExecutor(max_workers=min(max_workers, len(unique_codes))) as executor:
+        futures = {executor.submit(load_one, fund_code): fund_code for fund_code in unique_codes}
+        for future in as_completed(futures):
+            fund_code = futures[future]
+            try:
+                yield fund_code, future.result(), None
+            except Exception as e:
+                yield fund_code, None, e
+
+def _fetch_history(fund_code, start_date, end_date, source):
+    """按数据源获取历史净值数据，pingzhong数据源失败时回退到分页接口"""
+    if source not in HISTORY_SOURCES:
+        raise ValueError(f"未知的数据源: {source}")
+    
+    # auto模式下增量更新只有少量数据，分页接口一次请求即可完成
+    use_pingzhong = source == 'pingzhong' or (source == 'auto' and start_date is None)
+    if use_pingzhong:
+        try:
+            df = fetch_fund_data_from_pingzhong(fund_code)
+            if start_date:
+                df = df[df['date'] >= pd.to_datetime(start_date)]
+            if end_date:
+                df = df[df['date'] <= pd.to_datetime(end_date)]
+            if not df.empty:
+                return df.reset_index(drop=True)
+            print("pingzhongdata接口未返回数据，回退到分页接口...")
+        except Exception as e:
+            print(f"从pingzhongdata接口获取数据时发生错误: {str(e)}，回退到分页接口...")
+    return fetch_fund_data_from_api(fund_code, start_date, end_date)
+
+def _extract_js_var(text, var_name):
+    """从pingzhongdata脚本中提取一个JSON变量的值，变量不存在时返回None"""
+    match = re.search(r'var\s+' + var_name + r'\s*=\s*(.*?);\s*(?:/\*|var\s|$)', text, re.S)
+    if not match:
+        return None
+    return json.loads(match.group(1))
+
+def _trend_to_series(points):
+    """将[[时间戳(毫秒), 值], ...]或[{'x': 时间戳, 'y': 值}, ...]格式的走势数据转换为以日期为索引的Series"""
+    if not points:
+        return pd.Series(dtype=float)
+    if isinstance(points[0], dict):
+        timestamps = [point['x'] for point in points]
+        values = [point['y'] for point in points]
+    else:
+        timestamps = [point[0] for point in points]
+        values = [point[1] for point in points]
+    # 时间戳是北京时间零点对应的UTC毫秒数，加8小时后取日期
+    dates = (pd.to_datetime(timestamps, unit='ms') + pd.Timedelta(hours=8)).normalize()
+    return pd.Series(pd.to_numeric(values, errors='coerce'), index=dates)
+
+def fetch_fund_data_from_pingzhong(fund_code):
+    """从pingzhongdata脚本接口一次性获取基金的完整净值走势
+
+    返回与分页接口相同结构的DataFrame：非货币基金包含date/nav/acc_nav列，货币基金包含date/nav列（每万份收益）
+    """
+    print(f"开始从pingzhongdata接口获取基金{fund_code}的完整历史数据...")
+    url = _api_url(FUND_BASE_URL, f"/pingzhongdata/{fund_code}.js")
+    response = _http_get(url)
+    response.encoding = 'utf-8'
+    text = response.text
+    
+    # 脚本中的ishb标记是否为货币基金，缺失时以基金信息为准
+    is_money_fund = _extract_js_var(text, 'ishb')
+    if is_money_fund is None:
+        is_money_fund = get_fund_info(fund_code, static_only=True).get('is_money_fund', False)
+    
+    if is_money_fund:
+        income = _trend_to_series(_extract_js_var(text, 'Data_millionCopiesIncome'))
+        df = pd.DataFrame({'date': income.index, 'nav': income.values})
+    else:
+        nav = _trend_to_series(_extract_js_var(text, 'Data_netWorthTrend'))
+        acc_nav = _trend_to_series(_extract_js_var(text, 'Data_ACWorthTrend'))
+        nav = nav[~nav.index.duplicated(keep='last')]
+        acc_nav = acc_nav[~acc_nav.index.duplicated(keep='last')]
+        df = pd.DataFrame({'date': nav.index, 'nav': nav.values})
+        df['acc_nav'] = acc_nav.reindex(nav.index).values
+    
+    if not df.empty:
+        df = df.dropna(subset=['date', 'nav'])
+        df = df.sort_values('date')
+        df = df.drop_duplicates(subset=['date'])
+        df = df.reset_index(drop=True)
+        print(f"共获取到 {len(df)} 条数据记录，日期范围：{df['date'].min().strftime('%Y-%m-%d')} 至 {df['date'].max().strftime('%Y-%m-%d')}")
+    return df
+
+def _build_lsjz_url(fund_code, page, per_page, start_date=None, end_date=None):
+    """构建历史净值分页接口的URL"""
+    url = _api_url(FUND_BASE_URL, f"/f10/F10DataApi.aspx?type=lsjz&code={fund_code}&per={per_page}&page={page}")
+    if start_date:
+        url += f"&sdate={start_date}&edate={end_date}"
+    return url
+
+def _request_nav_page(fund_code, page, per_page, start_date=None, end_date=None):
+    """请求一页历史净值数据，返回原始响应文本（受所在主机的令牌桶限速器约束）"""
+    url = _build_lsjz_url(fund_code, page, per_page, start_date, end_date)
+    response = _http_get(url, rate_limiter=_get_page_rate_limiter(url))
+    return response.text
+
+def _parse_page_count(text):
+    """从分页接口响应中解析总页数，解析失败时返回None"""
+    match = re.search(r'pages:\s*(\d+)', text)
+    if match:
+        return int(match.group(1))
+    return None
+
+_NAV_ROW_PATTERN = re.compile(r'<tr[^>]*>(.*?)</tr>', re.S)
+_NAV_CELL_PATTERN = re.compile(r'<t([dh])[^>]*>(.*?)</t[dh]>', re.S)
+_NAV_TAG_PATTERN = re.compile(r'<[^>]+>')
+_NAV_DATE_PATTERN = re.compile(r'^\d{4}-\d{2}-\d{2}$')
+
+def _parse_nav_page(text, is_money_fund):
+    """解析一页历史净值数据，返回包含date/nav(/acc_nav)列的DataFrame
+
+    遇到"暂无数据"时返回空DataFrame，表格解析失败时抛出异常
+    """
+    if "暂无数据" in text:
+        return pd.DataFrame()
+    
+    df = _parse_nav_table_fast(text, is_money_fund)
+    if df is not None:
+        return df
+    # 表格结构与预期不一致时退回到pandas的HTML解析
+    return _parse_nav_table_html(text, is_money_fund)
+
+def _to_float(value):
+    """把净值单元格转换为float，无法转换时（如"--"或空白）返回NaN"""
+    try:
+        return float(value.replace('*', '').replace(',', ''))
+    except ValueError:
+        return np.nan
+
+def _parse_nav_table_fast(text, is_money_fund):
+    """按历史净值接口固定的表格结构逐行解析，直接生成datetime64/float64数组
+
+    表头或行结构与预期不一致时返回None，由调用方退回到pd.read_html
+    """
+    nav_header = '每万份收益' if is_money_fund else '单位净值'
+    min_cells = 2 if is_money_fund else 3
+    header_checked = False
+    dates, navs, acc_navs = [], [], []
+    for row in _NAV_ROW_PATTERN.finditer(text):
+        cells = _NAV_CELL_PATTERN.findall(row.group(1))
+        if not cells:
+            continue
+        if cells[0][0] == 'h':
+            # 表头：前几列必须依次是净值日期、单位净值（每万份收益）、累计净值
+            labels = [_NAV_TAG_PATTERN.sub('', cell).strip() for _, cell in cells]
+            if len(labels) < min_cells or labels[0] != '净值日期' or labels[1] != nav_header:
+                return None
+            if not is_money_fund and labels[2] != '累计净值':
+                return None
+            header_checked = True
+            continue
+        if not header_checked or len(cells) < min_cells:
+            return None
+        date = _NAV_TAG_PATTERN.sub('', cells[0][1]).strip().replace('*', '')
+        if not _NAV_DATE_PATTERN.match(date):
+            return None
+        dates.append(date)
+        navs.append(_to_float(_NAV_TAG_PATTERN.sub('', cells[1][1]).strip()))
+        if not is_money_fund:
+            acc_navs.append(_to_float(_NAV_TAG_PATTERN.sub('', cells[2][1]).strip()))
+    if not header_checked:
+        return None
+    
+    data = {
+        'date': np.array(dates, dtype='datetime64[D]').astype('datetime64[ns]'),
+        'nav': np.array(navs, dtype=np.float64)
+    }
+    if not is_money_fund:
+        data['acc_nav'] = np.array(acc_navs, dtype=np.float64)
+    return pd.DataFrame(data)
+
+def _parse_nav_table_html(text, is_money_fund):
+    """使用pd.read_html解析历史净值表格（快速解析失败时的后备方案）"""
+    # 使用StringIO包装HTML内容
+    df = pd.read_html(StringIO(text))[0]
+    if df.empty:
+        return df
+    
+    # 根据基金类型处理不同的列名
+    if is_money_fund:
+        # 货币基金的列名通常是：净值日期、每万份收益、7日年化收益率(%)等
+        df.columns = ['date', 'nav', 'annual_return', 'subscription_status', 'redemption_status', 'dividend'] \
+            if len(df.columns) == 6 else ['date', 'nav', 'annual_return', 'subscription_status', 'redemption_status']
+    else:
+        # 其他基金的列名通常是：净值日期、单位净值、累计净值、日增长率等
+        df.columns = ['date', 'nav', 'acc_nav', 'daily_return', 'subscription_status', 'redemption_status', 'dividend'] \
+            if len(df.columns) == 7 else ['date', 'nav', 'acc_nav', 'daily_return', 'subscription_status', 'redemption_status']
+    
+    # 转换日期列
+    df['date'] = df['date'].replace({'\\*': ''}, regex=True)  # 移除星号
+    # 统一为纳秒精度，与快速解析和缓存读取的结果一致（新版pandas默认解析为微秒精度）
+    df['date'] = pd.to_datetime(df['date'], format='%Y-%m-%d', errors='coerce').astype('datetime64[ns]')
+    
+    # 转换净值列为数值类型
+    df['nav'] = df['nav'].replace({'\\*': '', ',': ''}, regex=True)  # 移除星号和逗号
+    df['nav'] = pd.to_numeric(df['nav'], errors='coerce')
+    
+    # 转换累计净值列为数值类型（对于非货币基金）
+    if not is_money_fund and 'acc_nav' in df.columns:
+        df['acc_nav'] = df['acc_nav'].replace({'\\*': '', ',': ''}, regex=True)
+        df['acc_nav'] = pd.to_numeric(df['acc_nav'], errors='coerce')
+    
+    if is_money_fund:
+        return df[['date', 'nav']]
+    # 对于非货币基金，保存单位净值和累计净值
+    return df[['date', 'nav', 'acc_nav']]
+
+def _parse_record_count(text):
+    """从分页接口响应中解析总记录数，解析失败时返回None"""
+    match = re.search(r'records:\s*(\d+)', text)
+    if match:
+        return int(match.group(1))
+    return None
+
+def _staging_root():
+    return os.path.join(CACHE_DIR, STAGING_DIR_NAME)
+
+def _staging_dir(fund_code, start_date, end_date):
+    """一次分页下载的暂存目录，以基金代码和日期范围区分"""
+    return os.path.join(_staging_root(), f"{fund_code}_{start_date or 'all'}_{end_date or 'latest'}")
+
+def _cleanup_stale_staging():
+    """清理长时间未更新的暂存目录"""
+    root = _staging_root()
+    if not os.path.isdir(root):
+        return
+    now = time.time()
+    for name in os.listdir(root):
+        path = os.path.join(root, name)
+        try:
+            if now - os.path.getmtime(path) > STAGING_MAX_AGE:
+                shutil.rmtree(path, ignore_errors=True)
+        except OSError:
+            pass
+
+def _write_json_atomic(path, data):
+    temp_file = path + '.tmp'
+    with open(temp_file, 'w', encoding='utf-8') as f:
+        json.dump(data, f, ensure_ascii=False)
+    os.replace(temp_file, path)
+
+def _open_staging(fund_code, start_date, end_date, per_page, total_records, total_pages):
+    """打开分页下载的暂存区，返回(暂存目录, 清单)
+
+    清单记录下载参数和已完成的页码；总记录数变化说明有新净值公布、页面边界已经移动，此时丢弃旧的暂存数据重新开始
+    """
+    staging_dir = _staging_dir(fund_code, start_date, end_date)
+    manifest_file = os.path.join(staging_dir, 'manifest.json')
+    manifest = None
+    if os.path.exists(manifest_file):
+        try:
+            with open(manifest_file, 'r', encoding='utf-8') as f:
+                manifest = json.load(f)
+        except Exception:
+            manifest = None
+    
+    if manifest is not None and manifest.get('per_page') == per_page and manifest.get('total_records') == total_records \
+            and manifest.get('total_pages') == total_pages:
+        # 只保留页面文件确实存在的页码
+        manifest['pages_done'] = [page for page in manifest.get('pages_done', [])
+                                  if os.path.exists(os.path.join(staging_dir, f"page_{page}.csv"))]
+        if manifest['pages_done']:
+            print(f"发现未完成的下载，已下载{len(manifest['pages_done'])}页，从断点继续...")
+        return staging_dir, manifest
+    
+    shutil.rmtree(staging_dir, ignore_errors=True)
+    os.makedirs(staging_dir, exist_ok=True)
+    manifest = {
+        'fund_code': fund_code,
+        'start_date': start_date,
+        'end_date': end_date,
+        'per_page': per_page,
+        'total_records': total_records,
+        'total_pages': total_pages,
+        'pages_done': [],
+        'created': datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+    }
+    _write_json_atomic(manifest_file, manifest)
+    return staging_dir, manifest
+
+def _read_staged_page(staging_dir, page):
+    return pd.read_csv(os.path.join(staging_dir, f"page_{page}.csv"), parse_dates=['date'])
+
+def _fetch_remaining_pages_concurrently(fund_code, total_pages, per_page, start_date, end_date, is_money_fund, max_workers,
+                                        total_records=None):
+    """使用线程池并发获取第2页至最后一页的数据，按页码顺序返回
+
+    每页获取成功后立即写入暂存区并记录到清单，失败的页面按指数退避重试；
+    仍有页面失败时抛出异常（已下载的页面保留在暂存区，下次调用从断点继续），不会返回不完整的数据
+    """
+    staging_dir, manifest = _open_staging(fund_code, start_date, end_date, per_page, total_records, total_pages)
+    manifest_file = os.path.join(staging_dir, 'manifest.json')
+    manifest_lock = threading.Lock()
+    pages = list(range(2, total_pages + 1))
+    pending_pages = [page for page in pages if page not in manifest['pages_done']]
+    results = {}
+    failed_pages = []
+    
+    def fetch_page(page):
+        for attempt in range(FETCH_PAGE_RETRIES + 1):
+            try:
+                df = _parse_nav_page(_request_nav_page(fund_code, page, per_page, start_date, end_date), is_money_fund)
+                break
+            except Exception as e:
+                if attempt == FETCH_PAGE_RETRIES:
+                    raise
+                delay = min(HTTP_BACKOFF_MAX, HTTP_BACKOFF_BASE * (2 ** (attempt + 1)))
+                delay = random.uniform(delay / 2, delay)
+                print(f"获取第 {page} 页数据失败（{str(e)}），{delay:.1f}秒后重试...")
+                time.sleep(delay)
+        
+        # 写入暂存区并更新清单
+        page_file = os.path.join(staging_dir, f"page_{page}.csv")
+        df.to_csv(page_file + '.tmp', index=False)
+        os.replace(page_file + '.tmp', page_file)
+        with manifest_lock:
+            manifest['pages_done'].append(page)
+            _write_json_atomic(manifest_file, manifest)
+        return df
+    
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        futures = {executor.submit(fetch_page, page): page for page in pending_pages}
+        for future in as_completed(futures):
+            page = futures[future]
+            try:
+                results[page] = future.result()
+            except Exception as e:
+                print(f"获取第 {page} 页数据时发生错误: {str(e)}")
+                failed_pages.append(page)
+    
+    if failed_pages:
+        raise RuntimeError(f"基金{fund_code}有{len(failed_pages)}页数据获取失败（第{min(failed_pages)}页等），"
+                           f"已下载的{len(manifest['pages_done'])}页保存在暂存区，下次获取时从断点继续")
+    
+    frames = []
+    for page in pages:
+        df = results[page] if page in results else _read_staged_page(staging_dir, page)
+        if df.empty:
+            break
+        print(f"第{page}页: 获取到{len(df)}条数据，最早日期: {df['date'].min().strftime('%Y-%m-%d')}")
+        frames.append(df)
+    
+    # 下载完成，删除暂存数据
+    shutil.rmtree(staging_dir, ignore_errors=True)
+    return frames
+
+def fetch_fund_data_from_api(fund_code, start_date, end_date, max_workers=None):
+    """从API获取基金数据，使用分页方式从最新日期往前滚动获取
+
+    先请求第一页并从响应中解析总页数，其余页面通过有界线程池并发获取，
+    所有线程共享所在主机的令牌桶限速器，最后按页码顺序拼接。max_workers为1时退化为逐页顺序获取。
+    已下载的页面写入暂存区，下载中断时抛出异常而不是返回不完整的数据，再次调用时从断点继续。
+    """
+    if max_workers is None:
+        max_workers = FETCH_MAX_WORKERS
+    frames = []
     page = 1
     per_page = 20  # 每页数据量，东方财富默认20条
     
     print(f"开始获取基金{fund_code}的历史数据...")
+    _cleanup_stale_staging()
     if start_date:
         print(f"获取日期范围: {start_date} 至 {end_date}")
     
     # 首先获取基金类型
     try:
-        fund_info = get_fund_info(fund_code)
+        fund_info = get_fund_info(fund_code, static_only=True)
         is_money_fund = fund_info.get('is_money_fund', False)
     except Exception as e:
         print(f"获取基金类型时发生错误: {str(e)}")
         is_money_fund = False
     
+    total_pages = None
+    total_records = None
     while True:
         try:
-            # 构建API URL，添加分页参数和日期参数
-            url = f"http://fund.eastmoney.com/f10/F10DataApi.aspx?type=lsjz&code={fund_code}&per={per_page}&page={page}"
-            
-            # 添加日期参数
-            if start_date:
-                url += f"&sdate={start_date}&edate={end_date}"
-            
-            # 发送请求获取数据
-            headers = {
-                "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36"
-            }
-            response = requests.get(url, headers=headers)
+            text = _request_nav_page(fund_code, page, per_page, start_date, end_date)
             
             # 检查是否有"暂无数据"
-            if "暂无数据" in response.text:
+            if "暂无数据" in text:
                 print(f"已获取所有数据")
                 break
             
-            # 使用StringIO包装HTML内容
             try:
-                df = pd.read_html(StringIO(response.text))[0]
+                df = _parse_nav_page(text, is_money_fund)
             except Exception as e:
                 print(f"解析HTML表格时发生错误: {str(e)}")
                 if page == 1:
                     return pd.DataFrame()
-                break
+                raise
             
             # 如果没有数据了，退出循环
             if df.empty:
                 break
             
-            # 根据基金类型处理不同的列名
-            if is_money_fund:
-                # 货币基金的列名通常是：净值日期、每万份收益、7日年化收益率(%)等
-                df.columns = ['date', 'nav', 'annual_return', 'subscription_status', 'redemption_status', 'dividend'] \
-                    if len(df.columns) == 6 else ['date', 'nav', 'annual_return', 'subscription_status', 'redemption_status']
-            else:
-                # 其他基金的列名通常是：净值日期、单位净值、累计净值、日增长率等
-                df.columns = ['date', 'nav', 'acc_nav', 'daily_return', 'subscription_status', 'redemption_status', 'dividend'] \
-                    if len(df.columns) == 7 else ['date', 'nav', 'acc_nav', 'daily_return', 'subscription_status', 'redemption_status']
-            
-            # 转换日期列
-            df['date'] = df['date'].replace({'\\*': ''}, regex=True)  # 移除星号
-            df['date'] = pd.to_datetime(df['date'], format='%Y-%m-%d', errors='coerce')
-            
-            # 转换净值列为数值类型
-            df['nav'] = df['nav'].replace({'\\*': '', ',': ''}, regex=True)  # 移除星号和逗号
-            df['nav'] = pd.to_numeric(df['nav'], errors='coerce')
-            
-            # 转换累计净值列为数值类型（对于非货币基金）
-            if not is_money_fund and 'acc_nav' in df.columns:
-                df['acc_nav'] = df['acc_nav'].replace({'\\*': '', ',': ''}, regex=True)
-                df['acc_nav'] = pd.to_numeric(df['acc_nav'], errors='coerce')
-            
-            # 合并数据
-            if is_money_fund:
-                all_data = pd.concat([all_data, df[['date', 'nav']]], ignore_index=True)
-            else:
-                # 对于非货币基金，保存单位净值和累计净值
-                all_data = pd.concat([all_data, df[['date', 'nav', 'acc_nav']]], ignore_index=True)
-            
+            frames.append(df)
             print(f"第{page}页: 获取到{len(df)}条数据，最早日期: {df['date'].min().strftime('%Y-%m-%d')}")
             
             # 检查是否还有下一页（通过数据量判断）
@@ -435,17 +1945,30 @@ def fetch_fund_data_from_api(fund_code, start_date, end_date):
                 print("已到达最后一页")
                 break
             
+            # 第一页返回了总页数时，剩余页面在循环结束后交给线程池并发获取（支持断点续传）
+            if page == 1:
+                total_pages = _parse_page_count(text)
+                if total_pages is not None:
+                    total_records = _parse_record_count(text)
+                    break
+            
             # 下一页
             page += 1
             
-            # 添加延迟，避免请求过于频繁
-            time.sleep(0.5)
-            
         except Exception as e:
             print(f"获取第 {page} 页数据时发生错误: {str(e)}")
             if page == 1:
                 return pd.DataFrame()
-            break
+            # 中途失败时不返回不完整的历史数据，避免被当作完整数据写入缓存
+            raise
+    
+    if total_pages is not None and total_pages > 1:
+        print(f"共{total_pages}页，使用{max_workers}个线程并发获取剩余页面...")
+        frames.extend(_fetch_remaining_pages_concurrently(
+            fund_code, total_pages, per_page, start_date, end_date, is_money_fund, max_workers,
+            total_records=total_records))
+    
+    all_data = pd.concat(frames, ignore_index=True) if frames else pd.DataFrame()
     
     if not all_data.empty:
         # 删除无效数据并排序
@@ -454,4 +1977,4 @@ def fetch_fund_data_from_api(fund_code, start_date, end_date):
         all_data = all_data.drop_duplicates(subset=['date'])
         print(f"共获取到 {len(all_data)} 条数据记录，日期范围：{all_data['date'].min().strftime('%Y-%m-%d')} 至 {all_data['date'].max().strftime('%Y-%m-%d')}")
     
-    return all_data
\ No newline at end of file
+    return all_data
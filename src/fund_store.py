@@ -0,0 +1,165 @@
+import sqlite3
+import threading
+import json
+import os
+import numpy as np
+import pandas as pd
+
+# 单文件SQLite净值库，保存全部基金的净值数据和元数据
+# 使用绝对路径确保文件保存在根目录的data目录下
+STORE_PATH = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "data", "fund_store.db")
+
+STORE_BUSY_TIMEOUT = 10000  # 等待其他连接释放写锁的最长时间（毫秒）
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS nav (
+    fund_code TEXT NOT NULL,
+    date INTEGER NOT NULL,      -- 自1970-01-01起的天数
+    nav REAL NOT NULL,
+    acc_nav REAL,
+    PRIMARY KEY (fund_code, date)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS idx_nav_date ON nav (date);
+CREATE TABLE IF NOT EXISTS fund_meta (
+    fund_code TEXT PRIMARY KEY,
+    last_update TEXT NOT NULL,
+    data_count INTEGER NOT NULL,
+    start_date TEXT,
+    end_date TEXT,
+    meta TEXT NOT NULL          -- 与二进制缓存文件头相同结构的JSON元数据
+);
+"""
+
+_local = threading.local()
+
+def _get_connection():
+    """获取当前线程的数据库连接，首次调用时创建并开启WAL模式
+
+    每个线程使用独立的连接；WAL模式下多个读连接（例如多个Streamlit会话）可以与一个写连接并发工作
+    """
+    conn = getattr(_local, 'conn', None)
+    if conn is None or getattr(_local, 'path', None) != STORE_PATH:
+        os.makedirs(os.path.dirname(STORE_PATH), exist_ok=True)
+        conn = sqlite3.connect(STORE_PATH, timeout=STORE_BUSY_TIMEOUT / 1000)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.execute(f"PRAGMA busy_timeout={STORE_BUSY_TIMEOUT}")
+        conn.executescript(_SCHEMA)
+        _local.conn = conn
+        _local.path = STORE_PATH
+    return conn
+
+def _date_to_days(value):
+    """将日期转换为自1970-01-01起的天数"""
+    return int(np.datetime64(pd.to_datetime(value).date(), 'D').astype(np.int64))
+
+def _frame_to_rows(fund_code, df):
+    """将净值DataFrame转换为nav表的行"""
+    days = df['date'].values.astype('datetime64[D]').astype(np.int64)
+    navs = df['nav'].to_numpy(dtype=np.float64)
+    if 'acc_nav' in df.columns:
+        acc_navs = [None if np.isnan(value) else float(value) for value in df['acc_nav'].to_numpy(dtype=np.float64)]
+    else:
+        acc_navs = [None] * len(df)
+    return [(fund_code, int(day), float(nav), acc_nav) for day, nav, acc_nav in zip(days, navs, acc_navs)]
+
+def _rows_to_frame(rows, columns):
+    """将查询结果转换为净值DataFrame，rows的列顺序与columns一致"""
+    df = pd.DataFrame(rows, columns=columns)
+    df['date'] = pd.to_datetime(df['date'].to_numpy(dtype=np.int64).astype('datetime64[D]').astype('datetime64[ns]'))
+    for column in ('nav', 'acc_nav'):
+        if column in df.columns:
+            df[column] = df[column].astype(np.float64)
+    return df
+
+def _upsert_meta(conn, fund_code, meta_data):
+    conn.execute(
+        "INSERT OR REPLACE INTO fund_meta (fund_code, last_update, data_count, start_date, end_date, meta) "
+        "VALUES (?, ?, ?, ?, ?, ?)",
+        (fund_code, meta_data['last_update'], meta_data['data_count'],
+         meta_data['date_range']['start'], meta_data['date_range']['end'],
+         json.dumps(meta_data, ensure_ascii=False))
+    )
+
+def load_meta(fund_code):
+    """读取基金的元数据，不存在时返回None"""
+    row = _get_connection().execute("SELECT meta FROM fund_meta WHERE fund_code = ?", (fund_code,)).fetchone()
+    if row is None:
+        return None
+    return json.loads(row[0])
+
+def save_meta(fund_code, meta_data):
+    """只更新基金的元数据"""
+    conn = _get_connection()
+    with conn:
+        _upsert_meta(conn, fund_code, meta_data)
+
+def load_fund_data(fund_code, start_date=None, end_date=None):
+    """读取基金净值数据，可按日期范围过滤，返回(DataFrame, 元数据)，不存在时返回(None, None)"""
+    meta_data = load_meta(fund_code)
+    if meta_data is None:
+        return None, None
+
+    sql = "SELECT date, nav, acc_nav FROM nav WHERE fund_code = ?"
+    params = [fund_code]
+    if start_date is not None:
+        sql += " AND date >= ?"
+        params.append(_date_to_days(start_date))
+    if end_date is not None:
+        sql += " AND date <= ?"
+        params.append(_date_to_days(end_date))
+    sql += " ORDER BY date"
+    rows = _get_connection().execute(sql, params).fetchall()
+
+    df = _rows_to_frame(rows, ['date', 'nav', 'acc_nav'])
+    if 'acc_nav' not in meta_data['columns']:
+        df = df.drop(columns=['acc_nav'])
+    return df, meta_data
+
+def save_fund_data(fund_code, df, meta_data):
+    """用df完整替换基金的净值数据并更新元数据（单个事务）"""
+    conn = _get_connection()
+    with conn:
+        conn.execute("DELETE FROM nav WHERE fund_code = ?", (fund_code,))
+        conn.executemany("INSERT INTO nav (fund_code, date, nav, acc_nav) VALUES (?, ?, ?, ?)",
+                         _frame_to_rows(fund_code, df))
+        _upsert_meta(conn, fund_code, meta_data)
+
+def append_fund_data(fund_code, new_data, meta_data):
+    """写入增量净值数据并更新元数据（单个事务），已存在的日期会被覆盖"""
+    conn = _get_connection()
+    with conn:
+        conn.executemany("INSERT OR REPLACE INTO nav (fund_code, date, nav, acc_nav) VALUES (?, ?, ?, ?)",
+                         _frame_to_rows(fund_code, new_data))
+        _upsert_meta(conn, fund_code, meta_data)
+
+def load_nav_range(start_date=None, end_date=None, fund_codes=None):
+    """跨基金的日期范围查询，例如"所有基金最近30天"
+
+    返回包含fund_code/date/nav/acc_nav列的长表，按日期和基金代码排序；
+    日期条件和排序都由date索引满足，一次索引扫描即可完成，fund_codes可限定基金范围
+    """
+    sql = "SELECT fund_code, date, nav, acc_nav FROM nav WHERE 1 = 1"
+    params = []
+    if start_date is not None:
+        sql += " AND date >= ?"
+        params.append(_date_to_days(start_date))
+    if end_date is not None:
+        sql += " AND date <= ?"
+        params.append(_date_to_days(end_date))
+    if fund_codes is not None:
+        fund_codes = list(fund_codes)
+        if not fund_codes:
+            return _rows_to_frame([], ['fund_code', 'date', 'nav', 'acc_nav'])
+        sql += f" AND fund_code IN ({', '.join('?' * len(fund_codes))})"
+        params.extend(fund_codes)
+    sql += " ORDER BY date, fund_code"
+    rows = _get_connection().execute(sql, params).fetchall()
+    return _rows_to_frame(rows, ['fund_code', 'date', 'nav', 'acc_nav'])
+
+def list_funds():
+    """列出库中所有基金的元数据摘要"""
+    rows = _get_connection().execute(
+        "SELECT fund_code, last_update, data_count, start_date, end_date FROM fund_meta ORDER BY fund_code"
+    ).fetchall()
+    return pd.DataFrame(rows, columns=['fund_code', 'last_update', 'data_count', 'start_date', 'end_date'])
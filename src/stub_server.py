@@ -0,0 +1,396 @@
+"""东方财富接口的本地替身服务器
+
+回放录制的响应（基金详情页、FundSearchAPI、F10DataApi历史净值分页、pingzhongdata、基金排行），
+没有录制的请求根据本地缓存中的净值数据和基金信息合成响应，可以在离线环境下复现地测试并发和缓存逻辑。
+支持配置响应延迟、错误率和限流（超出每秒请求数时返回503），录制模式下把请求转发到真实接口并保存响应。
+
+用法：
+    python -m src.stub_server --port 8765 --latency 0.05 --error-rate 0.05
+    FUND_API_BASE_URL=http://127.0.0.1:8765 streamlit run main.py
+"""
+import argparse
+import collections
+import hashlib
+import json
+import math
+import os
+import random
+import re
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qsl, urlencode
+
+import numpy as np
+import pandas as pd
+import requests
+
+from src import fund_data
+
+# 录制的响应保存目录，每个响应一个JSON文件
+FIXTURE_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "data", "stub_fixtures")
+
+# 计算响应的键时忽略的参数（随时间变化，不影响返回内容）
+IGNORED_PARAMS = {'_', 'sd', 'ed', 'v'}
+
+# 录制模式下按路径选择真实接口的主机
+SEARCH_PATH_PREFIX = '/FundSearch/'
+
+
+def _fixture_key(path, query):
+    """由路径和（排序后的）查询参数生成响应的键"""
+    params = sorted((key, value) for key, value in parse_qsl(query, keep_blank_values=True) if key not in IGNORED_PARAMS)
+    return path + ('?' + urlencode(params) if params else '')
+
+def _fixture_file(fixture_dir, key):
+    return os.path.join(fixture_dir, hashlib.sha1(key.encode('utf-8')).hexdigest()[:16] + '.json')
+
+def _to_js_ms(dates):
+    """日期转换为pingzhongdata使用的时间戳：北京时间零点对应的UTC毫秒数"""
+    return ((pd.DatetimeIndex(dates) - pd.Timedelta(hours=8)).asi8 // 1_000_000).tolist()
+
+def _default_fund_info(fund_code, df):
+    is_money_fund = 'acc_nav' not in df.columns
+    return {
+        'fund_name': f"基金{fund_code}",
+        'fund_company': '替身基金管理有限公司',
+        'fund_type': '货币型' if is_money_fund else '混合型',
+        'fund_code': fund_code,
+        'is_money_fund': is_money_fund,
+    }
+
+def load_local_funds():
+    """从本地缓存读取所有基金的净值数据和基金信息，返回{基金代码: {'df': 净值数据, 'fund_info': 基金信息}}"""
+    codes = set(fund_data._cached_fund_codes())
+    if os.path.exists(fund_data.CACHE_DIR):
+        # 旧版CSV缓存读取时会被自动转换
+        codes.update(name[:-len('.csv')] for name in os.listdir(fund_data.CACHE_DIR) if name.endswith('.csv'))
+    funds = {}
+    for fund_code in sorted(codes):
+        try:
+            df, _ = fund_data._load_cache(fund_code)
+        except Exception as e:
+            print(f"读取基金{fund_code}的缓存数据时发生错误: {str(e)}")
+            continue
+        if df is None or df.empty:
+            continue
+        record = fund_data._load_fund_info_record(fund_code)
+        fund_info = record['fund_info'] if record else _default_fund_info(fund_code, df)
+        funds[fund_code] = {'df': df.sort_values('date').reset_index(drop=True), 'fund_info': fund_info}
+    return funds
+
+
+class StubServer:
+    """东方财富接口的替身服务器，在后台线程中运行
+
+    funds为{基金代码: {'df': 净值数据, 'fund_info': 基金信息}}，用于合成没有录制的响应，为None时读取本地缓存；
+    latency/jitter为每个响应的固定延迟和随机附加延迟（秒），error_rate为返回500的概率，
+    max_rps为每秒最多处理的请求数（超出时返回503），record为True时转发到真实接口并把响应保存到fixture_dir
+    """
+
+    def __init__(self, host='127.0.0.1', port=0, funds=None, fixture_dir=None, record=False,
+                 latency=0.0, jitter=0.0, error_rate=0.0, max_rps=None, seed=None):
+        self.funds = load_local_funds() if funds is None else funds
+        self.fixture_dir = FIXTURE_DIR if fixture_dir is None else fixture_dir
+        self.record = record
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.max_rps = max_rps
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self._recent = collections.deque()
+        self.stats = collections.Counter()
+
+        stub = self
+        class Handler(_StubRequestHandler):
+            server_stub = stub
+        self._httpd = ThreadingHTTPServer((host, port), Handler)
+        self._httpd.daemon_threads = True
+        self._thread = None
+
+    @property
+    def base_url(self):
+        host, port = self._httpd.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start(self):
+        """在后台线程中启动服务器，返回自身"""
+        self._thread = threading.Thread(target=self._httpd.serve_forever, name='stub-server', daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._httpd.shutdown()
+        self._httpd.server_close()
+        if self._thread is not None:
+            self._thread.join()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+    def reset_stats(self):
+        with self._lock:
+            self.stats.clear()
+
+    def _count(self, name):
+        with self._lock:
+            self.stats[name] += 1
+
+    def _throttled(self):
+        """最近一秒内的请求数超过max_rps时返回True"""
+        if not self.max_rps:
+            return False
+        now = time.monotonic()
+        with self._lock:
+            while self._recent and now - self._recent[0] > 1.0:
+                self._recent.popleft()
+            if len(self._recent) >= self.max_rps:
+                return True
+            self._recent.append(now)
+            return False
+
+    def _should_fail(self):
+        with self._lock:
+            return self.error_rate > 0 and self._random.random() < self.error_rate
+
+    def _delay(self):
+        with self._lock:
+            delay = self.latency + (self._random.uniform(0, self.jitter) if self.jitter else 0.0)
+        if delay > 0:
+            time.sleep(delay)
+
+    def handle(self, path, query):
+        """处理一个GET请求，返回(状态码, Content-Type, 响应内容)"""
+        self._count('requests')
+        if self._throttled():
+            self._count('throttled')
+            return 503, 'text/plain; charset=utf-8', 'Service Unavailable'
+        self._delay()
+        if self._should_fail():
+            self._count('errors')
+            return 500, 'text/plain; charset=utf-8', 'Internal Server Error'
+
+        key = _fixture_key(path, query)
+        if self.record:
+            return self._record(key, path, query)
+        fixture_file = _fixture_file(self.fixture_dir, key)
+        if os.path.exists(fixture_file):
+            with open(fixture_file, 'r', encoding='utf-8') as f:
+                fixture = json.load(f)
+            self._count('replayed')
+            return fixture['status'], fixture['content_type'], fixture['body']
+
+        response = self._synthesize(path, dict(parse_qsl(query, keep_blank_values=True)))
+        if response is None:
+            self._count('not_found')
+            return 404, 'text/plain; charset=utf-8', 'Not Found'
+        self._count('synthesized')
+        return response
+
+    def _record(self, key, path, query):
+        """转发到真实接口并保存响应"""
+        base_url = fund_data.FUND_SEARCH_BASE_URL if path.startswith(SEARCH_PATH_PREFIX) else fund_data.FUND_BASE_URL
+        url = base_url + path + ('?' + query if query else '')
+        headers = dict(fund_data.HTTP_HEADERS)
+        if path == fund_data.SNAPSHOT_PATH:
+            headers['Referer'] = fund_data.SNAPSHOT_REFERER
+        upstream = requests.get(url, headers=headers, timeout=fund_data.HTTP_TIMEOUT)
+        upstream.encoding = 'utf-8'
+        content_type = upstream.headers.get('Content-Type', 'text/html; charset=utf-8')
+        if upstream.status_code == 200:
+            os.makedirs(self.fixture_dir, exist_ok=True)
+            with open(_fixture_file(self.fixture_dir, key), 'w', encoding='utf-8') as f:
+                json.dump({'key': key, 'status': upstream.status_code, 'content_type': content_type,
+                           'body': upstream.text}, f, ensure_ascii=False)
+            self._count('recorded')
+        return upstream.status_code, content_type, upstream.text
+
+    def _synthesize(self, path, params):
+        """根据基金数据合成接口响应，不支持的请求返回None"""
+        if path == '/f10/F10DataApi.aspx' and params.get('type') == 'lsjz':
+            return 200, 'text/html; charset=utf-8', self._lsjz_page(params)
+        match = re.fullmatch(r'/pingzhongdata/(\d{6})\.js', path)
+        if match:
+            return self._pingzhong(match.group(1))
+        match = re.fullmatch(r'/(\d{6})\.html', path)
+        if match:
+            return self._detail_page(match.group(1))
+        if path == '/FundSearch/api/FundSearchAPI.ashx':
+            return 200, 'application/json; charset=utf-8', self._search(params.get('key', ''))
+        if path == fund_data.SNAPSHOT_PATH:
+            return 200, 'text/html; charset=utf-8', self._ranking(params)
+        return None
+
+    def _lsjz_page(self, params):
+        fund = self.funds.get(params.get('code'))
+        per_page = int(params.get('per', 20))
+        page = int(params.get('page', 1))
+        df = fund['df'] if fund else pd.DataFrame(columns=['date', 'nav'])
+        start_date = params.get('sdate')
+        end_date = params.get('edate')
+        df = fund_data.slice_by_date(df, start_date or None, end_date if end_date not in (None, '', 'None') else None)
+        df = df.iloc[::-1]
+        records = len(df)
+        pages = math.ceil(records / per_page)
+        rows = df.iloc[(page - 1) * per_page:page * per_page]
+        is_money_fund = 'acc_nav' not in df.columns
+
+        if is_money_fund:
+            head = "<th class='first'>净值日期</th><th>每万份收益</th><th>7日年化收益率（%）</th><th>申购状态</th><th>赎回状态</th><th class='tor last'>分红送配</th>"
+        else:
+            head = "<th class='first'>净值日期</th><th>单位净值</th><th>累计净值</th><th>日增长率</th><th>申购状态</th><th>赎回状态</th><th class='tor last'>分红送配</th>"
+        if rows.empty:
+            body = "<tr><td colspan='7' align='center'>暂无数据!</td></tr>"
+        else:
+            growth = df['nav'].iloc[::-1].pct_change().iloc[::-1].reindex(rows.index)
+            cells = []
+            for date, nav, rate, acc_nav in zip(rows['date'], rows['nav'], growth,
+                                                rows['acc_nav'] if not is_money_fund else [None] * len(rows)):
+                rate_text = '' if pd.isna(rate) else f"{rate * 100:.2f}%"
+                if is_money_fund:
+                    cells.append(f"<tr><td>{date:%Y-%m-%d}</td><td class='tor bold'>{nav:.4f}</td><td class='tor bold'>--</td>"
+                                 f"<td>开放申购</td><td>开放赎回</td><td class='red unbold'></td></tr>")
+                else:
+                    cells.append(f"<tr><td>{date:%Y-%m-%d}</td><td class='tor bold'>{nav:.4f}</td><td class='tor bold'>{acc_nav:.4f}</td>"
+                                 f"<td class='tor bold'>{rate_text}</td><td>开放申购</td><td>开放赎回</td><td class='red unbold'></td></tr>")
+            body = ''.join(cells)
+        content = f"<table class='w782 comm lsjz'><thead><tr>{head}</tr></thead><tbody>{body}</tbody></table>"
+        return f'var apidata={{ content:"{content}",records:{records},pages:{pages},curpage:{page}}};'
+
+    def _pingzhong(self, fund_code):
+        fund = self.funds.get(fund_code)
+        if fund is None:
+            return None
+        df = fund['df']
+        timestamps = _to_js_ms(df['date'])
+        name = fund['fund_info'].get('fund_name', '')
+        parts = [f'var fS_name = {json.dumps(name, ensure_ascii=False)};', f'var fS_code = "{fund_code}";']
+        if 'acc_nav' not in df.columns:
+            income = [[ts, float(value)] for ts, value in zip(timestamps, df['nav'])]
+            parts += ['var ishb=true;', f'var Data_millionCopiesIncome = {json.dumps(income)};']
+        else:
+            returns = (df['nav'].pct_change().fillna(0) * 100).round(2)
+            trend = [{'x': ts, 'y': float(nav), 'equityReturn': float(ret), 'unitMoney': ''}
+                     for ts, nav, ret in zip(timestamps, df['nav'], returns)]
+            acc_trend = [[ts, None if np.isnan(acc) else float(acc)] for ts, acc in zip(timestamps, df['acc_nav'])]
+            parts += ['var ishb=false;', f'var Data_netWorthTrend = {json.dumps(trend)};',
+                      f'var Data_ACWorthTrend = {json.dumps(acc_trend)};']
+        return 200, 'application/javascript; charset=utf-8', ''.join(parts)
+
+    def _detail_page(self, fund_code):
+        fund = self.funds.get(fund_code)
+        if fund is None:
+            return None
+        info = fund['fund_info']
+        html = (f"<html><body><div class='fundDetail-tit'><div>{info.get('fund_name', '')}</div></div>"
+                f"<table class='info w790'><tr><td>基金类型</td><td>{info.get('fund_type', '')}</td>"
+                f"<td>基金管理人</td><td>{info.get('fund_company', '')}</td></tr></table></body></html>")
+        return 200, 'text/html; charset=utf-8', html
+
+    def _search(self, fund_code):
+        fund = self.funds.get(fund_code)
+        datas = []
+        if fund is not None:
+            info = fund['fund_info']
+            datas.append({
+                'CODE': fund_code,
+                'NAME': info.get('fund_name', ''),
+                'CATEGORY': 700,
+                'CATEGORYDESC': '基金',
+                'FundBaseInfo': {
+                    'FCODE': fund_code,
+                    'SHORTNAME': info.get('fund_short_name', info.get('fund_name', '')),
+                    'JJJL': info.get('fund_manager', ''),
+                    'JJJLID': info.get('fund_manager_id', ''),
+                    'ISBUY': '1' if info.get('is_buy', True) else '2',
+                    'MINSG': info.get('min_purchase', 10),
+                    'FSRQ': fund['df']['date'].iloc[-1].strftime('%Y-%m-%d'),
+                    'FTYPE': info.get('fund_type', ''),
+                    'JJGS': info.get('fund_company', ''),
+                    'JJGSID': info.get('fund_company_id', ''),
+                    'OTHERNAME': info.get('other_name', ''),
+                },
+                'ZTJJInfo': [{'TTYPE': theme.get('type', ''), 'TTYPENAME': theme.get('name', '')}
+                             for theme in info.get('investment_themes', [])],
+            })
+        return json.dumps({'ErrCode': 0, 'ErrMsg': None, 'Datas': datas}, ensure_ascii=False)
+
+    def _ranking(self, params):
+        page = int(params.get('pi', 1))
+        per_page = int(params.get('pn', 50))
+        rows = []
+        for fund_code, fund in sorted(self.funds.items()):
+            df = fund['df']
+            if 'acc_nav' not in df.columns:
+                continue
+            last = df.iloc[-1]
+            growth = df['nav'].iloc[-1] / df['nav'].iloc[-2] - 1 if len(df) > 1 else 0.0
+            name = fund['fund_info'].get('fund_name', '')
+            rows.append(f"{fund_code},{name},,{last['date']:%Y-%m-%d},{last['nav']:.4f},{last['acc_nav']:.4f},{growth * 100:.2f}")
+        total_pages = max(1, math.ceil(len(rows) / per_page))
+        datas = ','.join(json.dumps(row, ensure_ascii=False) for row in rows[(page - 1) * per_page:page * per_page])
+        return (f"var rankData = {{datas:[{datas}],allRecords:{len(rows)},pageIndex:{page},pageNum:{per_page},"
+                f"allPages:{total_pages},allNum:{len(rows)}}};")
+
+
+class _StubRequestHandler(BaseHTTPRequestHandler):
+    server_stub = None
+    protocol_version = 'HTTP/1.1'
+
+    def do_GET(self):
+        parsed = urlparse(self.path)
+        try:
+            status, content_type, body = self.server_stub.handle(parsed.path, parsed.query)
+        except Exception as e:
+            status, content_type, body = 500, 'text/plain; charset=utf-8', f"替身服务器内部错误: {str(e)}"
+        payload = body.encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def log_message(self, format, *args):
+        # 默认的逐请求日志在压测时过于嘈杂
+        pass
+
+
+def main():
+    parser = argparse.ArgumentParser(description="东方财富接口的本地替身服务器")
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--fixtures', default=FIXTURE_DIR, help="录制响应的保存目录")
+    parser.add_argument('--record', action='store_true', help="转发到真实接口并录制响应")
+    parser.add_argument('--latency', type=float, default=0.0, help="每个响应的固定延迟（秒）")
+    parser.add_argument('--jitter', type=float, default=0.0, help="每个响应的随机附加延迟上限（秒）")
+    parser.add_argument('--error-rate', type=float, default=0.0, help="返回500错误的概率")
+    parser.add_argument('--max-rps', type=float, default=None, help="每秒最多处理的请求数，超出时返回503")
+    parser.add_argument('--seed', type=int, default=None, help="错误和延迟的随机种子")
+    args = parser.parse_args()
+
+    server = StubServer(args.host, args.port, fixture_dir=args.fixtures, record=args.record, latency=args.latency,
+                        jitter=args.jitter, error_rate=args.error_rate, max_rps=args.max_rps, seed=args.seed)
+    print(f"替身服务器已启动，共{len(server.funds)}只基金的本地数据")
+    fixture_count = len([name for name in os.listdir(args.fixtures) if name.endswith('.json')]) \
+        if os.path.isdir(args.fixtures) else 0
+    if fixture_count:
+        print(f"共{fixture_count}个录制的响应: {args.fixtures}")
+    elif not args.record:
+        print(f"没有录制的响应（{args.fixtures}），所有响应都由本地数据合成，不能检验解析逻辑是否适配真实页面；"
+              f"可以在能访问东方财富的环境中加上--record录制")
+    print(f"使用方法: FUND_API_BASE_URL={server.base_url} streamlit run main.py")
+    server.start()
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        print(f"请求统计: {dict(server.stats)}")
+        server.stop()
+
+
+if __name__ == "__main__":
+    main()
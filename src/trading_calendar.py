@@ -0,0 +1,137 @@
+import datetime
+import numpy as np
+import pandas as pd
+
+# 沪深交易所休市安排（不含普通周末），每年需要根据交易所公告补充下一年的数据
+# 每个区间为闭区间，区间内的周末不影响结果
+_HOLIDAY_RANGES = {
+    2015: [('2015-01-01', '2015-01-02'), ('2015-02-18', '2015-02-24'), ('2015-04-06', '2015-04-06'),
+           ('2015-05-01', '2015-05-01'), ('2015-06-22', '2015-06-22'), ('2015-09-03', '2015-09-04'),
+           ('2015-10-01', '2015-10-07')],
+    2016: [('2016-01-01', '2016-01-01'), ('2016-02-08', '2016-02-12'), ('2016-04-04', '2016-04-04'),
+           ('2016-05-02', '2016-05-02'), ('2016-06-09', '2016-06-10'), ('2016-09-15', '2016-09-16'),
+           ('2016-10-03', '2016-10-07')],
+    2017: [('2017-01-02', '2017-01-02'), ('2017-01-27', '2017-02-02'), ('2017-04-03', '2017-04-04'),
+           ('2017-05-01', '2017-05-01'), ('2017-05-29', '2017-05-30'), ('2017-10-02', '2017-10-06')],
+    2018: [('2018-01-01', '2018-01-01'), ('2018-02-15', '2018-02-21'), ('2018-04-05', '2018-04-06'),
+           ('2018-04-30', '2018-05-01'), ('2018-06-18', '2018-06-18'), ('2018-09-24', '2018-09-24'),
+           ('2018-10-01', '2018-10-05')],
+    2019: [('2019-01-01', '2019-01-01'), ('2019-02-04', '2019-02-08'), ('2019-04-05', '2019-04-05'),
+           ('2019-05-01', '2019-05-03'), ('2019-06-07', '2019-06-07'), ('2019-09-13', '2019-09-13'),
+           ('2019-10-01', '2019-10-07')],
+    2020: [('2020-01-01', '2020-01-01'), ('2020-01-24', '2020-01-31'), ('2020-04-06', '2020-04-06'),
+           ('2020-05-01', '2020-05-05'), ('2020-06-25', '2020-06-26'), ('2020-10-01', '2020-10-08')],
+    2021: [('2021-01-01', '2021-01-01'), ('2021-02-11', '2021-02-17'), ('2021-04-05', '2021-04-05'),
+           ('2021-05-03', '2021-05-05'), ('2021-06-14', '2021-06-14'), ('2021-09-20', '2021-09-21'),
+           ('2021-10-01', '2021-10-07')],
+    2022: [('2022-01-03', '2022-01-03'), ('2022-01-31', '2022-02-04'), ('2022-04-04', '2022-04-05'),
+           ('2022-05-02', '2022-05-04'), ('2022-06-03', '2022-06-03'), ('2022-09-12', '2022-09-12'),
+           ('2022-10-03', '2022-10-07')],
+    2023: [('2023-01-02', '2023-01-02'), ('2023-01-23', '2023-01-27'), ('2023-04-05', '2023-04-05'),
+           ('2023-05-01', '2023-05-03'), ('2023-06-22', '2023-06-23'), ('2023-09-29', '2023-10-06')],
+    2024: [('2024-01-01', '2024-01-01'), ('2024-02-09', '2024-02-16'), ('2024-04-04', '2024-04-05'),
+           ('2024-05-01', '2024-05-03'), ('2024-06-10', '2024-06-10'), ('2024-09-16', '2024-09-17'),
+           ('2024-10-01', '2024-10-07')],
+    2025: [('2025-01-01', '2025-01-01'), ('2025-01-28', '2025-02-04'), ('2025-04-04', '2025-04-04'),
+           ('2025-05-01', '2025-05-05'), ('2025-06-02', '2025-06-02'), ('2025-10-01', '2025-10-08')],
+    2026: [('2026-01-01', '2026-01-02'), ('2026-02-16', '2026-02-23'), ('2026-04-06', '2026-04-06'),
+           ('2026-05-01', '2026-05-05'), ('2026-06-19', '2026-06-19'), ('2026-09-25', '2026-09-25'),
+           ('2026-10-01', '2026-10-07')],
+}
+
+# 休市安排覆盖的年份范围，范围之外只按周末判断
+CALENDAR_START_YEAR = min(_HOLIDAY_RANGES)
+CALENDAR_END_YEAR = max(_HOLIDAY_RANGES)
+
+# 净值公布时间模型：(基金类型关键字, 滞后交易日数, 最早公布时刻)
+# T日净值最早在T日之后第"滞后交易日数"个交易日的该时刻公布，按顺序匹配基金类型，都不匹配时使用默认规则
+NAV_PUBLISH_RULES = [
+    ('QDII', 1, 18),
+    ('FOF', 1, 18),
+]
+DEFAULT_NAV_PUBLISH_RULE = (0, 16)
+
+
+def _build_holidays():
+    holidays = set()
+    for ranges in _HOLIDAY_RANGES.values():
+        for start, end in ranges:
+            for day in pd.date_range(start, end, freq='D'):
+                holidays.add(day.date())
+    return frozenset(holidays)
+
+_HOLIDAYS = _build_holidays()
+_HOLIDAY_ARRAY = np.array(sorted(_HOLIDAYS), dtype='datetime64[D]')
+
+
+def _to_date(value):
+    """将字符串、datetime或Timestamp转换为date"""
+    if isinstance(value, datetime.datetime):
+        return value.date()
+    if isinstance(value, datetime.date):
+        return value
+    return pd.to_datetime(value).date()
+
+def is_covered(day):
+    """判断日期是否在休市安排覆盖的年份范围内"""
+    return CALENDAR_START_YEAR <= _to_date(day).year <= CALENDAR_END_YEAR
+
+def is_trading_day(day):
+    """判断是否为A股交易日"""
+    day = _to_date(day)
+    return day.weekday() < 5 and day not in _HOLIDAYS
+
+def trading_days(start, end):
+    """返回[start, end]范围内的所有交易日（DatetimeIndex）"""
+    start = np.datetime64(_to_date(start), 'D')
+    end = np.datetime64(_to_date(end), 'D')
+    if end < start:
+        return pd.DatetimeIndex([])
+    days = np.arange(start, end + 1, dtype='datetime64[D]')
+    mask = np.is_busday(days, holidays=_HOLIDAY_ARRAY)
+    return pd.DatetimeIndex(days[mask].astype('datetime64[ns]'))
+
+def previous_trading_day(day, inclusive=True):
+    """返回不晚于day（inclusive为False时为早于day）的最近一个交易日"""
+    day = _to_date(day)
+    if not inclusive:
+        day -= datetime.timedelta(days=1)
+    while not is_trading_day(day):
+        day -= datetime.timedelta(days=1)
+    return day
+
+def next_trading_day(day, inclusive=False):
+    """返回晚于day（inclusive为True时为不早于day）的最近一个交易日"""
+    day = _to_date(day)
+    if not inclusive:
+        day += datetime.timedelta(days=1)
+    while not is_trading_day(day):
+        day += datetime.timedelta(days=1)
+    return day
+
+def get_nav_publish_rule(fund_type):
+    """根据基金类型返回净值公布规则(滞后交易日数, 最早公布时刻)"""
+    fund_type = fund_type or ''
+    for keyword, lag_days, publish_hour in NAV_PUBLISH_RULES:
+        if keyword in fund_type:
+            return lag_days, publish_hour
+    return DEFAULT_NAV_PUBLISH_RULE
+
+def expected_latest_nav_date(fund_type, now=None):
+    """根据交易日历和净值公布时间模型，返回此刻最晚可能已经公布净值的交易日
+
+    缓存中的最后日期不早于该日期时，说明还不可能有新数据，无需发起网络请求
+    """
+    if now is None:
+        now = datetime.datetime.now()
+    lag_days, publish_hour = get_nav_publish_rule(fund_type)
+
+    nav_day = previous_trading_day(now.date())
+    while True:
+        publish_day = nav_day
+        for _ in range(lag_days):
+            publish_day = next_trading_day(publish_day)
+        publish_time = datetime.datetime.combine(publish_day, datetime.time(publish_hour))
+        if publish_time <= now:
+            return nav_day
+        nav_day = previous_trading_day(nav_day, inclusive=False)
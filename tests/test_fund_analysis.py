@@ -0,0 +1,121 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from src import fund_analysis
+
+
+def _nav_series(dates, seed=0):
+    """以dates为索引的随机净值序列，包含若干净值不变的日子"""
+    returns = np.random.default_rng(seed).normal(0.0004, 0.012, len(dates))
+    returns[::17] = 0.0
+    return pd.Series(np.round(np.cumprod(1 + returns), 4), index=pd.DatetimeIndex(dates))
+
+
+# 以下为改用analyze()之前逐项计算指标的原实现，作为回归比较的基准
+
+def _reference_max_drawdown(nav_series):
+    cummax = nav_series.cummax()
+    return float(((nav_series - cummax) / cummax).min() * 100)
+
+
+def _reference_volatility(nav_series):
+    return float(nav_series.pct_change().dropna().std() * np.sqrt(252) * 100)
+
+
+def _reference_sharpe_ratio(nav_series, risk_free_rate=0.03):
+    excess_returns = nav_series.pct_change().dropna() - risk_free_rate / 252
+    if len(excess_returns) == 0:
+        return 0
+    return float(np.sqrt(252) * excess_returns.mean() / excess_returns.std())
+
+
+def _reference_annual_return(nav_series):
+    total_days = (nav_series.index[-1] - nav_series.index[0]).days
+    if total_days <= 0:
+        return 0.0
+    return float(((nav_series.iloc[-1] / nav_series.iloc[0]) ** (365 / total_days) - 1) * 100)
+
+
+def _reference_return_distribution(nav_series):
+    returns = nav_series.pct_change().dropna()
+    stats = {
+        'mean': returns.mean() * 100,
+        'std': returns.std() * 100,
+        'skew': returns.skew(),
+        'kurtosis': returns.kurtosis(),
+        'min': returns.min() * 100,
+        'max': returns.max() * 100,
+        'median': returns.median() * 100
+    }
+    for p in fund_analysis.DISTRIBUTION_PERCENTILES:
+        stats[f'percentile_{p}'] = np.percentile(returns, p) * 100
+    return stats
+
+
+@pytest.fixture(params=['date', 'intraday'])
+def nav_series(request):
+    """两年多的工作日净值；intraday为带有时间部分的日期（净值在每天15:00公布）"""
+    dates = pd.bdate_range('2021-01-04', '2023-03-31')
+    if request.param == 'intraday':
+        dates = dates + pd.Timedelta(hours=15)
+    return _nav_series(dates)
+
+
+def test_analyze_matches_reference(nav_series):
+    metrics = fund_analysis.analyze(nav_series, nav_series.index)
+
+    assert metrics.count == len(nav_series)
+    assert metrics.max_drawdown == pytest.approx(_reference_max_drawdown(nav_series))
+    assert metrics.volatility == pytest.approx(_reference_volatility(nav_series))
+    assert metrics.sharpe_ratio == pytest.approx(_reference_sharpe_ratio(nav_series))
+    assert metrics.annual_return == pytest.approx(_reference_annual_return(nav_series))
+    assert metrics.return_distribution() == pytest.approx(_reference_return_distribution(nav_series))
+
+
+def test_per_metric_functions_match_reference(nav_series):
+    assert fund_analysis.calculate_max_drawdown(nav_series) == pytest.approx(_reference_max_drawdown(nav_series))
+    assert fund_analysis.calculate_volatility(nav_series) == pytest.approx(_reference_volatility(nav_series))
+    assert fund_analysis.calculate_sharpe_ratio(nav_series) == pytest.approx(_reference_sharpe_ratio(nav_series))
+    assert fund_analysis.calculate_annual_return(nav_series) == pytest.approx(_reference_annual_return(nav_series))
+    assert fund_analysis.calculate_return_distribution(nav_series) == \
+        pytest.approx(_reference_return_distribution(nav_series))
+
+
+def test_fund_summary_matches_reference(nav_series):
+    df = pd.DataFrame({'date': nav_series.index, 'nav': nav_series.to_numpy()})
+
+    summary = fund_analysis.calculate_fund_summary(df)
+
+    assert summary['latest_date'] == df['date'].iloc[-1]
+    assert summary['max_nav'] == df['nav'].max()
+    assert summary['max_nav_date'] == df.loc[df['nav'].idxmax(), 'date']
+    assert summary['min_nav_date'] == df.loc[df['nav'].idxmin(), 'date']
+    assert summary['total_return'] == pytest.approx((df['nav'].iloc[-1] / df['nav'].iloc[0] - 1) * 100)
+
+
+def test_analyze_matrix_matches_analyze():
+    dates = pd.bdate_range('2020-01-01', '2023-12-29')
+    frames = {
+        'full': _nav_series(dates, seed=1),
+        'late_start': _nav_series(dates[400:], seed=2),
+        'early_stop': _nav_series(dates[:700], seed=3),
+        'short': _nav_series(dates[500:503], seed=4),
+    }
+    # 未公布净值的日子（对齐后为NaN）
+    frames['full'] = frames['full'].drop(frames['full'].index[[5, 6, 7, 300, 801]])
+    frames['late_start'] = frames['late_start'].drop(frames['late_start'].index[::11])
+    frames = {code: pd.DataFrame({'date': series.index, 'nav': series.to_numpy()}) for code, series in frames.items()}
+
+    aligned_dates, codes, matrix = fund_analysis.align_nav_frames(frames)
+    result = fund_analysis.analyze_matrix(matrix, aligned_dates, codes)
+
+    assert np.isnan(matrix).any()
+    for code, df in frames.items():
+        metrics = fund_analysis.analyze(df['nav'], df['date'])
+        expected = {name: getattr(metrics, name) for name in result.columns if hasattr(metrics, name)}
+        expected.update({f'percentile_{p}': value for p, value in metrics.percentiles.items()})
+        assert set(expected) == set(result.columns)
+        actual = result.loc[code]
+        for name, value in expected.items():
+            assert actual[name] == pytest.approx(value, rel=1e-9, nan_ok=True), (code, name)
@@ -0,0 +1,260 @@
+import datetime
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from src import fund_data
+from src import trading_calendar
+from src.stub_server import StubServer
+
+FUND_CODE = '000001'
+CACHED_ROWS = 613
+NEW_ROWS = 50   # 按每页20条为3页增量数据
+
+
+def _nav_frame(dates, seed=0):
+    nav = np.round(np.cumprod(1 + np.random.default_rng(seed).normal(0, 0.01, len(dates))), 4)
+    return pd.DataFrame({'date': pd.DatetimeIndex(dates), 'nav': nav, 'acc_nav': nav})
+
+
+@pytest.fixture
+def cache_dir(tmp_path, monkeypatch):
+    """使用临时缓存目录和文件缓存后端，基金信息固定为非货币基金，分页请求失败时不重试"""
+    monkeypatch.setattr(fund_data, 'CACHE_DIR', str(tmp_path))
+    monkeypatch.setattr(fund_data, 'CACHE_BACKEND', 'file')
+    monkeypatch.setattr(fund_data, 'FETCH_PAGE_RETRIES', 0)
+    monkeypatch.setattr(fund_data, 'get_fund_info',
+                        lambda fund_code, **kwargs: {'fund_type': '混合型', 'is_money_fund': False})
+    fund_data.clear_frame_cache()
+    yield tmp_path
+    fund_data.clear_frame_cache()
+
+
+@pytest.fixture
+def stub_for(monkeypatch):
+    """启动提供给定净值数据的替身服务器，并让接口请求指向它"""
+    servers = []
+
+    def start(funds):
+        stub = StubServer(funds={code: {'df': df, 'fund_info': {}} for code, df in funds.items()}).start()
+        servers.append(stub)
+        monkeypatch.setattr(fund_data, 'FUND_API_BASE_URL', stub.base_url)
+        return stub
+    yield start
+    for stub in servers:
+        stub.stop()
+
+
+@pytest.fixture
+def stub_fund(cache_dir, stub_for):
+    """准备613条缓存数据（最后更新于昨天），替身服务器提供之后的50条新净值"""
+    df = _nav_frame(pd.bdate_range(end=datetime.date.today() - datetime.timedelta(days=1),
+                                   periods=CACHED_ROWS + NEW_ROWS))
+
+    fund_data.save_fund_data_to_cache(FUND_CODE, df.iloc[:CACHED_ROWS].reset_index(drop=True))
+    meta_data = fund_data.get_cache_meta(FUND_CODE)
+    meta_data['last_update'] = (datetime.datetime.now() - datetime.timedelta(days=1)).strftime('%Y-%m-%d %H:%M:%S')
+    fund_data._update_cache_meta(FUND_CODE, meta_data)
+
+    stub_for({FUND_CODE: df})
+    return df, meta_data
+
+
+def _fail_pages(monkeypatch, *pages):
+    """让指定页码的分页请求失败，返回失败页码的集合（清空后恢复正常）"""
+    failing_pages = set(pages)
+    request_nav_page = fund_data._request_nav_page
+
+    def request(fund_code, page, *args, **kwargs):
+        if page in failing_pages:
+            raise RuntimeError("500 Server Error")
+        return request_nav_page(fund_code, page, *args, **kwargs)
+    monkeypatch.setattr(fund_data, '_request_nav_page', request)
+    return failing_pages
+
+
+def test_failed_incremental_page_keeps_cache(stub_fund, monkeypatch):
+    df, meta_data = stub_fund
+    _fail_pages(monkeypatch, 2)
+
+    result = fund_data.get_fund_data(FUND_CODE, source='lsjz')
+
+    assert len(result) == CACHED_ROWS
+    assert result['date'].iloc[-1] == df['date'].iloc[CACHED_ROWS - 1]
+    cache_meta = fund_data.get_cache_meta(FUND_CODE)
+    assert cache_meta['data_count'] == CACHED_ROWS
+    assert cache_meta['last_update'] == meta_data['last_update']
+
+
+def test_incremental_update_resumes_after_failure(stub_fund, monkeypatch):
+    df, _ = stub_fund
+    failing_pages = _fail_pages(monkeypatch, 2)
+    fund_data.get_fund_data(FUND_CODE, source='lsjz')
+    failing_pages.clear()
+
+    result = fund_data.get_fund_data(FUND_CODE, source='lsjz')
+
+    assert len(result) == CACHED_ROWS + NEW_ROWS
+    assert np.allclose(result['nav'].to_numpy(), df['nav'].to_numpy())
+
+
+def _cache_with_hole(full, hole, gaps_checked_through=None):
+    """缓存full中除hole以外的日期，可选地设置缺口检查进度，返回缓存元数据"""
+    cached = full[~full['date'].isin(pd.DatetimeIndex(hole))].reset_index(drop=True)
+    fund_data.save_fund_data_to_cache(FUND_CODE, cached)
+    meta_data = fund_data.get_cache_meta(FUND_CODE)
+    if gaps_checked_through is not None:
+        meta_data['gaps_checked_through'] = gaps_checked_through
+        fund_data._update_cache_meta(FUND_CODE, meta_data)
+    return meta_data
+
+
+def test_gap_repair_outage_is_not_confirmed(cache_dir, stub_for, monkeypatch):
+    full = _nav_frame(pd.bdate_range('2024-05-06', '2024-06-28'))
+    hole = pd.bdate_range('2024-06-03', '2024-06-14')
+    meta_data = _cache_with_hole(full, hole)
+    stub_for({FUND_CODE: full})
+    _fail_pages(monkeypatch, 1)
+
+    assert not fund_data._repair_cache_gaps(FUND_CODE, meta_data, needs_acc_nav=True)
+
+    cache_meta = fund_data.get_cache_meta(FUND_CODE)
+    assert 'gaps_checked_through' not in cache_meta
+    assert 'confirmed_gap_days' not in cache_meta
+    assert fund_data.find_cache_gaps(fund_data.get_cached_fund_data(FUND_CODE)[0]['date'])
+
+
+def test_gap_repair_confirms_upstream_gap(cache_dir, stub_for):
+    full = _nav_frame(pd.bdate_range('2024-05-06', '2024-06-28'))
+    hole = pd.bdate_range('2024-06-03', '2024-06-14')
+    meta_data = _cache_with_hole(full, hole)
+    # 上游同样没有这些日期的净值
+    stub_for({FUND_CODE: full[~full['date'].isin(hole)].reset_index(drop=True)})
+
+    assert not fund_data._repair_cache_gaps(FUND_CODE, meta_data, needs_acc_nav=True)
+
+    cache_meta = fund_data.get_cache_meta(FUND_CODE)
+    assert cache_meta['gaps_checked_through'] == '2024-06-28'
+    assert cache_meta['confirmed_gap_days'] == len(trading_calendar.trading_days(hole[0], hole[-1]))
+
+
+def test_gap_repair_finds_hole_right_after_checkpoint(cache_dir, stub_for):
+    full = _nav_frame(pd.bdate_range('2024-05-06', '2024-06-26'))
+    meta_data = _cache_with_hole(full, ['2024-06-25'], gaps_checked_through='2024-06-24')
+    stub_for({FUND_CODE: full})
+
+    assert fund_data._repair_cache_gaps(FUND_CODE, meta_data, needs_acc_nav=True)
+
+    cached, _ = fund_data.get_cached_fund_data(FUND_CODE)
+    assert pd.Timestamp('2024-06-25') in set(cached['date'])
+    assert fund_data.find_cache_gaps(cached['date']) == []
+    assert fund_data.get_cache_meta(FUND_CODE)['gaps_checked_through'] == '2024-06-26'
+
+
+def _snapshot_batch(stale_days):
+    """准备SNAPSHOT_MIN_FUNDS只基金的缓存（最后更新于昨天），缓存截止到最晚应有净值日之前stale_days个交易日"""
+    latest = trading_calendar.expected_latest_nav_date('混合型')
+    full = _nav_frame(trading_calendar.trading_days(latest - datetime.timedelta(days=120), latest))
+    codes = [f'{int(FUND_CODE) + i:06d}' for i in range(fund_data.SNAPSHOT_MIN_FUNDS)]
+    last_update = (datetime.datetime.now() - datetime.timedelta(days=1)).strftime('%Y-%m-%d %H:%M:%S')
+    for fund_code in codes:
+        fund_data.save_fund_data_to_cache(fund_code, full.iloc[:len(full) - stale_days].reset_index(drop=True))
+        meta_data = fund_data.get_cache_meta(fund_code)
+        meta_data['last_update'] = last_update
+        fund_data._update_cache_meta(fund_code, meta_data)
+    return full, codes
+
+
+def test_warm_batch_skips_snapshot(cache_dir, stub_for):
+    full, codes = _snapshot_batch(stale_days=0)
+    stub = stub_for({fund_code: full for fund_code in codes})
+
+    results = list(fund_data.get_fund_data_many(codes, with_info=False))
+
+    assert stub.stats['requests'] == 0
+    assert all(len(result['df']) == len(full) for _, result, _ in results)
+
+
+def test_stale_batch_uses_snapshot(cache_dir, stub_for):
+    full, codes = _snapshot_batch(stale_days=1)
+    stub = stub_for({fund_code: full for fund_code in codes})
+
+    fund_data.update_cache_from_snapshot(fund_data._stale_snapshot_candidates(codes))
+
+    assert stub.stats['requests'] == 1
+    for fund_code in codes:
+        assert fund_data.get_cache_meta(fund_code)['date_range']['end'] == full['date'].iloc[-1].strftime('%Y-%m-%d')
+
+
+def _lsjz_page(rows, is_money_fund=False):
+    """按历史净值接口的格式拼出一页响应"""
+    if is_money_fund:
+        head = ("<th class='first'>净值日期</th><th>每万份收益</th><th>7日年化收益率（%）</th>"
+                "<th>申购状态</th><th>赎回状态</th><th class='tor last'>分红送配</th>")
+    else:
+        head = ("<th class='first'>净值日期</th><th>单位净值</th><th>累计净值</th><th>日增长率</th>"
+                "<th>申购状态</th><th>赎回状态</th><th class='tor last'>分红送配</th>")
+    body = ''.join('<tr>' + ''.join(f"<td class='tor bold'>{cell}</td>" for cell in row) + '</tr>' for row in rows)
+    content = f"<table class='w782 comm lsjz'><thead><tr>{head}</tr></thead><tbody>{body}</tbody></table>"
+    return f'var apidata={{ content:"{content}",records:{len(rows)},pages:1,curpage:1}};'
+
+
+@pytest.mark.parametrize('is_money_fund, rows', [
+    (False, [
+        ('2024-06-14', '1.2345', '2.3456', '0.52%', '开放申购', '开放赎回', ''),
+        ('2024-06-13', '1.2281', '2.3392', '', '开放申购', '开放赎回', ''),
+        ('2024-06-12', '1.2302', '2.3413', '-0.17%', '暂停申购', '开放赎回', '每份派现金0.0500元'),
+        ('2024-06-11', '1,230.1000', '1,230.2000*', '0.00%', '开放申购', '开放赎回', ''),
+    ]),
+    (True, [
+        ('2024-06-14', '0.4521', '1.6830%', '开放申购', '开放赎回', ''),
+        ('2024-06-13', '0.4498', '', '开放申购', '开放赎回', ''),
+        ('2024-06-12', '1.3504', '1.6712%', '开放申购', '开放赎回', '每份收益结转'),
+    ]),
+])
+def test_fast_nav_parser_matches_read_html(is_money_fund, rows):
+    text = _lsjz_page(rows, is_money_fund)
+
+    fast = fund_data._parse_nav_table_fast(text, is_money_fund)
+    fallback = fund_data._parse_nav_table_html(text, is_money_fund)
+
+    assert fast is not None
+    assert list(fast.columns) == list(fallback.columns)
+    assert fast.dtypes.to_dict() == fallback.dtypes.to_dict()
+    pd.testing.assert_frame_equal(fast, fallback.reset_index(drop=True))
+    pd.testing.assert_frame_equal(fund_data._parse_nav_page(text, is_money_fund), fast)
+
+
+def test_metric_state_uses_given_fund_info(cache_dir, monkeypatch):
+    df = _nav_frame(pd.bdate_range('2024-01-02', periods=60))
+    fund_data.save_fund_data_to_cache(FUND_CODE, df)
+
+    def get_fund_info(fund_code, **kwargs):
+        raise AssertionError("不应再次获取基金信息")
+    monkeypatch.setattr(fund_data, 'get_fund_info', get_fund_info)
+
+    state = fund_data.get_fund_metric_state(FUND_CODE, {'is_money_fund': False})
+    assert state is not None and state.data_count == len(df)
+    assert fund_data.get_fund_metric_state(FUND_CODE, {'is_money_fund': True}) is None
+
+
+def test_load_cache_rereads_torn_header(cache_dir, monkeypatch):
+    df = _nav_frame(pd.bdate_range('2024-01-02', periods=60))
+    fund_data.save_fund_data_to_cache(FUND_CODE, df)
+    cache_file = fund_data._nav_cache_file(FUND_CODE)
+    with open(cache_file, 'rb') as f:
+        header = f.read(fund_data.NAV_CACHE_HEADER_SIZE)
+    # 模拟并发读取时文件头正被原地重写：前半部分是新内容，后半部分还是旧内容
+    torn = header[:len(fund_data.NAV_CACHE_MAGIC) + 20] + b'\x00' * 8
+    with open(cache_file, 'r+b') as f:
+        f.write(torn)
+
+    def finish_write(seconds):
+        with open(cache_file, 'r+b') as f:
+            f.write(header)
+    monkeypatch.setattr(fund_data.time, 'sleep', finish_write)
+
+    result, meta_data = fund_data._load_cache(FUND_CODE)
+    assert meta_data['data_count'] == len(df)
+    pd.testing.assert_frame_equal(result, df, check_dtype=False)
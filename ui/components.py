@@ -1,12 +1,12 @@
 import streamlit as st
 import plotly.graph_objects as go
 import pandas as pd
-import numpy as np
 import os
 import json
-from datetime import datetime, date
+from datetime import datetime
 
-from src.fund_data import get_fund_data, get_fund_info
+from src.fund_data import get_fund_data, get_fund_info, get_fund_data_many, slice_by_date
+from src.fund_analysis import calculate_fund_summary, calculate_period_metrics, NavRangeIndex
 
 # 自定义CSS样式
 def load_css():
@@ -160,6 +160,28 @@ def load_css():
     </style>
     """, unsafe_allow_html=True)
 
+def get_nav_range_index(df, fund_code):
+    """获取基金净值的区间指标索引：同一份净值数据只构建一次，页面重新运行（切换区间）时复用；
+    数据只是在末尾增加了新净值（例如后台更新完成）时，把新净值追加到已有的索引中"""
+    key = (fund_code, len(df), df['date'].iloc[-1], df['nav'].iloc[-1])
+    cached = st.session_state.get('nav_range_index')
+    if cached is not None and cached[0] == key:
+        return cached[1]
+    
+    if cached is not None:
+        cached_code, cached_len, cached_date, cached_nav = cached[0]
+        range_index = cached[1]
+        if (cached_code == fund_code and cached_len < len(df)
+                and df['date'].iloc[0] == pd.Timestamp(range_index.dates[0])
+                and df['date'].iloc[cached_len - 1] == cached_date and df['nav'].iloc[cached_len - 1] == cached_nav):
+            range_index.append(df['date'].iloc[cached_len:], df['nav'].iloc[cached_len:])
+            st.session_state.nav_range_index = (key, range_index)
+            return range_index
+    
+    range_index = NavRangeIndex(df['date'], df['nav'])
+    st.session_state.nav_range_index = (key, range_index)
+    return range_index
+
 def display_fund_analysis(df, fund_info, show_header=True):
     """显示基金分析内容"""
     if show_header:
@@ -284,63 +306,42 @@ def display_fund_analysis(df, fund_info, show_header=True):
     st.markdown('<h2 class="section-header">基金统计信息</h2>', unsafe_allow_html=True)
     
     # 计算统计指标
-    latest_date = df['date'].max()
-    latest_nav = df['nav'].iloc[-1]
-    establishment_date = df['date'].min()
+    summary = calculate_fund_summary(df, is_money_fund)
+    latest_date = summary['latest_date']
+    latest_nav = summary['latest_nav']
+    establishment_date = summary['establishment_date']
     
     if is_money_fund:
-        # 计算七日年化收益率
-        last_7_days = df[df['date'] > latest_date - pd.Timedelta(days=7)]['nav']
-        seven_day_sum = last_7_days.sum()
-        seven_day_return = (seven_day_sum / 10000) * 100  # 七日累计收益率
-        seven_day_annual = (pow(1 + seven_day_return/100, 365/7) - 1) * 100  # 七日年化收益率
-        
-        # 计算历史七日年化收益率序列
-        df['rolling_7day_sum'] = df['nav'].rolling(window=7).sum()
-        df['rolling_7day_return'] = (df['rolling_7day_sum'] / 10000) * 100
-        df['rolling_7day_annual'] = (pow(1 + df['rolling_7day_return']/100, 365/7) - 1) * 100
-        
-        max_7day_annual = df['rolling_7day_annual'].max()
-        min_7day_annual = df['rolling_7day_annual'].min()
-        
         # 显示统计信息
         col1, col2, col3, col4 = st.columns(4)
         with col1:
             st.metric(f"最新每万份收益（{latest_date.strftime('%Y-%m-%d')}）", f"{latest_nav:.4f}元")
         with col2:
-            st.metric("七日年化收益率", f"{seven_day_annual:.2f}%")
+            st.metric("七日年化收益率", f"{summary['seven_day_annual']:.2f}%")
         with col3:
-            st.metric(f"历史最高七日年化（{df.loc[df['rolling_7day_annual'].idxmax(), 'date'].strftime('%Y-%m-%d')}）", f"{max_7day_annual:.2f}%")
+            st.metric(f"历史最高七日年化（{summary['max_7day_annual_date'].strftime('%Y-%m-%d')}）", f"{summary['max_7day_annual']:.2f}%")
         with col4:
-            st.metric(f"历史最低七日年化（{df.loc[df['rolling_7day_annual'].idxmin(), 'date'].strftime('%Y-%m-%d')}）", f"{min_7day_annual:.2f}%")
+            st.metric(f"历史最低七日年化（{summary['min_7day_annual_date'].strftime('%Y-%m-%d')}）", f"{summary['min_7day_annual']:.2f}%")
         
         # 显示额外的统计信息
         st.markdown("---")
         st.markdown(f"**基金成立日期：** {establishment_date.strftime('%Y-%m-%d')}")
         st.markdown(f"**最新数据日期：** {latest_date.strftime('%Y-%m-%d')}")
     else:
-        # 非货币基金的原有统计逻辑
-        nav_change = (df['nav'].iloc[-1] / df['nav'].iloc[0] - 1) * 100
-        max_nav = df['nav'].max()
-        max_nav_date = df[df['nav'] == max_nav]['date'].iloc[0]
-        min_nav = df['nav'].min()
-        min_nav_date = df[df['nav'] == min_nav]['date'].iloc[0]
-        total_return = ((df['nav'].iloc[-1] / df['nav'].iloc[0]) - 1) * 100
-        
         col1, col2, col3, col4 = st.columns(4)
         with col1:
             st.metric(f"最新净值（{latest_date.strftime('%Y-%m-%d')}）", f"{latest_nav:.4f}")
         with col2:
-            st.metric("累计收益（最新净值/首日净值-1）", f"{nav_change:.2f}%")
+            st.metric("累计收益（最新净值/首日净值-1）", f"{summary['nav_change']:.2f}%")
         with col3:
-            st.metric(f"历史最高（{max_nav_date.strftime('%Y-%m-%d')}）", f"{max_nav:.4f}")
+            st.metric(f"历史最高（{summary['max_nav_date'].strftime('%Y-%m-%d')}）", f"{summary['max_nav']:.4f}")
         with col4:
-            st.metric(f"历史最低（{min_nav_date.strftime('%Y-%m-%d')}）", f"{min_nav:.4f}")
+            st.metric(f"历史最低（{summary['min_nav_date'].strftime('%Y-%m-%d')}）", f"{summary['min_nav']:.4f}")
         
         st.markdown("---")
         st.markdown(f"**基金成立日期：** {establishment_date.strftime('%Y-%m-%d')}")
         st.markdown(f"**最新数据日期：** {latest_date.strftime('%Y-%m-%d')}")
-        st.markdown(f"**成立至今累计收益：** {total_return:.2f}%")
+        st.markdown(f"**成立至今累计收益：** {summary['total_return']:.2f}%")
     
     # 添加基金投资天数指标分析
     st.markdown('<h2 class="section-header">基金投资天数指标分析</h2>', unsafe_allow_html=True)
@@ -402,23 +403,24 @@ def display_fund_analysis(df, fund_info, show_header=True):
     start_date = pd.to_datetime(start_date)
     end_date = pd.to_datetime(end_date)
     
-    # 获取选定期间的数据
-    mask = (df['date'] >= start_date) & (df['date'] <= end_date)
-    period_df = df.loc[mask].copy()
+    # 获取选定期间的数据（按日期二分定位，不构造整段历史的布尔掩码）
+    period_df = slice_by_date(df, start_date, end_date)
+    
+    # 计算区间指标
+    metrics = None
+    if not period_df.empty and start_date <= end_date:
+        range_index = get_nav_range_index(df, fund_info.get('fund_code'))
+        metrics = calculate_period_metrics(period_df, start_date, end_date, is_money_fund, range_index)
     
     # 在投资区间信息上方添加两个图表：收益率曲线图和单位净值曲线图
-    if not period_df.empty and start_date <= end_date and not is_money_fund:
+    if metrics is not None and not is_money_fund:
         # 1. 收益率曲线图（从起始日期0%开始，用累计净值计算）
-        if 'acc_nav' in period_df.columns and not period_df['acc_nav'].isna().all():
-            # 计算累计收益率曲线
-            start_acc_nav = period_df['acc_nav'].iloc[0]
-            period_df['return_rate'] = (period_df['acc_nav'] / start_acc_nav - 1) * 100
-            
+        if metrics['return_uses_acc_nav']:
             # 绘制收益率曲线图
             fig_return = go.Figure()
             fig_return.add_trace(go.Scatter(
                 x=period_df['date'],
-                y=period_df['return_rate'],
+                y=metrics['return_rate'],
                 mode='lines',
                 name='收益率曲线',
                 line=dict(color='#ff7f0e', width=2)
@@ -436,14 +438,11 @@ def display_fund_analysis(df, fund_info, show_header=True):
             st.plotly_chart(fig_return, use_container_width=True)
         else:
             # 如果没有累计净值数据，则使用单位净值
-            start_nav = period_df['nav'].iloc[0]
-            period_df['return_rate'] = (period_df['nav'] / start_nav - 1) * 100
-            
             # 绘制收益率曲线图
             fig_return = go.Figure()
             fig_return.add_trace(go.Scatter(
                 x=period_df['date'],
-                y=period_df['return_rate'],
+                y=metrics['return_rate'],
                 mode='lines',
                 name='收益率曲线 (使用单位净值计算)',
                 line=dict(color='#ff7f0e', width=2)
@@ -479,16 +478,14 @@ def display_fund_analysis(df, fund_info, show_header=True):
         )
         st.plotly_chart(fig_nav, use_container_width=True)
     
-    if not period_df.empty and start_date <= end_date:
-        # 计算投资天数
-        trading_days = len(period_df)
-        calendar_days = (end_date - start_date).days + 1
+    if metrics is not None:
+        # 投资天数
+        trading_days = metrics['trading_days']
+        calendar_days = metrics['calendar_days']
         
         if is_money_fund:
-            # 计算货币基金的收益指标
-            total_income = period_df['nav'].sum()  # 区间内每日万份收益之和
-            cumulative_return = (total_income / 10000) * 100  # 累计收益率
-            annual_return = (pow(1 + cumulative_return/100, 365/calendar_days) - 1) * 100  # 年化收益率
+            cumulative_return = metrics['cumulative_return']
+            annual_return = metrics['annual_return']
             
             # 显示指标分析结果
             st.markdown("### 投资区间基本信息")
@@ -503,25 +500,16 @@ def display_fund_analysis(df, fund_info, show_header=True):
                 st.metric("区间累计收益率", f"{cumulative_return:.2f}%",
                         help="累计收益率 = (区间内每日万份收益之和/10000) × 100%")
         else:
-            # 非货币基金的原有计算逻辑
-            period_return = (period_df['nav'].iloc[-1] / period_df['nav'].iloc[0] - 1) * 100
-            annual_return = (pow(1 + period_return/100, 252/trading_days) - 1) * 100
-            
-            # 计算风险类指标
-            period_df['daily_return'] = period_df['nav'].pct_change()
-            # 计算区间波动率
-            mean_return = period_df['daily_return'].mean()
-            volatility = np.sqrt(((period_df['daily_return'] - mean_return) ** 2).sum() / (trading_days - 1)) * 100
-            
-            period_df['rolling_max'] = period_df['nav'].expanding().max()
-            period_df['drawdown'] = (period_df['nav'] - period_df['rolling_max']) / period_df['rolling_max'] * 100
-            max_drawdown = abs(period_df['drawdown'].min())
+            period_return = metrics['period_return']
+            annual_return = metrics['annual_return']
+            volatility = metrics['volatility']
+            max_drawdown = metrics['max_drawdown']
             
             # 显示指标分析结果
             st.markdown("### 投资区间基本信息")
             st.markdown(f"- **投资天数：** {calendar_days}天（其中交易日{trading_days}天）")
-            st.markdown(f"- **区间起始净值：** {period_df['nav'].iloc[0]:.4f}")
-            st.markdown(f"- **区间结束净值：** {period_df['nav'].iloc[-1]:.4f}")
+            st.markdown(f"- **区间起始净值：** {metrics['start_nav']:.4f}")
+            st.markdown(f"- **区间结束净值：** {metrics['end_nav']:.4f}")
             
             st.markdown("### 收益类指标")
             col1, col2 = st.columns(2)
@@ -968,6 +956,54 @@ def add_edit_fund_form(is_edit=False, fund_index=None, fund_code=None, skip_inpu
                     import traceback
                     st.error(traceback.format_exc())
 
+def _update_portfolio_item(fund_item, fund_info, df):
+    """根据最新的基金信息和净值数据计算持仓的最新市值和盈亏"""
+    latest_data = df.iloc[-1] if not df.empty else None
+    if latest_data is None:
+        # 如果获取不到最新数据，保留原数据
+        return fund_item
+    
+    # 更新净值和盈亏信息
+    # 确保DWJZ键存在，如果不存在尝试使用'nav'
+    net_value = 0
+    if 'DWJZ' in latest_data:
+        net_value = float(latest_data['DWJZ'])
+    elif 'nav' in latest_data:
+        net_value = float(latest_data['nav'])
+    
+    purchase_amount = fund_item.get('amount', 0)
+    shares = fund_item.get('shares', 0)
+    cost_per_unit = fund_item.get('cost_per_unit', 0)
+    
+    # 如果有持仓成本单价，但没有份额数据，重新计算份额
+    if shares == 0 and cost_per_unit > 0:
+        shares = purchase_amount / cost_per_unit
+    # 如果没有持仓成本单价，但有份额数据，计算成本单价
+    elif shares > 0 and cost_per_unit == 0:
+        cost_per_unit = purchase_amount / shares
+    # 如果两者都没有，并且有净值数据，使用净值计算
+    elif shares == 0 and cost_per_unit == 0 and net_value > 0:
+        shares = purchase_amount / net_value
+        cost_per_unit = net_value
+    
+    current_value = shares * net_value
+    profit = current_value - purchase_amount
+    profit_percentage = (profit / purchase_amount * 100) if purchase_amount > 0 else 0
+    
+    # 更新基金数据
+    updated_fund = fund_item.copy()
+    updated_fund.update({
+        'fund_name': fund_info.get('fund_name', fund_item.get('fund_name', '未知基金')),
+        'net_value': net_value,
+        'shares': shares,
+        'cost_per_unit': cost_per_unit,  # 保留持仓成本单价
+        'current_value': current_value,
+        'profit': profit,
+        'profit_percentage': profit_percentage,
+        'update_time': datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+    })
+    return updated_fund
+
 def refresh_portfolio_data():
     """刷新所有基金持仓的最新数据"""
     if 'portfolio' not in st.session_state or not st.session_state.portfolio:
@@ -975,74 +1011,35 @@ def refresh_portfolio_data():
         return
     
     with st.spinner("正在刷新基金持仓数据..."):
-        updated_portfolio = []
-        total_funds = len(st.session_state.portfolio)
+        results = {}
+        fund_codes = [fund_item.get('fund_code') for fund_item in st.session_state.portfolio]
+        total_funds = len(set(fund_codes))
         progress_bar = st.progress(0)
         
-        for i, fund_item in enumerate(st.session_state.portfolio):
+        # 并行获取最新的基金信息和净值数据，按完成顺序更新进度
+        for i, (fund_code, result, error) in enumerate(get_fund_data_many(fund_codes)):
+            if error is None:
+                st.write(f"已更新 ({i+1}/{total_funds}): {fund_code}")
+                results[fund_code] = result
+            else:
+                st.error(f"刷新基金 {fund_code} 时出错: {str(error)}")
+            
+            # 更新进度
+            progress_bar.progress((i + 1) / total_funds)
+        
+        # 按原有顺序更新持仓，刷新失败的基金保留原有数据
+        updated_portfolio = []
+        for fund_item in st.session_state.portfolio:
+            result = results.get(fund_item.get('fund_code'))
+            if result is None:
+                updated_portfolio.append(fund_item)
+                continue
             try:
-                fund_code = fund_item.get('fund_code')
-                st.write(f"正在更新 ({i+1}/{total_funds}): {fund_code}")
-                
-                # 获取最新的基金信息和净值数据
-                fund_info = get_fund_info(fund_code)
-                df = get_fund_data(fund_code)
-                latest_data = df.iloc[-1] if not df.empty else None
-                
-                if latest_data is not None:
-                    # 更新净值和盈亏信息
-                    # 确保DWJZ键存在，如果不存在尝试使用'nav'
-                    net_value = 0
-                    if 'DWJZ' in latest_data:
-                        net_value = float(latest_data['DWJZ'])
-                    elif 'nav' in latest_data:
-                        net_value = float(latest_data['nav'])
-                    
-                    purchase_amount = fund_item.get('amount', 0)
-                    shares = fund_item.get('shares', 0)
-                    cost_per_unit = fund_item.get('cost_per_unit', 0)
-                    
-                    # 如果有持仓成本单价，但没有份额数据，重新计算份额
-                    if shares == 0 and cost_per_unit > 0:
-                        shares = purchase_amount / cost_per_unit
-                    # 如果没有持仓成本单价，但有份额数据，计算成本单价
-                    elif shares > 0 and cost_per_unit == 0:
-                        cost_per_unit = purchase_amount / shares
-                    # 如果两者都没有，并且有净值数据，使用净值计算
-                    elif shares == 0 and cost_per_unit == 0 and net_value > 0:
-                        shares = purchase_amount / net_value
-                        cost_per_unit = net_value
-                    
-                    current_value = shares * net_value
-                    profit = current_value - purchase_amount
-                    profit_percentage = (profit / purchase_amount * 100) if purchase_amount > 0 else 0
-                    
-                    # 更新基金数据
-                    updated_fund = fund_item.copy()
-                    updated_fund.update({
-                        'fund_name': fund_info.get('fund_name', fund_item.get('fund_name', '未知基金')),
-                        'net_value': net_value,
-                        'shares': shares,
-                        'cost_per_unit': cost_per_unit,  # 保留持仓成本单价
-                        'current_value': current_value,
-                        'profit': profit,
-                        'profit_percentage': profit_percentage,
-                        'update_time': datetime.now().strftime('%Y-%m-%d %H:%M:%S')
-                    })
-                    updated_portfolio.append(updated_fund)
-                else:
-                    # 如果获取不到最新数据，保留原数据
-                    updated_portfolio.append(fund_item)
-                
-                # 更新进度
-                progress_bar.progress((i + 1) / total_funds)
-                
+                updated_portfolio.append(_update_portfolio_item(fund_item, result['fund_info'], result['df']))
             except Exception as e:
-                st.error(f"刷新基金 {fund_code} 时出错: {str(e)}")
+                st.warning(f"更新基金 {fund_item.get('fund_code')} 的持仓数据时出错: {str(e)}")
                 # 保留原有数据
                 updated_portfolio.append(fund_item)
-                # 更新进度
-                progress_bar.progress((i + 1) / total_funds)
         
         # 完成进度条
         progress_bar.progress(1.0)
@@ -1052,4 +1049,4 @@ def refresh_portfolio_data():
         # 保存到文件
         save_portfolio(updated_portfolio)
         st.success("基金持仓数据更新完成！")
-        st.rerun()
\ No newline at end of file
+        st.rerun()
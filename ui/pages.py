@@ -4,7 +4,7 @@ import json
 import pandas as pd
 from datetime import datetime
 
-from src.fund_data import get_fund_data, get_fund_info
+from src.fund_data import get_fund_info, get_fund_data_many, get_fund_data_stale, get_fund_metric_state
 from ui.components import display_fund_analysis
 
 # 从本地文件加载自选基金数据
@@ -106,19 +106,40 @@ def fund_query_page():
     
     if st.session_state.fund_code:
         try:
-            # 获取基金数据（如果还没有获取）
+            # 获取基金数据（如果还没有获取）：有缓存时先显示缓存数据，增量更新在后台进行
             if st.session_state.fund_data is None:
                 with st.spinner("正在获取基金数据..."):
-                    df = get_fund_data(st.session_state.fund_code)
+                    df, future = get_fund_data_stale(st.session_state.fund_code)
                     fund_info = get_fund_info(st.session_state.fund_code)
                     st.session_state.fund_data = {
                         'df': df,
                         'fund_info': fund_info
                     }
+                    st.session_state.fund_data_future = (st.session_state.fund_code, future) if future is not None else None
             else:
                 df = st.session_state.fund_data['df']
                 fund_info = st.session_state.fund_data['fund_info']
             
+            # 检查后台更新是否完成，完成后用最新数据替换缓存数据
+            pending = st.session_state.get('fund_data_future')
+            if pending is not None:
+                pending_code, future = pending
+                if pending_code != st.session_state.fund_code:
+                    st.session_state.fund_data_future = None
+                elif future.done():
+                    st.session_state.fund_data_future = None
+                    try:
+                        new_df = future.result()
+                    except Exception as e:
+                        new_df = None
+                        print(f"后台更新基金数据时发生错误: {str(e)}")
+                    if new_df is not None and not new_df.empty and not new_df.equals(df):
+                        df = new_df
+                        st.session_state.fund_data['df'] = df
+                        st.toast("已获取最新的基金净值数据", icon="🔄")
+                else:
+                    st.caption("正在后台检查最新净值，页面刷新后将显示最新数据")
+            
             if not df.empty:
                 # 显示基金分析内容
                 display_fund_analysis(df, fund_info)
@@ -140,41 +161,29 @@ def refresh_favorite_funds():
         total_funds = len(st.session_state.favorite_funds)
         progress_bar = st.progress(0)
         
-        for i, fund_code in enumerate(st.session_state.favorite_funds):
-            try:
-                st.write(f"正在更新 ({i+1}/{total_funds}): {fund_code}")
-                
-                # 获取最新的基金信息
-                fund_info = get_fund_info(fund_code)
-                
-                # 获取最新的净值数据（依赖缓存智能更新机制）
-                # 这会自动检查缓存并只获取新数据
-                df = get_fund_data(fund_code)
-                
-                # 保存更新时间
-                last_update = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
-                
-                # 更新基金信息
+        # 并行获取最新的基金信息和净值数据（依赖缓存智能更新机制，只获取新数据），按完成顺序更新进度
+        for i, (fund_code, result, error) in enumerate(get_fund_data_many(list(st.session_state.favorite_funds))):
+            if error is None:
+                st.write(f"已更新 ({i+1}/{total_funds}): {fund_code}")
+                # 更新基金信息和更新时间
                 updated_funds[fund_code] = {
-                    'fund_info': fund_info,
-                    'last_update': last_update
+                    'fund_info': result['fund_info'],
+                    'last_update': datetime.now().strftime('%Y-%m-%d %H:%M:%S')
                 }
-                
-                # 更新进度
-                progress_bar.progress((i + 1) / total_funds)
-                
-            except Exception as e:
-                st.error(f"刷新基金 {fund_code} 时出错: {str(e)}")
-                # 保留原有数据
-                updated_funds[fund_code] = st.session_state.favorite_funds[fund_code]
-                # 更新进度
-                progress_bar.progress((i + 1) / total_funds)
+            else:
+                st.error(f"刷新基金 {fund_code} 时出错: {str(error)}")
+            
+            # 更新进度
+            progress_bar.progress((i + 1) / total_funds)
         
         # 完成进度条
         progress_bar.progress(1.0)
         
-        # 更新session_state中的数据
-        st.session_state.favorite_funds = updated_funds
+        # 按原有顺序更新session_state中的数据，刷新失败的基金保留原有数据
+        st.session_state.favorite_funds = {
+            fund_code: updated_funds.get(fund_code, fund_data)
+            for fund_code, fund_data in st.session_state.favorite_funds.items()
+        }
         # 保存到文件
         save_favorite_funds()
         st.success("自选基金数据更新完成！")
@@ -238,6 +247,18 @@ def favorite_funds_page():
                             else:
                                 is_buy = "未知"
                             
+                            # 主要指标来自随缓存增量更新的指标状态，读取开销与历史长度无关
+                            metrics_row = ""
+                            metric_state = get_fund_metric_state(fund_code, fund_data['fund_info'])
+                            if metric_state is not None and metric_state.count:
+                                headline = metric_state.headline()
+                                metrics_row = f"""
+                                <div class="info-row">
+                                    <span>净值：{headline['latest_nav']:.4f}（{headline['latest_date']}）</span>
+                                    <span>累计：{headline['total_return']:.2f}%</span>
+                                    <span>最大回撤：{headline['max_drawdown']:.2f}%</span>
+                                </div>"""
+                            
                             st.markdown(f"""
                             <div class="fund-card">
                                 <h4 title="{fund_name}">{fund_name}</h4>
@@ -248,7 +269,7 @@ def favorite_funds_page():
                                 <div class="info-row">
                                     <span>基金经理：{fund_manager}</span>
                                     <span>{is_buy}</span>
-                                </div>
+                                </div>{metrics_row}
                                 <p class="update-time">更新时间：{fund_data['last_update']}</p>
                             </div>
                             """, unsafe_allow_html=True)